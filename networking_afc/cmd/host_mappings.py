@@ -0,0 +1,119 @@
+"""Manage the host to switch interface mappings of the CX switches.
+
+    neutron-afc-host-mappings --config-file /etc/neutron/neutron.conf \
+        --config-file /etc/neutron/plugins/ml2/ml2_conf.ini <command>
+
+Commands:
+
+    sync                  replace all mappings with the config sections
+    list [--host-id H]    print the mappings, of one host if given
+    load FILE [--all]     load mappings from a JSON file, see below
+    delete SWITCH_IP [--host-id H]
+                          delete the mappings of a switch, or of one host
+
+The JSON file has the format of the ``ml2_mech_aster_cx`` sections:
+
+    {"192.168.4.102": {"physnet": "provider",
+                       "host_ports_mapping": {"compute1": ["X29"]}}}
+
+``load`` replaces the mappings of the switches in the file, with ``--all``
+the mappings of the other switches are deleted.
+
+Set [aster_db] sync_host_mappings to False when managing the mappings with
+this command, otherwise the next neutron-server start replaces them with the
+config sections again.
+"""
+
+import json
+import sys
+
+from neutron.common import config as common_config
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+
+from networking_afc._i18n import _
+from networking_afc.common import config
+from networking_afc.db import host_mappings
+from networking_afc.db.models import aster_models_v2
+
+
+def _print_counts(added, updated, removed):
+    print(_("%(added)d added, %(updated)d updated, %(removed)d removed") %
+          {'added': added, 'updated': updated, 'removed': removed})
+
+
+def do_sync(conf):
+    mappings = host_mappings.mappings_from_switch_infos(
+        config.cx_switches())
+    _print_counts(*host_mappings.replace_host_mappings(mappings))
+
+
+def do_list(conf):
+    model = aster_models_v2.AsterCxHostMapping
+    session = lib_db_api.get_reader_session()
+    with session.begin():
+        query = session.query(model.switch_ip, model.host_id,
+                              model.physical_network,
+                              model.switch_interfaces)
+        if conf.command.host_id:
+            query = query.filter(model.host_id == conf.command.host_id)
+        for row in query.order_by(model.switch_ip, model.host_id):
+            print("\t".join(row))
+
+
+def do_load(conf):
+    with open(conf.command.file) as mappings_file:
+        switch_infos = json.load(mappings_file)
+    mappings = host_mappings.mappings_from_switch_infos(switch_infos)
+    switch_ips = None if conf.command.all else switch_infos.keys()
+    _print_counts(*host_mappings.replace_host_mappings(
+        mappings, switch_ips=switch_ips))
+
+
+def do_delete(conf):
+    model = aster_models_v2.AsterCxHostMapping
+    session = lib_db_api.get_writer_session()
+    with session.begin():
+        query = session.query(model).filter(
+            model.switch_ip == conf.command.switch_ip)
+        if conf.command.host_id:
+            query = query.filter(model.host_id == conf.command.host_id)
+        removed = query.delete(synchronize_session=False)
+    _print_counts(0, 0, removed)
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser(
+        'sync', help=_('Replace all mappings with the config sections.'))
+    parser.set_defaults(func=do_sync)
+
+    parser = subparsers.add_parser('list', help=_('Print the mappings.'))
+    parser.add_argument('--host-id')
+    parser.set_defaults(func=do_list)
+
+    parser = subparsers.add_parser(
+        'load', help=_('Load the mappings of switches from a JSON file.'))
+    parser.add_argument('file')
+    parser.add_argument('--all', action='store_true',
+                        help=_('Delete the mappings of switches missing '
+                               'from the file.'))
+    parser.set_defaults(func=do_load)
+
+    parser = subparsers.add_parser(
+        'delete', help=_('Delete the mappings of a switch.'))
+    parser.add_argument('switch_ip')
+    parser.add_argument('--host-id')
+    parser.set_defaults(func=do_delete)
+
+
+command_opt = cfg.SubCommandOpt('command',
+                                title=_('Command'),
+                                help=_('Available commands'),
+                                handler=add_command_parsers)
+
+
+def main():
+    cfg.CONF.register_cli_opt(command_opt)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    cfg.CONF.command.func(cfg.CONF)
@@ -0,0 +1,99 @@
+"""Back-fill legacy port binding rows on a live database.
+
+    neutron-afc-migrate-port-bindings --config-file /etc/neutron/neutron.conf \
+        --config-file /etc/neutron/plugins/ml2/ml2_conf.ini \
+        [--batch-size 500] [--batch-interval 0.5] [--start-after ID]
+
+Each batch of rows is committed on its own and followed by a pause of
+--batch-interval seconds, so the tool can run while neutron-server serves
+requests. It can be interrupted at any time and resumed with the printed
+--start-after, or simply run again. Run it before the contract migration,
+which otherwise migrates the remaining rows while neutron-server is down.
+See networking_afc.db.migration.port_binding_data.
+"""
+
+import sys
+import time
+
+from neutron.common import config as common_config
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+
+from networking_afc._i18n import _
+from networking_afc.db.migration import port_binding_data
+
+
+cli_opts = [
+    cfg.IntOpt('batch-size',
+               default=port_binding_data.DEFAULT_BATCH_SIZE,
+               min=1,
+               help=_('Number of rows migrated in one transaction.')),
+    cfg.FloatOpt('batch-interval',
+                 default=0.5,
+                 min=0,
+                 help=_('Seconds to sleep between two batches.')),
+    cfg.IntOpt('start-after',
+               default=0,
+               min=0,
+               help=_('Resume after the binding with this binding_id.')),
+]
+
+
+def migrate(engine, batch_size, batch_interval, after_id=0, out=sys.stdout):
+    """Migrate all bindings after ``after_id``, reporting progress.
+
+    :returns: the ids of the bindings with an invalid vlan_id
+    :raises MissingSwitchPhysnets: when no switch physical network is
+        known
+    """
+    with engine.connect() as connection:
+        total = port_binding_data.count_bindings(connection, after_id)
+        physnets = port_binding_data.load_switch_physnets(connection,
+                                                          after_id)
+    scanned = updated = deleted = unresolved = 0
+    invalid = []
+    start = time.time()
+    while True:
+        with engine.begin() as connection:
+            result = port_binding_data.migrate_batch(connection, after_id,
+                                                     batch_size, physnets)
+        if result is None:
+            break
+        after_id = result.last_id
+        scanned += result.scanned
+        updated += result.updated
+        deleted += result.deleted
+        unresolved += result.unresolved
+        invalid.extend(result.invalid)
+        out.write(_("%(scanned)d/%(total)d rows scanned (%(rate).0f/s), "
+                    "%(updated)d updated, %(deleted)d deleted, "
+                    "%(unresolved)d unresolved, %(invalid)d invalid; "
+                    "resume with --start-after %(after_id)d\n") %
+                  {'scanned': scanned, 'total': total,
+                   'rate': scanned / max(time.time() - start, 0.001),
+                   'updated': updated, 'deleted': deleted,
+                   'unresolved': unresolved, 'invalid': len(invalid),
+                   'after_id': after_id})
+        out.flush()
+        if batch_interval:
+            time.sleep(batch_interval)
+    return invalid
+
+
+def main():
+    cfg.CONF.register_cli_opts(cli_opts)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    engine = lib_db_api.get_context_manager().writer.get_engine()
+    try:
+        invalid = migrate(engine, cfg.CONF.batch_size,
+                          cfg.CONF.batch_interval, cfg.CONF.start_after)
+    except port_binding_data.MissingSwitchPhysnets as ex:
+        sys.stderr.write("%s\n" % ex)
+        return 1
+    if invalid:
+        sys.stdout.write(_("Bindings with an invalid vlan_id, the contract "
+                           "migration fails until they are fixed or "
+                           "deleted: %s\n") % invalid)
+        return 1
+    return 0
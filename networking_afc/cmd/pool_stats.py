@@ -0,0 +1,66 @@
+"""Print the allocation counters of the Aster VNI and VLAN pools.
+
+    neutron-afc-pool-stats --config-file /etc/neutron/neutron.conf \
+        [--pool l3_vni] [--min-free-percent 10]
+
+Prints one line per pool: name, total, allocated, free and the IDs still
+allocated outside of the configured ranges. The counters are read from
+``ml2_aster_pool_counters``, the allocation tables are not scanned, so the
+command is cheap enough for monitoring checks: with --min-free-percent it
+exits with status 1 when a pool has less free IDs left.
+"""
+
+import sys
+
+from neutron.common import config as common_config
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+
+from networking_afc._i18n import _
+from networking_afc.db import pool_stats
+
+
+cli_opts = [
+    cfg.StrOpt('pool',
+               help=_('Only print this pool, for example l3_vni or '
+                      'border_vlan:192.168.4.102.')),
+    cfg.FloatOpt('min-free-percent',
+                 min=0,
+                 max=100,
+                 help=_('Exit with status 1 when a pool has less than this '
+                        'percentage of its IDs free.')),
+]
+
+
+def print_stats(pools, min_free_percent=None, out=sys.stdout):
+    """Print the counters of ``pools``.
+
+    :returns: the names of the pools with less than ``min_free_percent``
+        of their IDs free
+    """
+    low = []
+    out.write("pool\ttotal\tallocated\tfree\toutside_allocated\n")
+    for stats in pools:
+        out.write("%(pool)s\t%(total)d\t%(allocated)d\t%(free)d\t"
+                  "%(outside_allocated)d\n" % stats)
+        if (min_free_percent is not None and
+                stats['free'] * 100.0 < min_free_percent * stats['total']):
+            low.append(stats['pool'])
+    return low
+
+
+def main():
+    cfg.CONF.register_cli_opts(cli_opts)
+    common_config.init(sys.argv[1:])
+    common_config.setup_logging()
+    session = lib_db_api.get_reader_session()
+    with session.begin():
+        pools = pool_stats.get_stats(session, pool=cfg.CONF.pool)
+    low = print_stats(pools, cfg.CONF.min_free_percent)
+    if low:
+        sys.stdout.write(_("Pools with less than %(percent)s%% of their IDs "
+                           "free: %(pools)s\n") %
+                         {'percent': cfg.CONF.min_free_percent,
+                          'pools': ", ".join(low)})
+        return 1
+    return 0
@@ -1,9 +1,13 @@
 import json
+import time
 
 from oslo_log import log
 from oslo_config import cfg
 
 from networking_afc.common import config as conf
+from networking_afc.common import log_utils
+from networking_afc.common import metrics
+from networking_afc.common import scheduler
 from networking_afc.common.neutronclient.v2_0 import client
 from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
 
@@ -11,11 +15,33 @@ from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
 
+# Longest wait between two retries of a request
+MAX_RETRY_INTERVAL = 30
+
+# Operation kind and resource type of each endpoint, queued operations on
+# the same resource are compacted by the scheduler
+_ENDPOINT_OPERATIONS = {
+    "neutron_create_network": (scheduler.OP_CREATE, "network"),
+    "neutron_delete_network": (scheduler.OP_DELETE, "network"),
+    # Creating a router interface creates or updates the vrf
+    "neutron_create_router": (scheduler.OP_UPDATE, "router"),
+    "neutron_delete_router": (scheduler.OP_DELETE, "router"),
+}
+
+
+def _resource_key(resource, switch_ip, body):
+    if resource == "network":
+        return (resource, switch_ip, body.get("vni"), body.get("vlan_id"),
+                tuple(sorted(body.get("interfaces") or ())))
+    return (resource, switch_ip, body.get("router_vni"),
+            body.get("l2_vni"), body.get("vlan_id"))
+
 
 class AfcRestClient(object):
 
     def __init__(self):
         self.is_send_afc = conf.cfg.CONF.aster_authtoken.is_send_afc
+        metrics.start_exporter()
 
     @staticmethod
     def get_neutron_client():
@@ -27,17 +53,90 @@ class AfcRestClient(object):
         )
         return neutron
 
+    @staticmethod
+    def _call_afc(endpoint, switch_ip, func, *args, **kwargs):
+        """Call one AFC endpoint, recording latency and outcome metrics."""
+        labels = (endpoint, switch_ip)
+        body = kwargs.get("body")
+        # Serializing the body again is only worth it when it is exported
+        bytes_sent = len(json.dumps(body)) if body and metrics.enabled() \
+            else 0
+        max_retries = CONF.aster_afc.request_retries
+        retries = 0
+        status = "error"
+        request_ids = []
+        metrics.AFC_IN_FLIGHT.inc(*labels)
+        start = time.time()
+        try:
+            while True:
+                if bytes_sent:
+                    metrics.AFC_BYTES_SENT.inc(*labels, amount=bytes_sent)
+                try:
+                    result = func(*args, **kwargs)
+                except client.exceptions.ConnectionFailed:
+                    if retries >= max_retries:
+                        status = "connection_failed"
+                        raise
+                    interval = min(
+                        CONF.aster_afc.request_retry_interval * 2 ** retries,
+                        MAX_RETRY_INTERVAL)
+                    retries += 1
+                    metrics.AFC_RETRIES.inc(*labels)
+                    LOG.debug("Retrying AFC %s request to switch %s in "
+                              "%.1fs", endpoint, switch_ip, interval)
+                    time.sleep(interval)
+                    continue
+                except Exception as exc:
+                    status = getattr(exc, "status_code", None) or "error"
+                    request_ids = getattr(exc, "request_ids", None) or []
+                    raise
+                status = 200
+                request_ids = getattr(result, "request_ids", None) or []
+                return result
+        finally:
+            elapsed = time.time() - start
+            metrics.AFC_IN_FLIGHT.dec(*labels)
+            metrics.AFC_REQUEST_LATENCY.observe(elapsed, *labels)
+            metrics.AFC_REQUESTS.inc(*(labels + (status,)))
+            threshold = CONF.aster_afc.slow_request_threshold
+            if threshold and elapsed > threshold:
+                LOG.warning("Slow AFC %(endpoint)s request to switch "
+                            "%(switch_ip)s took %(elapsed).3fs, status "
+                            "%(status)s, retries %(retries)d, request_ids "
+                            "%(request_ids)s",
+                            {'endpoint': endpoint, 'switch_ip': switch_ip,
+                             'elapsed': elapsed, 'status': status,
+                             'retries': retries,
+                             'request_ids': request_ids})
+
     def get_switch_id_by_ip(self, switch_ip=None):
         neutron_client = self.get_neutron_client()
-        devices = neutron_client.\
-            list_devices(ip_address=switch_ip).get("devices")
+        devices = self._call_afc(
+            "list_devices", switch_ip, neutron_client.list_devices,
+            ip_address=switch_ip).get("devices")
         if not devices:
             raise ex.NoFoundPhysicalSwitch(
                 switch_ip=switch_ip
             )
         return neutron_client, devices[0].get("id")
 
-    def send_config_to_afc(self, config_params):
+    def _send_to_switch(self, endpoint, switch_ip, body):
+        neutron, switch_id = self.get_switch_id_by_ip(switch_ip=switch_ip)
+        return self._call_afc(endpoint, switch_ip,
+                              getattr(neutron, endpoint), switch_id,
+                              body=body)
+
+    def _schedule(self, endpoint, switch_ip, body, priority):
+        # Wait for the switch's rate limit, then send the request
+        kind, resource = _ENDPOINT_OPERATIONS[endpoint]
+        return scheduler.get_scheduler().submit(
+            switch_ip, self._send_to_switch,
+            args=(endpoint, switch_ip, body),
+            priority=priority, tenant_id=body.get("project_id"),
+            key=_resource_key(resource, switch_ip, body), kind=kind)
+
+    def send_config_to_afc(self, config_params,
+                           priority=scheduler.PRIORITY_CREATE):
         """
            Send create network request to AFC
         :param config_params: request params format:
@@ -49,10 +148,11 @@ class AfcRestClient(object):
                    "vlan_id": 105,
                    "vni": 10008
                 }
+        :param priority: scheduler priority class of the request
         :return:
         """
         LOG.debug("Neutron create_network config_params is: \n %s \n ",
-                  json.dumps(config_params, indent=3))
+                  log_utils.PrettyJson(config_params))
 
         switch_ip = config_params.pop("switch_ip", "")
         if not self.is_send_afc:
@@ -60,11 +160,12 @@ class AfcRestClient(object):
                       "was not sent to AFC.")
             return
         # Send create network request to AFC
-        neutron, switch_id = self.get_switch_id_by_ip(switch_ip=switch_ip)
-        ret = neutron.neutron_create_network(switch_id, body=config_params)
+        ret = self._schedule("neutron_create_network", switch_ip,
+                             config_params, priority)
         LOG.debug("Neutron_create_network result is: %s ", ret)
 
-    def delete_config_from_afc(self, delete_params):
+    def delete_config_from_afc(self, delete_params,
+                               priority=scheduler.PRIORITY_DELETE):
         """
            Send delete network request to AFC
         :param delete_params: request params format:
@@ -76,21 +177,23 @@ class AfcRestClient(object):
                    "vlan_id": 105,
                    "vni": 10008
                 }
+        :param priority: scheduler priority class of the request
         :return:
         """
         LOG.debug("Neutron delete_network delete_params is: \n %s \n ",
-                  json.dumps(delete_params, indent=3))
+                  log_utils.PrettyJson(delete_params))
 
         switch_ip = delete_params.pop("switch_ip", "")
         if not self.is_send_afc:
             LOG.debug("Delete_network request was not sent to AFC.")
             return
         # Send delete network request to AFC
-        neutron, switch_id = self.get_switch_id_by_ip(switch_ip=switch_ip)
-        ret = neutron.neutron_delete_network(switch_id, body=delete_params)
+        ret = self._schedule("neutron_delete_network", switch_ip,
+                             delete_params, priority)
         LOG.debug("Neutron_delete_network result is: %s", ret)
 
-    def create_or_update_vrf_on_physical_switch(self, request_params=None):
+    def create_or_update_vrf_on_physical_switch(
+            self, request_params=None, priority=scheduler.PRIORITY_CREATE):
         """
            Send create router request to AFC
            1. router_vni if not exist need create vrf
@@ -104,21 +207,23 @@ class AfcRestClient(object):
                    "vlan_id": 105,
                    "gw_ip": "10.10.10.1/24"
                 }
+        :param priority: scheduler priority class of the request
         :return:
         """
         LOG.debug("Neutron create_router config_params is: \n %s \n ",
-                  json.dumps(request_params, indent=3))
+                  log_utils.PrettyJson(request_params))
 
         switch_ip = request_params.pop("switch_ip", "")
         if not self.is_send_afc:
             LOG.debug("Create_router request was not sent to AFC.")
             return
         # Send create router request to AFC
-        neutron, switch_id = self.get_switch_id_by_ip(switch_ip=switch_ip)
-        ret = neutron.neutron_create_router(switch_id, body=request_params)
+        ret = self._schedule("neutron_create_router", switch_ip,
+                             request_params, priority)
         LOG.debug("Neutron_create_router result is: %s ", ret)
 
-    def delete_or_update_vrf_on_physical_switch(self, request_params=None):
+    def delete_or_update_vrf_on_physical_switch(
+            self, request_params=None, priority=scheduler.PRIORITY_DELETE):
         """
            Send delete router request to AFC
            1. Remove vlan interface from the vrf
@@ -131,16 +236,17 @@ class AfcRestClient(object):
                    "vlan_id": 105,
                    "gw_ip": "10.10.10.1/24"
                 }
+        :param priority: scheduler priority class of the request
         :return:
         """
         LOG.debug("Neutron delete_router config_params is: \n %s \n ",
-                  json.dumps(request_params, indent=3))
+                  log_utils.PrettyJson(request_params))
 
         switch_ip = request_params.pop("switch_ip", "")
         if not self.is_send_afc:
             LOG.debug("Delete_router request was not sent to AFC.")
             return
         # Send delete router request to AFC
-        neutron, switch_id = self.get_switch_id_by_ip(switch_ip=switch_ip)
-        ret = neutron.neutron_delete_router(switch_id, body=request_params)
+        ret = self._schedule("neutron_delete_router", switch_ip,
+                             request_params, priority)
         LOG.debug("Neutron_delete_router result is: %s ", ret)
@@ -0,0 +1,66 @@
+"""Small in-process caches for data read on every port event."""
+
+import collections
+import threading
+import time
+
+
+_clock = getattr(time, "monotonic", time.time)
+
+_MISSING = object()
+
+
+class LRUCache(object):
+    """Thread safe LRU cache whose entries expire after ``ttl`` seconds.
+
+    A ``ttl`` of 0 keeps entries until they are evicted or invalidated.
+    """
+
+    def __init__(self, maxsize, ttl=0, clock=_clock):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._clock = clock
+        self._entries = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        with self._lock:
+            value, expires = self._entries.get(key, (_MISSING, None))
+            if value is not _MISSING and (
+                    expires is None or expires > self._clock()):
+                # Move to the most recently used end
+                self._entries[key] = self._entries.pop(key)
+                self.hits += 1
+                return value
+            if value is not _MISSING:
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        if self.maxsize <= 0:
+            return
+        expires = self._clock() + self.ttl if self.ttl else None
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (value, expires)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    @property
+    def hit_rate(self):
+        lookups = self.hits + self.misses
+        return float(self.hits) / lookups if lookups else 0.0
@@ -1,3 +1,5 @@
+import threading
+
 from oslo_config import cfg
 from oslo_config import types
 
@@ -28,9 +30,198 @@ aster_afc_opts = [
 cfg.CONF.register_opts(aster_afc_opts, "aster_authtoken")
 
 
+afc_client_opts = [
+    cfg.IntOpt(
+        'request_retries',
+        default=0,
+        min=0,
+        help=_('Number of times a request to the Aster AFC is retried '
+               'after a connection failure.')),
+    cfg.FloatOpt(
+        'request_retry_interval',
+        default=0.5,
+        min=0,
+        help=_('Seconds to wait before the first retry of a request to the '
+               'Aster AFC, doubled for each further retry up to 30 '
+               'seconds.')),
+    cfg.FloatOpt(
+        'slow_request_threshold',
+        default=1.0,
+        min=0,
+        help=_('Requests to the Aster AFC taking longer than this many '
+               'seconds are logged with their request ID. 0 disables '
+               'slow request logging.')),
+    cfg.StrOpt(
+        'metrics_file',
+        help=_('Write AFC request metrics in Prometheus text format to '
+               'this file. "{pid}" is replaced with the worker pid.')),
+    cfg.IntOpt(
+        'metrics_file_interval',
+        default=15,
+        min=1,
+        help=_('Seconds between two writes of "metrics_file".')),
+    cfg.HostAddressOpt(
+        'metrics_bind_host',
+        default='127.0.0.1',
+        help=_('Address the AFC request metrics endpoint listens on.')),
+    cfg.PortOpt(
+        'metrics_bind_port',
+        default=0,
+        help=_('Port of the AFC request metrics endpoint. 0 disables the '
+               'endpoint.')),
+    cfg.FloatOpt(
+        'switch_rate_limit',
+        default=0,
+        min=0,
+        help=_('Maximum number of operations per second sent to AFC for '
+               'one switch. 0 disables the per switch limit.')),
+    cfg.IntOpt(
+        'switch_rate_burst',
+        default=10,
+        min=1,
+        help=_('Number of operations for one switch that may be sent to '
+               'AFC at once before "switch_rate_limit" applies.')),
+    cfg.FloatOpt(
+        'global_rate_limit',
+        default=0,
+        min=0,
+        help=_('Maximum number of operations per second sent to AFC for '
+               'all switches. 0 disables the global limit.')),
+    cfg.IntOpt(
+        'global_rate_burst',
+        default=20,
+        min=1,
+        help=_('Number of operations that may be sent to AFC at once '
+               'before "global_rate_limit" applies.')),
+    cfg.FloatOpt(
+        'rate_limit_max_wait',
+        default=60,
+        min=0,
+        help=_('Maximum number of seconds an operation waits for the rate '
+               'limiter before failing. 0 waits forever.'))
+]
+
+cfg.CONF.register_opts(afc_client_opts, "aster_afc")
+
+
+aster_db_opts = [
+    cfg.IntOpt(
+        'subnet_cache_size',
+        default=1024,
+        min=0,
+        help=_('Maximum number of networks whose subnet details are '
+               'cached in each worker. 0 disables the cache.')),
+    cfg.IntOpt(
+        'subnet_cache_ttl',
+        default=30,
+        min=0,
+        help=_('Seconds a cached subnet detail is used. Subnet events '
+               'invalidate the cache of the worker handling them, the TTL '
+               'bounds how stale other workers and servers can be. 0 keeps '
+               'entries until they are invalidated.')),
+    cfg.BoolOpt(
+        'sync_host_mappings',
+        default=True,
+        help=_('Replace the host to switch interface mappings stored in '
+               'the database with the "ml2_mech_aster_cx" sections at '
+               'startup. Disable when the mappings are managed with '
+               'neutron-afc-host-mappings.')),
+    cfg.BoolOpt(
+        'replica_reads',
+        default=False,
+        help=_('Send read-only lookups to the database replica configured '
+               'with "slave_connection" in the [database] section.')),
+    cfg.FloatOpt(
+        'read_after_write_window',
+        default=5.0,
+        min=0,
+        help=_('Seconds after a write during which the lookups of the same '
+               'thread read from the primary database. Set it above the '
+               'usual replication lag of the replica.')),
+    cfg.IntOpt(
+        'replica_retry_interval',
+        default=30,
+        min=1,
+        help=_('Seconds lookups read from the primary database after the '
+               'replica could not be reached.')),
+    cfg.FloatOpt(
+        'replica_max_lag',
+        default=5.0,
+        min=0,
+        help=_('Seconds the replica may lag behind the primary database '
+               'before lookups read from the primary. The lag is measured '
+               'with a heartbeat row written to the primary. 0 disables '
+               'the check.')),
+    cfg.FloatOpt(
+        'replica_lag_check_interval',
+        default=2.0,
+        min=0.1,
+        help=_('Seconds between two measurements of the replica lag by a '
+               'worker. Lags below the interval may go unnoticed, keep it '
+               'below replica_max_lag.')),
+    cfg.StrOpt(
+        'vni_pool_storage',
+        default='rows',
+        choices=[('rows', _('One row per allocatable VNI.')),
+                 ('ranges', _('One row per allocated VNI and the free '
+                              'VNIs as intervals.'))],
+        help=_('How the aster_vxlan, L2 VNI and L3 VNI pools are stored. '
+               'Switching to "ranges" converts the pools online when the '
+               'server starts, switching back to "rows" restores the row '
+               'per VNI. All neutron servers must use the same mode.')),
+    cfg.IntOpt(
+        'pool_sync_lease',
+        default=600,
+        min=1,
+        help=_('Seconds after which the synchronization of an allocation '
+               'pool started by a worker that did not finish it is taken '
+               'over by another worker.')),
+    cfg.IntOpt(
+        'pool_sync_wait',
+        default=60,
+        min=0,
+        help=_('Maximum number of seconds an allocation waits for the '
+               'synchronization of its pool when the server starts. 0 '
+               'waits forever.')),
+    cfg.IntOpt(
+        'prefetch_size',
+        default=0,
+        min=0,
+        help=_('Number of free L2 VNIs, L3 VNIs or border VLANs a worker '
+               'reserves in one transaction and then hands out to the '
+               'routers it creates, which reduces the contention on the '
+               'allocation tables when many routers are created at once. '
+               '0 disables prefetching.')),
+    cfg.IntOpt(
+        'prefetch_lease',
+        default=300,
+        min=10,
+        help=_('Seconds a block of prefetched IDs stays reserved for a '
+               'worker. IDs left in an expired block are returned to their '
+               'pool.')),
+    cfg.IntOpt(
+        'orphan_sweep_interval',
+        default=3600,
+        min=0,
+        help=_('Seconds between two sweeps reclaiming the L3 VNIs, L2 VNIs '
+               'and border VLANs still allocated to routers that no longer '
+               'exist. 0 disables the sweeps, orphans are then only '
+               'reclaimed by the synchronization of the L3 VNI pool.')),
+    cfg.IntOpt(
+        'orphan_sweep_batch',
+        default=500,
+        min=1,
+        help=_('Maximum number of orphaned IDs reclaimed in one '
+               'transaction.'))
+]
+
+cfg.CONF.register_opts(aster_db_opts, "aster_db")
+
+
 cx_sub_opts = [
     cfg.StrOpt(
         'physnet',
+        mutable=True,
         help=_('This is required if Aster VXLAN overlay feature is '
                'configured.  It should be the physical network name defined '
                'in "network_vlan_ranges" (defined beneath the "ml2_type_vlan" '
@@ -46,6 +237,7 @@ cx_sub_opts = [
         'host_ports_mapping',
         default={},
         sample_default='<None>',
+        mutable=True,
         type=types.Dict(value_type=types.List(bounds=True)),
         help=_('A list of key:value pairs describing which host is '
                'connected to which physical port or portchannel on the '
@@ -90,12 +282,10 @@ def get_sub_section_dict(name="", sub_opts=None):
     return identities
 
 
-_identities = get_sub_section_dict(name="ml2_mech_aster_cx",
-                                   sub_opts=cx_sub_opts)
 opt_ml2_mech_aster_cx_dict = cfg.DictOpt(
     'ml2_mech_aster_cx',
-    default=_identities,
-    help=_('A dictionary of ml2_mech_aster_cx titles'),
+    help=_('A dictionary of ml2_mech_aster_cx titles. Defaults to the '
+           '"ml2_mech_aster_cx:<switch_ip>" sections.'),
     dest="cx_switches"
 )
 cfg.CONF.register_opt(opt_ml2_mech_aster_cx_dict, "ml2_aster")
@@ -105,6 +295,7 @@ border_leaf_sub_opts = [
     cfg.ListOpt(
         'vlan_ranges',
         default=[],
+        mutable=True,
         help=_("Comma-separated list of <vni_min>:<vni_max> tuples "
                "enumerating ranges of VXLAN Network IDs that are "
                "available for tenant network allocation. "
@@ -113,16 +304,105 @@ border_leaf_sub_opts = [
         'physical_network_ports_mapping',
         default={},
         sample_default='<None>',
+        mutable=True,
         type=types.Dict(value_type=types.List(bounds=True)),
         help=_('A list of key:value pairs'))
 ]
 
-_identities = get_sub_section_dict(name="ml2_border_leaf",
-                                   sub_opts=border_leaf_sub_opts)
 opt_ml2_border_dict = cfg.DictOpt(
     'ml2_border_leaf',
-    default=_identities,
-    help=_('A dictionary of ml2_border_leaf titles'),
+    help=_('A dictionary of ml2_border_leaf titles. Defaults to the '
+           '"ml2_border_leaf:<switch_ip>" sections.'),
     dest="border_switches"
 )
 cfg.CONF.register_opt(opt_ml2_border_dict, "ml2_aster")
+
+
+class _ReadOnlyDict(dict):
+    """A dict shared by all the readers of the switch sections."""
+
+    def _read_only(self, *args, **kwargs):
+        raise TypeError("Switch sections are read-only")
+
+    __setitem__ = __delitem__ = _read_only
+    clear = pop = popitem = setdefault = update = _read_only
+
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return _ReadOnlyDict((key, _freeze(item))
+                             for key, item in value.items())
+    if isinstance(value, list):
+        return tuple(_freeze(item) for item in value)
+    return value
+
+
+class SwitchSections(object):
+    """The ``[<name>:<switch_ip>]`` sections, parsed on first access.
+
+    The sections are parsed on first access, once the config files are
+    loaded, and cached read-only, keyed by switch IP. Parsing, reloading or
+    mutating the config files, or calling ``reset``, parses them again. A
+    value of the ``[ml2_aster] <dest>`` option, set with ``set_override``
+    in tests, is returned instead.
+    """
+
+    def __init__(self, name, sub_opts, dest):
+        self.name = name
+        self.sub_opts = sub_opts
+        self.dest = dest
+        self._lock = threading.Lock()
+        self._sections = None
+        self._namespace = None
+
+    def get(self):
+        value = getattr(cfg.CONF.ml2_aster, self.dest)
+        if value is not None:
+            return value
+        # Parsing or reloading the config files replaces the namespace of
+        # the parsed values, oslo.config has no hook for them
+        namespace = getattr(cfg.CONF, "_namespace", None)
+        with self._lock:
+            if self._sections is None or self._namespace is not namespace:
+                self._sections = _freeze(get_sub_section_dict(
+                    name=self.name, sub_opts=self.sub_opts))
+                self._namespace = namespace
+            return self._sections
+
+    def reset(self):
+        with self._lock:
+            self._sections = None
+
+
+_cx_switches = SwitchSections("ml2_mech_aster_cx", cx_sub_opts,
+                              "cx_switches")
+_border_switches = SwitchSections("ml2_border_leaf", border_leaf_sub_opts,
+                                  "border_switches")
+
+
+def cx_switches():
+    """Return ``{switch_ip: {"physnet": ..., "host_ports_mapping": ...}}``
+    of the ``ml2_mech_aster_cx`` sections.
+    """
+    return _cx_switches.get()
+
+
+def border_switches():
+    """Return ``{switch_ip: {"vlan_ranges": ...,
+    "physical_network_ports_mapping": ...}}`` of the ``ml2_border_leaf``
+    sections.
+    """
+    return _border_switches.get()
+
+
+def reset_switch_sections():
+    """Parse the switch sections again on their next access."""
+    _cx_switches.reset()
+    _border_switches.reset()
+
+
+def _switch_sections_mutated(conf, fresh):
+    reset_switch_sections()
+
+
+cfg.CONF.register_mutate_hook(_switch_sections_mutated)
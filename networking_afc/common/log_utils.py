@@ -0,0 +1,35 @@
+import json
+
+
+def _to_serializable(value):
+    # dict views, sets and generators end up in request params
+    try:
+        return list(value)
+    except TypeError:
+        return str(value)
+
+
+class PrettyJson(object):
+    """Defer JSON formatting of a log argument until it is emitted.
+
+    Pass an instance as a logging argument instead of calling
+    ``json.dumps`` eagerly, so the serialization only happens when the
+    record passes the logger's level check:
+
+        LOG.debug("params: \\n %s \\n", PrettyJson(params))
+    """
+
+    __slots__ = ("obj", "indent")
+
+    def __init__(self, obj, indent=3):
+        self.obj = obj
+        self.indent = indent
+
+    def __str__(self):
+        try:
+            return json.dumps(self.obj, indent=self.indent,
+                              default=_to_serializable)
+        except (TypeError, ValueError):
+            return repr(self.obj)
+
+    __repr__ = __str__
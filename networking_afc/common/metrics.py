@@ -0,0 +1,295 @@
+"""Lightweight metrics for calls made to the Aster AFC.
+
+Metrics are kept in process and rendered in the Prometheus text exposition
+format, either served from a local HTTP endpoint or written periodically
+to a file (for node-exporter's textfile collector, for example).
+"""
+
+import bisect
+import os
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+
+
+LOG = log.getLogger(__name__)
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5,
+                   1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(label_names, label_values, extra=None):
+    pairs = list(zip(label_names, label_values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    return "{%s}" % ",".join(
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").
+                     replace('"', '\\"'))
+        for name, value in pairs)
+
+
+class _Metric(object):
+
+    metric_type = None
+
+    def __init__(self, name, documentation, label_names=()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if len(labels) != len(self.label_names):
+            raise ValueError("%s expects labels %s" %
+                             (self.name, self.label_names))
+        return tuple(labels)
+
+    def render(self):
+        lines = ["# HELP %s %s" % (self.name, self.documentation),
+                 "# TYPE %s %s" % (self.name, self.metric_type)]
+        with self._lock:
+            items = sorted(self._values.items(),
+                           key=lambda item: [str(v) for v in item[0]])
+        for labels, value in items:
+            lines.extend(self._render_sample(labels, value))
+        return lines
+
+    def _render_sample(self, labels, value):
+        return ["%s%s %s" % (self.name,
+                             _format_labels(self.label_names, labels),
+                             _format_value(value))]
+
+
+class Counter(_Metric):
+
+    metric_type = "counter"
+
+    def inc(self, *labels, **kwargs):
+        amount = kwargs.get("amount", 1)
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Gauge(_Metric):
+
+    metric_type = "gauge"
+
+    def inc(self, *labels):
+        self._add(labels, 1)
+
+    def dec(self, *labels):
+        self._add(labels, -1)
+
+    def _add(self, labels, amount):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(self._key(labels), 0)
+
+
+class Histogram(_Metric):
+
+    metric_type = "histogram"
+
+    def __init__(self, name, documentation, label_names=(),
+                 buckets=DEFAULT_BUCKETS):
+        super(Histogram, self).__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, *labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            sample = self._values.get(key)
+            if sample is None:
+                # [per-bucket counts..., +Inf count, sum]
+                sample = self._values[key] = [0] * (len(self.buckets) + 2)
+            sample[index] += 1
+            sample[-1] += value
+
+    def count(self, *labels):
+        sample = self._values.get(self._key(labels))
+        return sum(sample[:-1]) if sample else 0
+
+    def _render_sample(self, labels, sample):
+        lines = []
+        cumulative = 0
+        bounds = [_format_value(b) for b in self.buckets] + ["+Inf"]
+        for bound, bucket_count in zip(bounds, sample[:-1]):
+            cumulative += bucket_count
+            lines.append("%s_bucket%s %d" % (
+                self.name,
+                _format_labels(self.label_names, labels, ("le", bound)),
+                cumulative))
+        label_str = _format_labels(self.label_names, labels)
+        lines.append("%s_sum%s %s" % (self.name, label_str,
+                                      _format_value(sample[-1])))
+        lines.append("%s_count%s %d" % (self.name, label_str, cumulative))
+        return lines
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return repr(value)
+    return str(value)
+
+
+class MetricsRegistry(object):
+
+    def __init__(self):
+        self._metrics = []
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            self._metrics.append(metric)
+        return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics)
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+_AFC_LABELS = ("endpoint", "switch")
+
+AFC_REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "afc_request_duration_seconds",
+    "Latency of requests sent to the AFC, including retries.",
+    _AFC_LABELS))
+AFC_REQUESTS = REGISTRY.register(Counter(
+    "afc_requests_total",
+    "Requests sent to the AFC by response status.",
+    _AFC_LABELS + ("status",)))
+AFC_RETRIES = REGISTRY.register(Counter(
+    "afc_request_retries_total",
+    "Requests to the AFC retried after a connection failure.",
+    _AFC_LABELS))
+AFC_BYTES_SENT = REGISTRY.register(Counter(
+    "afc_request_bytes_sent_total",
+    "Serialized request body bytes sent to the AFC.",
+    _AFC_LABELS))
+AFC_IN_FLIGHT = REGISTRY.register(Gauge(
+    "afc_requests_in_flight",
+    "Requests to the AFC currently waiting for a response.",
+    _AFC_LABELS))
+AFC_COMPACTED = REGISTRY.register(Counter(
+    "afc_operations_compacted_total",
+    "Queued AFC operations dropped because a later operation on the same "
+    "resource superseded or cancelled them.",
+    ("switch",)))
+
+ORPHANS_RECLAIMED = REGISTRY.register(Counter(
+    "afc_orphaned_ids_reclaimed_total",
+    "IDs of router pools held by deleted routers and reclaimed by the "
+    "sweeper, released to the pool or removed when out of its ranges.",
+    ("pool", "action")))
+
+SUBNET_CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "afc_subnet_cache_lookups_total",
+    "Lookups of the subnet detail cache by result (hit or miss).",
+    ("result",)))
+
+
+class _MetricsHTTPServer(socketserver.ThreadingMixIn,
+                         BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _MetricsRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path.split("?")[0] not in ("/", "/metrics"):
+            self.send_error(404)
+            return
+        payload = self.server.registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, fmt, *args):
+        pass
+
+
+def write_metrics_file(path, registry=REGISTRY):
+    # Write to a temporary file and rename so scrapers never read a
+    # partially written file
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(tmp_path, "w") as metrics_file:
+        metrics_file.write(registry.render())
+    os.rename(tmp_path, path)
+
+
+def _file_writer_loop(path, interval, registry):
+    while True:
+        try:
+            write_metrics_file(path, registry)
+        except (IOError, OSError) as ex:
+            LOG.warning("Failed to write AFC metrics to %s: %s", path, ex)
+        time.sleep(interval)
+
+
+def enabled():
+    """Whether an exporter publishes the metrics of this process."""
+    conf = cfg.CONF.aster_afc
+    return bool(conf.metrics_bind_port or conf.metrics_file)
+
+
+_exporter_lock = threading.Lock()
+_exporter_started = False
+
+
+def start_exporter(registry=REGISTRY):
+    """Start the configured exporters once per process."""
+    global _exporter_started
+    with _exporter_lock:
+        if _exporter_started:
+            return
+        _exporter_started = True
+
+    conf = cfg.CONF.aster_afc
+    if conf.metrics_bind_port:
+        try:
+            server = _MetricsHTTPServer(
+                (conf.metrics_bind_host, conf.metrics_bind_port),
+                _MetricsRequestHandler)
+        except (IOError, OSError) as ex:
+            # Several workers of one neutron-server share the config, only
+            # the first one to bind serves its metrics
+            LOG.info("AFC metrics endpoint %s:%s not started: %s",
+                     conf.metrics_bind_host, conf.metrics_bind_port, ex)
+        else:
+            server.registry = registry
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+            LOG.info("Serving AFC metrics on %s:%s",
+                     conf.metrics_bind_host, conf.metrics_bind_port)
+    if conf.metrics_file:
+        path = conf.metrics_file.replace("{pid}", str(os.getpid()))
+        thread = threading.Thread(
+            target=_file_writer_loop,
+            args=(path, conf.metrics_file_interval, registry))
+        thread.daemon = True
+        thread.start()
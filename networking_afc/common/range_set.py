@@ -0,0 +1,80 @@
+"""Immutable sets of IDs given as inclusive ``(min, max)`` ranges.
+
+The VNI and VLAN pools are configured as a few ranges which may span
+millions of IDs. A ``RangeSet`` keeps the merged ranges only and tests
+membership with a binary search, instead of materializing every ID.
+"""
+
+import bisect
+
+from six import moves
+
+
+class RangeSet(object):
+    """Set of the IDs of inclusive ``(min, max)`` ranges.
+
+    Overlapping and adjacent ranges are merged, ``overlapping`` tells
+    whether the given ranges overlapped.
+
+    :raises ValueError: when the max of a range is lower than its min
+    """
+
+    __slots__ = ("source", "overlapping", "_starts", "_ends", "_len")
+
+    def __init__(self, ranges=()):
+        self.source = tuple((int(low), int(high)) for low, high in ranges)
+        self.overlapping = False
+        self._starts = []
+        self._ends = []
+        for low, high in sorted(self.source):
+            if high < low:
+                raise ValueError("Invalid range %d:%d" % (low, high))
+            if self._ends and low <= self._ends[-1]:
+                self.overlapping = True
+            if self._ends and low <= self._ends[-1] + 1:
+                self._ends[-1] = max(self._ends[-1], high)
+            else:
+                self._starts.append(low)
+                self._ends.append(high)
+        self._len = sum(high - low + 1
+                        for low, high in zip(self._starts, self._ends))
+
+    def __contains__(self, id_):
+        index = bisect.bisect_right(self._starts, id_) - 1
+        return index >= 0 and id_ <= self._ends[index]
+
+    def __iter__(self):
+        for low, high in zip(self._starts, self._ends):
+            for id_ in moves.range(low, high + 1):
+                yield id_
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    __nonzero__ = __bool__
+
+    def __repr__(self):
+        return "RangeSet(%s)" % ",".join(
+            "%d:%d" % (low, high) for low, high in self.ranges())
+
+    def ranges(self):
+        """Sorted disjoint ``[(min, max), ...]`` ranges of the set."""
+        return list(zip(self._starts, self._ends))
+
+    def matches(self, ranges):
+        """Whether the set was built from ``ranges``."""
+        return self.source == tuple((low, high) for low, high in ranges)
+
+
+def get(ranges, current=None):
+    """Return ``current`` if it was built from ``ranges``, else a new set.
+
+    Lets the owner of a list of ranges keep its set up to date when the
+    list is replaced.
+    """
+    if current is not None and current.matches(ranges):
+        return current
+    return RangeSet(ranges)
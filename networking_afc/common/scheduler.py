@@ -0,0 +1,375 @@
+"""Rate limiting and priority scheduling of requests sent to the AFC.
+
+Every AFC operation passes through an ``AfcScheduler`` which enforces a
+token bucket per switch and a global one. When operations have to wait,
+they are dispatched by priority class (deletes that free resources first,
+then creates) and round-robin across tenants within a class, so one
+tenant's teardown cannot starve everybody else.
+
+Operations waiting in the queue are compacted per resource: a delete
+supersedes the creates and updates queued before it and consecutive
+updates collapse into the last one, see ``compact``.
+
+With no rate limit configured operations are executed immediately.
+"""
+
+import collections
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from networking_afc.common import metrics
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
+
+
+LOG = log.getLogger(__name__)
+
+PRIORITY_DELETE = 0
+PRIORITY_CREATE = 1
+PRIORITIES = (PRIORITY_DELETE, PRIORITY_CREATE)
+
+OP_CREATE = "create"
+OP_UPDATE = "update"
+OP_DELETE = "delete"
+
+# Queue the new operation behind the pending one
+COMPACT_KEEP = "keep"
+# Drop the pending operation and queue the new one
+COMPACT_REPLACE = "replace"
+# Drop both operations
+COMPACT_CANCEL = "cancel"
+
+# Upper bound of a single wait on the condition; waiters are woken
+# explicitly whenever an operation is dispatched
+_MAX_POLL_INTERVAL = 1.0
+
+_clock = getattr(time, "monotonic", time.time)
+
+
+class TokenBucket(object):
+    """Token bucket refilled at ``rate`` tokens per second.
+
+    A rate of 0 disables the limit.
+    """
+
+    def __init__(self, rate, burst, clock=_clock):
+        self.rate = float(rate)
+        self.capacity = float(max(burst, 1))
+        self.tokens = self.capacity
+        self._clock = clock
+        self._updated = clock()
+
+    @property
+    def unlimited(self):
+        return self.rate <= 0
+
+    def _refill(self, now):
+        elapsed = max(now - self._updated, 0)
+        self.tokens = min(self.capacity, self.tokens + elapsed * self.rate)
+        self._updated = now
+
+    def wait_time(self, now=None):
+        """Seconds until a token is available, 0 if one is available now."""
+        if self.unlimited:
+            return 0
+        self._refill(self._clock() if now is None else now)
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
+
+    def consume(self, now=None):
+        if self.unlimited:
+            return
+        self._refill(self._clock() if now is None else now)
+        self.tokens -= 1
+
+
+def compact(pending_kind, new_kind, previous_kind=None):
+    """Combine a new operation with the last pending one on its resource.
+
+    Creates and updates are upserts, the AFC is sent creates for resources
+    already configured on the switch. A create followed by a delete only
+    cancels out when the create is known to create the resource, that is
+    when it follows a pending delete; otherwise the delete supersedes the
+    create so that a resource configured before is still deleted. An update
+    followed by an update or a delete and a create followed by a create are
+    superseded by the new operation. Pending deletes are never dropped.
+
+    :param pending_kind: kind of the last pending operation
+    :param new_kind: kind of the new operation
+    :param previous_kind: kind of the pending operation before the last
+        one, None if there is none
+    :returns: one of COMPACT_KEEP, COMPACT_REPLACE and COMPACT_CANCEL
+    """
+    if pending_kind == OP_CREATE:
+        if new_kind == OP_DELETE:
+            if previous_kind == OP_DELETE:
+                return COMPACT_CANCEL
+            return COMPACT_REPLACE
+        if new_kind == OP_CREATE:
+            return COMPACT_REPLACE
+    elif pending_kind == OP_UPDATE:
+        if new_kind in (OP_UPDATE, OP_DELETE):
+            return COMPACT_REPLACE
+    return COMPACT_KEEP
+
+
+def _compact_pending(pending_kinds, new_kind):
+    previous_kind = pending_kinds[-2] if len(pending_kinds) > 1 else None
+    return compact(pending_kinds[-1], new_kind, previous_kind)
+
+
+def compact_sequence(ops):
+    """Compact a sequence of ``(key, kind, payload)`` operations.
+
+    This applies the same rules as the scheduler's queue and returns the
+    surviving operations in their original order.
+    """
+    pending = collections.defaultdict(list)
+    survivors = []
+    for index, (key, kind, _payload) in enumerate(ops):
+        action = COMPACT_KEEP
+        if pending[key]:
+            action = _compact_pending(
+                [ops[pending_index][1] for pending_index in pending[key]],
+                kind)
+        if action != COMPACT_KEEP:
+            survivors.remove(pending[key].pop())
+        if action != COMPACT_CANCEL:
+            pending[key].append(index)
+            survivors.append(index)
+    return [ops[index] for index in survivors]
+
+
+class AfcOperation(object):
+    """One AFC request waiting in the scheduler."""
+
+    __slots__ = ("switch_ip", "priority", "tenant_id", "key", "kind",
+                 "cancelled")
+
+    def __init__(self, switch_ip, priority, tenant_id, key=None,
+                 kind=None):
+        self.switch_ip = switch_ip
+        self.priority = priority
+        self.tenant_id = tenant_id
+        self.key = key
+        self.kind = kind
+        self.cancelled = False
+
+
+class _SwitchQueue(object):
+    """Pending operations of one switch.
+
+    Operations are grouped by priority class, then by tenant. Tenants are
+    served round-robin: after dispatching a tenant's operation, the tenant
+    moves to the back of its class.
+    """
+
+    def __init__(self):
+        self._classes = dict((priority, collections.OrderedDict())
+                             for priority in PRIORITIES)
+
+    def __len__(self):
+        return sum(len(queue)
+                   for tenants in self._classes.values()
+                   for queue in tenants.values())
+
+    def append(self, op):
+        tenants = self._classes[op.priority]
+        tenants.setdefault(op.tenant_id, collections.deque()).append(op)
+
+    def head(self):
+        for priority in PRIORITIES:
+            tenants = self._classes[priority]
+            if tenants:
+                return next(iter(tenants.values()))[0]
+
+    def remove(self, op):
+        tenants = self._classes[op.priority]
+        queue = tenants.get(op.tenant_id)
+        if not queue or op not in queue:
+            return False
+        was_head = queue[0] is op
+        queue.remove(op)
+        if not queue:
+            del tenants[op.tenant_id]
+        elif was_head:
+            # Round-robin, the next operation of this tenant waits for the
+            # other tenants of the same class
+            tenants[op.tenant_id] = tenants.pop(op.tenant_id)
+        return True
+
+
+class AfcScheduler(object):
+
+    def __init__(self, switch_rate=0, switch_burst=1, global_rate=0,
+                 global_burst=1, max_wait=0, clock=_clock):
+        self.switch_rate = switch_rate
+        self.switch_burst = switch_burst
+        self.max_wait = max_wait
+        self._clock = clock
+        self._global_bucket = TokenBucket(global_rate, global_burst, clock)
+        self._switch_buckets = {}
+        self._queues = collections.defaultdict(_SwitchQueue)
+        # Resource key -> pending operations on it, oldest first
+        self._pending_by_key = {}
+        self._cond = threading.Condition()
+
+    @property
+    def limited(self):
+        return self.switch_rate > 0 or not self._global_bucket.unlimited
+
+    def _switch_bucket(self, switch_ip):
+        bucket = self._switch_buckets.get(switch_ip)
+        if bucket is None:
+            bucket = self._switch_buckets[switch_ip] = TokenBucket(
+                self.switch_rate, self.switch_burst, self._clock)
+        return bucket
+
+    def pending(self, switch_ip=None):
+        with self._cond:
+            if switch_ip is not None:
+                return len(self._queues.get(switch_ip) or ())
+            return sum(len(queue) for queue in self._queues.values())
+
+    def _enqueue(self, op):
+        self._queues[op.switch_ip].append(op)
+        if op.key is not None:
+            self._pending_by_key.setdefault(op.key, []).append(op)
+
+    def _dequeue(self, op):
+        queue = self._queues.get(op.switch_ip)
+        removed = queue is not None and queue.remove(op)
+        if queue is not None and not len(queue):
+            del self._queues[op.switch_ip]
+        pending = self._pending_by_key.get(op.key)
+        if pending and op in pending:
+            pending.remove(op)
+            if not pending:
+                del self._pending_by_key[op.key]
+        return removed
+
+    def _admit(self, op):
+        """Compact ``op`` against the pending operations and queue it.
+
+        :returns: False when ``op`` cancelled out and must not be sent.
+        """
+        pending = self._pending_by_key.get(op.key)
+        if op.key is None or not pending:
+            self._enqueue(op)
+            return True
+        last = pending[-1]
+        action = _compact_pending([p.kind for p in pending], op.kind)
+        if action != COMPACT_KEEP:
+            self._dequeue(last)
+            last.cancelled = True
+            metrics.AFC_COMPACTED.inc(op.switch_ip)
+            LOG.debug("Compacted pending AFC %(pending)s operation on "
+                      "%(key)s with a new %(new)s operation",
+                      {'pending': last.kind, 'key': op.key,
+                       'new': op.kind})
+            # Wake the waiter of the dropped operation
+            self._cond.notify_all()
+        if action == COMPACT_CANCEL:
+            metrics.AFC_COMPACTED.inc(op.switch_ip)
+            return False
+        self._enqueue(op)
+        return True
+
+    def _higher_priority_ready(self, op, now):
+        # Another switch has a more urgent operation which only waits for
+        # a global token, let it have the next one
+        for switch_ip, queue in self._queues.items():
+            if switch_ip == op.switch_ip:
+                continue
+            head = queue.head()
+            if (head is not None and head.priority < op.priority and
+                    not self._switch_bucket(switch_ip).wait_time(now)):
+                return True
+        return False
+
+    def _try_dispatch(self, op, now):
+        """Dispatch ``op`` if it is its switch's next operation.
+
+        :returns: None when dispatched, otherwise the number of seconds
+            worth waiting before trying again.
+        """
+        if self._queues[op.switch_ip].head() is not op:
+            return _MAX_POLL_INTERVAL
+        if self._higher_priority_ready(op, now):
+            return _MAX_POLL_INTERVAL
+        switch_bucket = self._switch_bucket(op.switch_ip)
+        wait = max(switch_bucket.wait_time(now),
+                   self._global_bucket.wait_time(now))
+        if wait > 0:
+            return min(wait, _MAX_POLL_INTERVAL)
+        switch_bucket.consume(now)
+        self._global_bucket.consume(now)
+        self._dequeue(op)
+        return None
+
+    def submit(self, switch_ip, func, args=(), kwargs=None,
+               priority=PRIORITY_CREATE, tenant_id=None, key=None,
+               kind=None):
+        """Run ``func(*args, **kwargs)`` once the rate limits allow it.
+
+        Operations with a resource ``key`` and ``kind`` (one of OP_CREATE,
+        OP_UPDATE and OP_DELETE) are compacted while they wait. A
+        compacted operation is not sent and None is returned.
+        """
+        kwargs = kwargs or {}
+        if not self.limited:
+            return func(*args, **kwargs)
+
+        op = AfcOperation(switch_ip, priority, tenant_id, key, kind)
+        start = self._clock()
+        with self._cond:
+            if not self._admit(op):
+                return None
+            while True:
+                if op.cancelled:
+                    return None
+                now = self._clock()
+                wait = self._try_dispatch(op, now)
+                if wait is None:
+                    break
+                if self.max_wait:
+                    remaining = start + self.max_wait - now
+                    if remaining <= 0:
+                        self._dequeue(op)
+                        self._cond.notify_all()
+                        raise ex.AfcRequestQueueTimeout(
+                            switch_ip=switch_ip, timeout=self.max_wait)
+                    wait = min(wait, remaining)
+                self._cond.wait(wait)
+            # The next operation of this switch may be dispatchable now
+            self._cond.notify_all()
+
+        waited = self._clock() - start
+        if waited > 1:
+            LOG.debug("AFC request to switch %(switch_ip)s waited "
+                      "%(waited).3fs in the scheduler",
+                      {'switch_ip': switch_ip, 'waited': waited})
+        return func(*args, **kwargs)
+
+
+_scheduler = None
+_scheduler_lock = threading.Lock()
+
+
+def get_scheduler():
+    """Return the process wide scheduler built from [aster_afc] options."""
+    global _scheduler
+    if _scheduler is None:
+        with _scheduler_lock:
+            if _scheduler is None:
+                conf = cfg.CONF.aster_afc
+                _scheduler = AfcScheduler(
+                    switch_rate=conf.switch_rate_limit,
+                    switch_burst=conf.switch_rate_burst,
+                    global_rate=conf.global_rate_limit,
+                    global_burst=conf.global_rate_burst,
+                    max_wait=conf.rate_limit_max_wait)
+    return _scheduler
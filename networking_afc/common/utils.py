@@ -1,17 +1,27 @@
-import json
-import copy
+import collections
+import functools
+import threading
+
 from sqlalchemy import and_
+from oslo_config import cfg
 from oslo_log import log as logging
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
 from neutron_lib import constants as n_const
 from neutron_lib import context as neutron_context
 from neutron_lib.plugins import constants as plugin_constants
 from neutron_lib.plugins import directory
 from neutron_lib.db import api as lib_db_api
-from neutron_lib.plugins.ml2 import api
 from neutron.plugins.ml2.driver_context import NetworkContext  # noqa
 from neutron.db import models_v2
 from neutron.db.models import segment as segment_models
+from neutron.plugins.ml2 import models as ml2_models
 
+from networking_afc.common import cache
+from networking_afc.common import config  # noqa
+from networking_afc.common import metrics
+from networking_afc.db import replica
 from networking_afc.db.models import aster_models_v2
 
 
@@ -24,53 +34,191 @@ def get_writer_session():
 
 
 def get_read_session():
-    session = lib_db_api.get_reader_session()
+    # Read-only lookups may be served by the replica, see db.replica. The
+    # lookups deciding the configuration of the switches read from the
+    # primary instead, a lagging replica would undo changes on them
+    session = replica.get_reader_session()
     return session, session.begin(subtransactions=True)
 
 
+def get_context_session(context=None):
+    """Return the DB session of a plugin or driver context.
+
+    The session of a driver context's plugin context joins the transaction
+    Neutron has open for the request, if any. Without one, a new writer
+    session is returned.
+    """
+    plugin_context = getattr(context, "_plugin_context", context)
+    session = getattr(plugin_context, "session", None)
+    if session is None:
+        session = lib_db_api.get_writer_session()
+    return session
+
+
+# Maximum number of router ids in one IN clause
+_IN_CHUNK_SIZE = 500
+
+_local = threading.local()
+
+
+class AllocationMemo(object):
+    """Memoize router allocation lookups of the current thread.
+
+    Inside the context every VNI or VLAN of a router is queried at most
+    once. Nested contexts share the outermost memo. Allocating or
+    releasing a segment clears it, see ``invalidate_allocation_memo``.
+    """
+
+    def __enter__(self):
+        self._outermost = getattr(_local, "allocation_memo", None) is None
+        if self._outermost:
+            _local.allocation_memo = {}
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._outermost:
+            _local.allocation_memo = None
+
+
+def memoize_allocation_lookups(func):
+    """Run ``func`` inside an ``AllocationMemo``."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with AllocationMemo():
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def invalidate_allocation_memo():
+    memo = getattr(_local, "allocation_memo", None)
+    if memo:
+        memo.clear()
+
+
+def _memoized_lookup(kind, router_ids, query_func):
+    router_ids = [router_id for router_id in set(router_ids) if router_id]
+    memo = getattr(_local, "allocation_memo", None)
+    if memo is None:
+        return query_func(router_ids) if router_ids else {}
+    result = {}
+    missing = []
+    for router_id in router_ids:
+        try:
+            value = memo[(kind, router_id)]
+        except KeyError:
+            missing.append(router_id)
+            continue
+        if value is not None:
+            result[router_id] = value
+    if missing:
+        found = query_func(missing)
+        for router_id in missing:
+            memo[(kind, router_id)] = found.get(router_id)
+        result.update(found)
+    return result
+
+
+def _query_by_router_ids(router_ids, *columns):
+    # Yields (router_id, value...) rows, one IN query per chunk of ids
+    session = lib_db_api.get_reader_session()
+    with session.begin(subtransactions=True):
+        router_id_column = columns[0]
+        for i in range(0, len(router_ids), _IN_CHUNK_SIZE):
+            chunk = router_ids[i: i + _IN_CHUNK_SIZE]
+            for row in session.query(*columns).filter(
+                    router_id_column.in_(chunk)):
+                yield row
+
+
+def _get_vnis_by_router_ids(router_ids, model, vni_column):
+    result = {}
+    for router_id, vni in _query_by_router_ids(router_ids, model.router_id,
+                                               vni_column):
+        result.setdefault(router_id, vni)
+    return result
+
+
+def get_l3_vnis_by_router_ids(router_ids):
+    """Return {router_id: l3_vni} of the routers owning a L3 VNI."""
+    model = aster_models_v2.AsterL3VNIAllocation
+    return _memoized_lookup(
+        "l3_vni", router_ids,
+        lambda ids: _get_vnis_by_router_ids(ids, model, model.l3_vni))
+
+
+def get_l2_vnis_by_router_ids(router_ids):
+    """Return {router_id: l2_vni} of the routers owning a L2 VNI."""
+    model = aster_models_v2.AsterL2VNIAllocation
+    return _memoized_lookup(
+        "l2_vni", router_ids,
+        lambda ids: _get_vnis_by_router_ids(ids, model, model.l2_vni))
+
+
+def _get_vlan_ids_by_router_ids(router_ids):
+    model = aster_models_v2.AsterLeafVlanAllocation
+    result = {}
+    for router_id, switch_ip, vlan_id in _query_by_router_ids(
+            router_ids, model.router_id, model.switch_ip, model.vlan_id):
+        result.setdefault(router_id, {}).setdefault(switch_ip, vlan_id)
+    return result
+
+
+def get_vlan_ids_by_router_ids(router_ids):
+    """Return {router_id: {switch_ip: vlan_id}} of border leaf VLANs."""
+    return _memoized_lookup("vlan_id", router_ids,
+                            _get_vlan_ids_by_router_ids)
+
+
 def get_l3_vni_by_route_id(router_id):
-    session, ctx_manager = get_read_session()
-    with ctx_manager:
-        alloc = session.query(aster_models_v2.AsterL3VNIAllocation). \
-            filter_by(router_id=router_id).first()
-        return alloc.l3_vni if alloc else -1
+    return get_l3_vnis_by_router_ids([router_id]).get(router_id, -1)
 
 
 def get_l2_vni_by_route_id(router_id):
-    session, ctx_manager = get_read_session()
-    with ctx_manager:
-        alloc = session.query(aster_models_v2.AsterL2VNIAllocation). \
-            filter_by(router_id=router_id).first()
-        return alloc.l2_vni if alloc else -1
+    return get_l2_vnis_by_router_ids([router_id]).get(router_id, -1)
 
 
+@memoize_allocation_lookups
 def get_routers_and_interfaces(self):
     core = directory.get_plugin()
     ctx = neutron_context.get_admin_context()
     routers = directory.get_plugin(plugin_constants.L3).get_routers(ctx)
+    if not routers:
+        return routers, []
 
+    l3_vnis = get_l3_vnis_by_router_ids(
+        [router.get("id") for router in routers])
     for router in routers:
-        router_id = router.get("id")
-        l3_vni = get_l3_vni_by_route_id(router_id)
         router.update({
-            "l3_vni": l3_vni
+            "l3_vni": l3_vnis.get(router.get("id"), -1)
         })
 
+    # Fetch the interfaces of all routers, their subnets and segments once
+    ports = core.get_ports(
+        ctx,
+        filters={
+            'device_id': [router['id'] for router in routers],
+            'device_owner': [n_const.DEVICE_OWNER_ROUTER_INTF,
+                             n_const.DEVICE_OWNER_ROUTER_GW]}) or []
+    router_ports = {}
+    for p in ports:
+        router_ports.setdefault(p['device_id'], []).append(p)
+    subnet_ids = list(set(p['fixed_ips'][0]['subnet_id'] for p in ports))
+    subnets = dict((subnet['id'], subnet) for subnet in core.get_subnets(
+        ctx, filters={'id': subnet_ids})) if subnet_ids else {}
+    seg_ids = {}
+
     router_interfaces = list()
     for router in routers:
-        ports = core.get_ports(
-            ctx,
-            filters={
-                'device_id': [router['id']],
-                'device_owner': [n_const.DEVICE_OWNER_ROUTER_INTF,
-                                 n_const.DEVICE_OWNER_ROUTER_GW]}) or []
-        for p in ports:
+        for p in router_ports.get(router['id'], []):
             router_interface = router.copy()
             net_id = p['network_id']
             subnet_id = p['fixed_ips'][0]['subnet_id']
-            subnet = core.get_subnet(ctx, subnet_id)
-            ml2_db = NetworkContext(self, ctx, {'id': net_id})
-            seg_id = ml2_db.network_segments[0]['segmentation_id']
+            subnet = subnets.get(subnet_id) or core.get_subnet(ctx, subnet_id)
+            if net_id not in seg_ids:
+                ml2_db = NetworkContext(self, ctx, {'id': net_id})
+                seg_ids[net_id] = \
+                    ml2_db.network_segments[0]['segmentation_id']
+            seg_id = seg_ids[net_id]
 
             router_interface['seg_id'] = seg_id
             router_interface['cidr'] = subnet['cidr']
@@ -91,60 +239,63 @@ def get_router_interface_by_subnet_id(self, subnet_id=None):
             return router_interface
 
 
-def get_ports_by_subnet(**kwargs):
-    """
-    DVR: RPC called by dvr-agent to get all ports for subnet.
-     Add filter of dhcp port when create
-    """
-    subnet_id = kwargs.get('subnet_id')
-    host_ids = kwargs.get('host_ids', [])
+# A port of a subnet with the segment it is bound to at the bottom level;
+# the segment fields are None for ports that are not bound
+SubnetPort = collections.namedtuple(
+    "SubnetPort", ("id", "host_id", "device_owner", "network_type",
+                   "segmentation_id", "physical_network"))
 
-    core = directory.get_plugin()
-    admin_ctx = neutron_context.get_admin_context()
-    filters = {
-        'binding:host_id': host_ids,
-        'fixed_ips': {'subnet_id': [subnet_id]}
-    }
+_PORT_STREAM_BATCH = 500
+
+
+def get_ports_by_subnet(subnet_id=None, host_ids=None, session=None):
+    """Return the non DHCP ports of a subnet bound to the given hosts.
 
-    LOG.info("Get all ports for subnet, filters params is: \n %s \n",
-             json.dumps(filters, indent=3))
-
-    ports = core.get_ports(admin_ctx, filters=filters)
-    host_port_mappings = {}
-
-    # 'device_owner': 'network:dhcp'
-
-    for port in copy.deepcopy(ports):
-        if port.get("device_owner") == 'network:dhcp':
-            ports.remove(port)
-        host_id = port.get("binding:host_id")
-        port_id = port.get("id")
-        if host_id in host_port_mappings.keys():
-            host_port_mappings[host_id].append(port_id)
-        else:
-            host_port_mappings.update({
-                host_id: [port_id]
-            })
-
-    port_bound_contexts = {}
-    for host, port_ids in host_port_mappings.items():
-        _bound_contexts = core.get_bound_ports_contexts(
-            admin_ctx, port_ids, host
+    Ports are read with their active binding and binding levels in one
+    streamed query, the segment of each port's deepest binding level is
+    returned as ``network_type``, ``segmentation_id`` and
+    ``physical_network``. Without ``host_ids`` ports of all hosts are
+    returned.
+
+    :returns: a list of ``SubnetPort``
+    """
+    session = session or lib_db_api.get_reader_session()
+    with session.begin(subtransactions=True):
+        level = ml2_models.PortBindingLevel
+        segment = segment_models.NetworkSegment
+        query = (
+            session.query(
+                models_v2.Port.id, ml2_models.PortBinding.host,
+                models_v2.Port.device_owner, segment.network_type,
+                segment.segmentation_id, segment.physical_network).
+            join(models_v2.IPAllocation,
+                 models_v2.IPAllocation.port_id == models_v2.Port.id).
+            join(ml2_models.PortBinding,
+                 ml2_models.PortBinding.port_id == models_v2.Port.id).
+            outerjoin(level, and_(level.port_id == models_v2.Port.id,
+                                  level.host == ml2_models.PortBinding.host)).
+            outerjoin(segment, segment.id == level.segment_id).
+            filter(models_v2.IPAllocation.subnet_id == subnet_id,
+                   models_v2.Port.device_owner != n_const.DEVICE_OWNER_DHCP,
+                   ml2_models.PortBinding.status == n_const.ACTIVE).
+            order_by(models_v2.Port.id, level.level)
         )
-        LOG.info("Get host [%s], _bound_contexts is: \n %s \n",
-                 host, _bound_contexts)
-        port_bound_contexts.update(_bound_contexts)
-
-    for port in ports:
-        port_id = port.get("id")
-        port_bound_context = port_bound_contexts.get(port_id)
-        if port_bound_context:
-            segment = port_bound_context.bottom_bound_segment
-            port.update({
-                'network_type': segment[api.NETWORK_TYPE],
-                'segmentation_id': segment[api.SEGMENTATION_ID],
-                'physical_network': segment[api.PHYSICAL_NETWORK]
-            })
+        if host_ids:
+            query = query.filter(
+                ml2_models.PortBinding.host.in_(list(host_ids)))
+
+        ports = []
+        for row in query.yield_per(_PORT_STREAM_BATCH):
+            # Rows of one port are adjacent and ordered by binding level,
+            # the last one holds the bottom bound segment
+            if ports and ports[-1].id == row[0]:
+                ports[-1] = SubnetPort(*row)
+            else:
+                ports.append(SubnetPort(*row))
+
+    LOG.debug("Subnet %(subnet_id)s has %(count)d ports on hosts "
+              "%(host_ids)s", {'subnet_id': subnet_id, 'count': len(ports),
+                               'host_ids': host_ids})
     return ports
 
 
@@ -160,15 +311,50 @@ def get_l2_gw_ip_by_subnet_id(subnet_id=None):
     admin_ctx = neutron_context.get_admin_context()
     subnet_fields = ["cidr", "gateway_ip"]
     subnet = core.get_subnet(admin_ctx, subnet_id, fields=subnet_fields)
-    cidr = subnet.get("cidr")
-    subnet_mask = cidr.split('/')[1]
-    gip = subnet.get("gateway_ip")
-    return "{}/{}".format(gip, subnet_mask)
+    return _gw_and_mask(subnet.get("gateway_ip"), subnet.get("cidr"))
 
 
-def get_subnet_detail_by_network_id(network_id=None):
-    session = lib_db_api.get_reader_session()
-    with session.begin():
+def _gw_and_mask(gateway_ip, cidr):
+    return "{}/{}".format(gateway_ip, cidr.split('/')[1])
+
+
+_subnet_cache = None
+_subnet_cache_lock = threading.Lock()
+
+
+def _get_subnet_cache():
+    global _subnet_cache
+    if _subnet_cache is None:
+        with _subnet_cache_lock:
+            if _subnet_cache is None:
+                conf = cfg.CONF.aster_db
+                _subnet_cache = cache.LRUCache(conf.subnet_cache_size,
+                                               conf.subnet_cache_ttl)
+    return _subnet_cache
+
+
+def invalidate_subnet_cache(network_id=None):
+    """Drop the cached subnet detail of a network, or of all networks."""
+    if network_id is None:
+        _get_subnet_cache().clear()
+    else:
+        _get_subnet_cache().invalidate(network_id)
+
+
+def _invalidate_subnet_cache_on_event(resource, event, trigger, **kwargs):
+    subnet = kwargs.get('subnet') or {}
+    invalidate_subnet_cache(subnet.get('network_id'))
+
+
+def subscribe_subnet_cache_invalidation():
+    for event in (events.AFTER_CREATE, events.AFTER_UPDATE,
+                  events.AFTER_DELETE):
+        registry.subscribe(_invalidate_subnet_cache_on_event,
+                           resources.SUBNET, event)
+
+
+def _query_subnet_detail(session, network_id):
+    with session.begin(subtransactions=True):
         subnet_model = models_v2.Subnet
         db_result = (
             session.query(
@@ -178,22 +364,39 @@ def get_subnet_detail_by_network_id(network_id=None):
                 subnet_model.ip_version
             ).filter_by(network_id=network_id).first()
         )
-        if not db_result:
-            LOG.info("Get subnet detail is: %s", db_result)
-            return db_result
-        result = {
-            k: db_result[index]
-            for index, k in enumerate(
-                ('subnet_id', 'gip', 'cidr', 'ip_version'))
-        }
-        if result:
-            cidr = result.get("cidr")
-            subnet_mask = cidr.split('/')[1]
-            gip = result.get("gip")
-            result["gw_and_mask"] = "{}/{}".format(gip, subnet_mask)
+    if not db_result:
+        LOG.info("Get subnet detail is: %s", db_result)
+        return db_result
+    result = {
+        k: db_result[index]
+        for index, k in enumerate(
+            ('subnet_id', 'gip', 'cidr', 'ip_version'))
+    }
+    result["gw_and_mask"] = _gw_and_mask(result["gip"], result["cidr"])
     return result
 
 
+def get_subnet_detail_by_network_id(network_id=None, session=None):
+    """Return the first subnet of a network, cached per worker.
+
+    Entries are dropped on subnet events, see
+    ``subscribe_subnet_cache_invalidation``. Missing subnets are not
+    cached, the subnet may be created by another worker.
+    """
+    subnet_cache = _get_subnet_cache()
+    result = subnet_cache.get(network_id)
+    if result is not None:
+        metrics.SUBNET_CACHE_LOOKUPS.inc("hit")
+    else:
+        metrics.SUBNET_CACHE_LOOKUPS.inc("miss")
+        result = _query_subnet_detail(
+            session or lib_db_api.get_reader_session(), network_id)
+        if result is not None:
+            subnet_cache.put(network_id, result)
+    # Callers may modify the returned dict
+    return dict(result) if result else result
+
+
 def get_network_gateway_ipv4(port_id):
     """Returns all the routers and IPv4 gateway that have network as gateway"""
     session = lib_db_api.get_reader_session()
@@ -234,11 +437,18 @@ def _format_gateway_result(db_result):
 
 
 def get_vlan_id_by_route_id(switch_ip=None, router_id=None):
-    session, ctx_manager = get_read_session()
-    with ctx_manager:
-        alloc = session.query(aster_models_v2.AsterLeafVlanAllocation). \
-            filter_by(switch_ip=switch_ip, router_id=router_id).first()
-        return alloc.vlan_id if alloc else -1
+    vlan_ids = get_vlan_ids_by_router_ids([router_id]).get(router_id, {})
+    return vlan_ids.get(switch_ip, -1)
+
+
+def get_switch_vlans_by_subnet_id(subnet_id):
+    """Return the (switch_ip, vlan_id) of the switches bound to a subnet."""
+    session = lib_db_api.get_reader_session()
+    with session.begin():
+        # One binding per switch and subnet, see the unique constraint
+        model = aster_models_v2.AsterPortBinding
+        return session.query(model.switch_ip, model.vlan_id).\
+            filter_by(subnet_id=subnet_id).all()
 
 
 def get_network_segments(network_id=None):
@@ -0,0 +1,394 @@
+"""In-memory free ID pools backed by the allocation tables.
+
+Every allocatable ID of the VNI and VLAN pools has a row in an allocation
+table, allocating used to look for the lowest free row of the table. A
+``PoolAllocator`` keeps the free IDs of one pool in memory, as sorted
+disjoint intervals, and only asks the database to confirm its choice:
+
+* the pool is loaded from the free rows of the table on first use, the
+  database groups them into intervals so only one row per interval is
+  returned;
+* an ID is allocated with a conditional UPDATE which only succeeds when
+  the row is still free, the table stays the source of truth;
+* an ID taken by another worker or server in the meantime is dropped and
+  the next one is tried, after too many such misses or when the pool runs
+  empty it is reloaded from the table.
+
+Memory is proportional to the number of free intervals, not to the size
+of the pool.
+"""
+
+import bisect
+import threading
+
+from oslo_log import log as logging
+from six import moves
+import sqlalchemy as sa
+
+from networking_afc.db import pool_stats
+
+
+LOG = logging.getLogger(__name__)
+
+# Reload a pool after this many IDs in a row were taken by somebody else
+MAX_MISSES = 16
+
+# Free IDs fetched at once when the database has no window functions
+_LOAD_BATCH = 10000
+
+
+class FreeIdSet(object):
+    """Set of integer IDs stored as sorted disjoint inclusive intervals.
+
+    Intervals before ``_head`` are exhausted, which makes taking the lowest
+    ID O(1); they are dropped once they make up half of the lists.
+    """
+
+    __slots__ = ("_starts", "_ends", "_head", "_len")
+
+    def __init__(self, intervals=()):
+        self._starts = []
+        self._ends = []
+        self._head = 0
+        self._len = 0
+        for start, end in intervals:
+            self._append(start, end)
+
+    @classmethod
+    def from_sorted_ids(cls, ids):
+        """Build the set from IDs in ascending order, coalescing runs."""
+        free_ids = cls()
+        for free_id in ids:
+            free_ids._append(free_id, free_id)
+        return free_ids
+
+    def _append(self, start, end):
+        if self._ends and start <= self._ends[-1]:
+            raise ValueError("Intervals must be sorted and disjoint")
+        if self._ends and self._ends[-1] + 1 == start:
+            self._ends[-1] = end
+        else:
+            self._starts.append(start)
+            self._ends.append(end)
+        self._len += end - start + 1
+
+    def __len__(self):
+        return self._len
+
+    def __bool__(self):
+        return self._len > 0
+
+    __nonzero__ = __bool__
+
+    def _find(self, id_):
+        # Index of the interval containing ``id_``, or -1
+        index = bisect.bisect_right(self._starts, id_, self._head) - 1
+        if index >= self._head and id_ <= self._ends[index]:
+            return index
+        return -1
+
+    def __contains__(self, id_):
+        return self._find(id_) >= 0
+
+    def __iter__(self):
+        for index in moves.range(self._head, len(self._starts)):
+            for id_ in moves.range(self._starts[index],
+                                   self._ends[index] + 1):
+                yield id_
+
+    def intervals(self):
+        return list(zip(self._starts[self._head:], self._ends[self._head:]))
+
+    def pop_lowest(self):
+        """Remove and return the lowest ID, None if the set is empty."""
+        if not self._len:
+            return None
+        head = self._head
+        id_ = self._starts[head]
+        if id_ == self._ends[head]:
+            self._head += 1
+            if self._head * 2 > len(self._starts):
+                del self._starts[:self._head]
+                del self._ends[:self._head]
+                self._head = 0
+        else:
+            self._starts[head] = id_ + 1
+        self._len -= 1
+        return id_
+
+    def add(self, id_):
+        index = bisect.bisect_right(self._starts, id_, self._head)
+        if index > self._head and id_ <= self._ends[index - 1]:
+            return
+        joins_left = index > self._head and self._ends[index - 1] + 1 == id_
+        joins_right = (index < len(self._starts) and
+                       self._starts[index] - 1 == id_)
+        if joins_left and joins_right:
+            self._ends[index - 1] = self._ends[index]
+            del self._starts[index]
+            del self._ends[index]
+        elif joins_left:
+            self._ends[index - 1] = id_
+        elif joins_right:
+            self._starts[index] = id_
+        else:
+            self._starts.insert(index, id_)
+            self._ends.insert(index, id_)
+        self._len += 1
+
+    def discard(self, id_):
+        index = self._find(id_)
+        if index < 0:
+            return False
+        start, end = self._starts[index], self._ends[index]
+        if start == end:
+            del self._starts[index]
+            del self._ends[index]
+        elif id_ == start:
+            self._starts[index] = id_ + 1
+        elif id_ == end:
+            self._ends[index] = id_ - 1
+        else:
+            self._ends[index] = id_ - 1
+            self._starts.insert(index + 1, id_ + 1)
+            self._ends.insert(index + 1, end)
+        self._len -= 1
+        return True
+
+
+class PoolAllocator(object):
+    """Allocate the IDs of one pool from memory, confirmed by the DB.
+
+    :param name: pool name used in logs
+    :param load_free_ids: ``load_free_ids(session)`` returns the free IDs
+        of the pool stored in the database as a ``FreeIdSet``
+    :param claim: ``claim(session, id, owner)`` marks a free ID as
+        allocated to ``owner`` with a conditional UPDATE and returns
+        whether a row was updated
+    :param claim_many: ``claim_many(session, ids, owner)`` marks the IDs
+        among ``ids`` that are still free as allocated to ``owner`` with a
+        locking SELECT and a single UPDATE and returns them, optional
+    """
+
+    def __init__(self, name, load_free_ids, claim, claim_many=None):
+        self.name = name
+        self._load_free_ids = load_free_ids
+        self._claim = claim
+        self._claim_many = claim_many
+        self._free_ids = None
+        self._lock = threading.Lock()
+
+    def reload(self, session):
+        free_ids = self._load_free_ids(session)
+        with self._lock:
+            self._free_ids = free_ids
+        LOG.debug("Loaded %(count)d free IDs in %(intervals)d intervals "
+                  "of pool %(pool)s", {'count': len(free_ids),
+                                       'intervals': len(free_ids.intervals()),
+                                       'pool': self.name})
+
+    def invalidate(self):
+        """Reload the pool from the table on its next use."""
+        with self._lock:
+            self._free_ids = None
+
+    def _pop(self):
+        with self._lock:
+            if self._free_ids is None:
+                return None
+            return self._free_ids.pop_lowest()
+
+    def _pop_many(self, count):
+        with self._lock:
+            ids = []
+            while self._free_ids and len(ids) < count:
+                ids.append(self._free_ids.pop_lowest())
+            return ids
+
+    def allocate(self, session, owner=None):
+        """Allocate the lowest free ID known to be free.
+
+        :returns: the allocated ID, None when the pool is exhausted
+        """
+        misses = 0
+        reloaded = self._free_ids is None
+        if reloaded:
+            self.reload(session)
+        while True:
+            candidate = self._pop()
+            if candidate is None:
+                if reloaded:
+                    return None
+                # Other workers may have released IDs
+                self.reload(session)
+                reloaded = True
+                continue
+            try:
+                claimed = self._claim(session, candidate, owner)
+            except Exception:
+                self.release(candidate)
+                raise
+            if claimed:
+                return candidate
+            misses += 1
+            if misses >= MAX_MISSES and not reloaded:
+                LOG.debug("Pool %s is out of date, reloading it",
+                          self.name)
+                self.reload(session)
+                reloaded = True
+
+    def allocate_many(self, session, count, owner=None):
+        """Allocate up to ``count`` of the lowest free IDs together.
+
+        :returns: the allocated IDs, fewer than ``count`` when the pool is
+            exhausted
+        """
+        if self._claim_many is None:
+            ids = []
+            while len(ids) < count:
+                id_ = self.allocate(session, owner)
+                if id_ is None:
+                    break
+                ids.append(id_)
+            return ids
+
+        ids = []
+        reloaded = self._free_ids is None
+        if reloaded:
+            self.reload(session)
+        while len(ids) < count:
+            candidates = self._pop_many(count - len(ids))
+            if not candidates:
+                if reloaded:
+                    break
+                self.reload(session)
+                reloaded = True
+                continue
+            try:
+                claimed = self._claim_many(session, candidates, owner)
+            except Exception:
+                for candidate in candidates:
+                    self.release(candidate)
+                raise
+            ids.extend(claimed)
+            if len(claimed) < len(candidates) and not reloaded:
+                # Taken by somebody else, the pool is out of date
+                self.reload(session)
+                reloaded = True
+        return ids
+
+    def release(self, id_):
+        """Return an ID released in the table to the pool."""
+        with self._lock:
+            if self._free_ids is not None:
+                self._free_ids.add(id_)
+
+    def remove(self, id_):
+        """Drop an ID allocated or deleted without the allocator."""
+        with self._lock:
+            if self._free_ids is not None:
+                self._free_ids.discard(id_)
+
+
+def _has_window_functions(dialect):
+    version = dialect.server_version_info or ()
+    if dialect.name == "mysql":
+        if getattr(dialect, "_is_mariadb", False):
+            return getattr(dialect, "_is_mariadb_102", False)
+        return version >= (8,)
+    if dialect.name == "sqlite":
+        return version >= (3, 25)
+    return True
+
+
+def load_free_intervals(session, id_column, *criteria):
+    """Return the IDs of the rows matching ``criteria`` as a FreeIdSet.
+
+    Consecutive IDs have the same difference to their row number, the
+    intervals are the min and max ID of each such group. Databases without
+    window functions return the IDs themselves, fetched in batches.
+    """
+    if _has_window_functions(session.get_bind().dialect):
+        ids = sa.select([
+            id_column.label("id"),
+            (id_column - sa.func.row_number().over(order_by=id_column)).
+            label("island")]).where(sa.and_(*criteria)).alias("free_ids")
+        first_id = sa.func.min(ids.c.id)
+        return FreeIdSet(session.execute(
+            sa.select([first_id, sa.func.max(ids.c.id)]).
+            group_by(ids.c.island).order_by(first_id)))
+    query = session.query(id_column).filter(*criteria).order_by(id_column)
+    return FreeIdSet.from_sorted_ids(
+        id_ for id_, in query.yield_per(_LOAD_BATCH))
+
+
+def router_pool(name, model, id_column, **filters):
+    """Pool of a table whose free rows have an empty ``router_id``.
+
+    Allocations are counted in the ``pool_stats`` counters of ``name``.
+    """
+
+    def load_free_ids(session):
+        return load_free_intervals(
+            session, id_column, model.router_id == "",
+            *[getattr(model, key) == value
+              for key, value in filters.items()])
+
+    def claim(session, id_, router_id):
+        with session.begin(subtransactions=True):
+            claimed = session.query(model).filter(
+                id_column == id_, model.router_id == "").filter_by(
+                    **filters).update({"router_id": router_id},
+                                      synchronize_session=False) == 1
+            if claimed:
+                pool_stats.adjust(session, name, allocated=1)
+            return claimed
+
+    def claim_many(session, ids, router_id):
+        with session.begin(subtransactions=True):
+            free = session.query(model).filter(
+                id_column.in_(ids), model.router_id == "").filter_by(
+                    **filters)
+            claimed = [id_ for id_, in free.with_entities(
+                id_column).order_by(id_column).with_for_update()]
+            if claimed:
+                free.filter(id_column.in_(claimed)).update(
+                    {"router_id": router_id}, synchronize_session=False)
+                pool_stats.adjust(session, name, allocated=len(claimed))
+            return claimed
+
+    return PoolAllocator(name, load_free_ids, claim, claim_many)
+
+
+def flag_pool(name, model, id_column):
+    """Pool of a table whose free rows have ``allocated`` set to False.
+
+    Allocations are counted in the ``pool_stats`` counters of ``name``.
+    """
+
+    def load_free_ids(session):
+        return load_free_intervals(session, id_column,
+                                   model.allocated == sa.false())
+
+    def claim(session, id_, owner):
+        with session.begin(subtransactions=True):
+            claimed = session.query(model).filter(
+                id_column == id_).filter_by(allocated=False).update(
+                    {"allocated": True}, synchronize_session=False) == 1
+            if claimed:
+                pool_stats.adjust(session, name, allocated=1)
+            return claimed
+
+    def claim_many(session, ids, owner):
+        with session.begin(subtransactions=True):
+            free = session.query(model).filter(
+                id_column.in_(ids)).filter_by(allocated=False)
+            claimed = [id_ for id_, in free.with_entities(
+                id_column).order_by(id_column).with_for_update()]
+            if claimed:
+                free.filter(id_column.in_(claimed)).update(
+                    {"allocated": True}, synchronize_session=False)
+                pool_stats.adjust(session, name, allocated=len(claimed))
+            return claimed
+
+    return PoolAllocator(name, load_free_ids, claim, claim_many)
@@ -0,0 +1,340 @@
+"""Free interval storage of the VNI pools.
+
+By default every allocatable VNI has a row in its allocation table, which
+makes ``ml2_aster_vxlan_allocations``, ``ml2_aster_l3_vni_allocations``
+and ``ml2_leaf_l2_vni_allocations`` as large as the configured ranges.
+With ``[aster_db] vni_pool_storage = ranges`` the allocation tables only
+hold the allocated VNIs and the free VNIs of each pool are stored as
+intervals in ``ml2_aster_free_ranges``:
+
+* allocating an ID removes it from its interval, splitting it when
+  needed, then inserts the allocated row;
+* releasing an ID deletes its row and merges it back into the intervals;
+* ``sync_pool`` rebuilds the intervals of a pool from its configured
+  ranges and allocated rows when the server starts, then deletes the
+  free rows of the row per ID layout in batches. This is the online
+  migration between both modes, the pool stays usable while it runs.
+
+Switching back to ``rows`` clears the intervals, the allocation managers
+then insert the missing free rows again.
+"""
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from neutron_lib.db import api as lib_db_api
+import sqlalchemy as sa
+
+from networking_afc.common import config  # noqa
+from networking_afc.common import range_set
+from networking_afc.db import allocator
+from networking_afc.db import pool_stats
+from networking_afc.db.models import aster_models_v2
+
+
+LOG = logging.getLogger(__name__)
+
+ROWS = "rows"
+RANGES = "ranges"
+
+POOL_VXLAN = "aster_vxlan"
+POOL_L2_VNI = "l2_vni"
+POOL_L3_VNI = "l3_vni"
+
+# Free rows deleted per transaction when converting a pool
+BATCH_SIZE = 1000
+
+
+def ranges_enabled():
+    return cfg.CONF.aster_db.vni_pool_storage == RANGES
+
+
+def free_intervals(id_ranges, allocated_ids):
+    """Subtract the allocated IDs from the configured ranges.
+
+    :param id_ranges: ``[(min, max), ...]`` inclusive ranges, they may
+        overlap
+    :param allocated_ids: iterable of allocated IDs
+    :returns: sorted disjoint ``[(first_id, last_id), ...]``
+    """
+    merged = range_set.RangeSet(id_ranges).ranges()
+    intervals = []
+    allocated = sorted(set(allocated_ids))
+    index = 0
+    for first_id, last_id in merged:
+        while index < len(allocated) and allocated[index] < first_id:
+            index += 1
+        while index < len(allocated) and allocated[index] <= last_id:
+            if allocated[index] > first_id:
+                intervals.append((first_id, allocated[index] - 1))
+            first_id = allocated[index] + 1
+            index += 1
+        if first_id <= last_id:
+            intervals.append((first_id, last_id))
+    return intervals
+
+
+def load_intervals(session, pool):
+    model = aster_models_v2.AsterFreeRange
+    return [(first_id, last_id) for first_id, last_id in
+            session.query(model.first_id, model.last_id).
+            filter_by(pool=pool).order_by(model.first_id)]
+
+
+def _containing(session, pool, id_):
+    # The locking read sees the latest committed intervals even in a
+    # REPEATABLE READ transaction
+    model = aster_models_v2.AsterFreeRange
+    row = (session.query(model.first_id, model.last_id).
+           filter(model.pool == pool, model.first_id <= id_).
+           order_by(model.first_id.desc()).with_for_update().first())
+    if row is not None and row.last_id >= id_:
+        return row
+    return None
+
+
+def _runs(ids):
+    # Consecutive IDs of a sorted list as (first_id, last_id) runs
+    runs = []
+    for id_ in ids:
+        if runs and runs[-1][1] + 1 == id_:
+            runs[-1][1] = id_
+        else:
+            runs.append([id_, id_])
+    return runs
+
+
+def take_free_run(session, pool, first_id, last_id):
+    """Remove the free IDs from ``first_id`` up to ``last_id`` from the
+    intervals of ``pool``, stopping at the end of the interval holding
+    ``first_id``.
+
+    :returns: the last ID removed, None when ``first_id`` is not free
+    """
+    model = aster_models_v2.AsterFreeRange
+    with session.begin(subtransactions=True):
+        row = _containing(session, pool, first_id)
+        if row is None:
+            return None
+        deleted = session.query(model).filter_by(
+            pool=pool, first_id=row.first_id, last_id=row.last_id).delete(
+                synchronize_session=False)
+        if deleted != 1:
+            return None
+        last_id = min(last_id, row.last_id)
+        remainders = []
+        if row.first_id < first_id:
+            remainders.append({'pool': pool, 'first_id': row.first_id,
+                               'last_id': first_id - 1})
+        if last_id < row.last_id:
+            remainders.append({'pool': pool, 'first_id': last_id + 1,
+                               'last_id': row.last_id})
+        if remainders:
+            session.execute(model.__table__.insert(), remainders)
+        return last_id
+
+
+def take_free_id(session, pool, id_):
+    """Remove a free ID from the intervals of ``pool``.
+
+    :returns: False when the ID is not free
+    """
+    return take_free_run(session, pool, id_, id_) is not None
+
+
+def _merge_run(session, pool, first_id, last_id):
+    # Merge IDs none of which is free into the intervals
+    model = aster_models_v2.AsterFreeRange
+    query = session.query(model).filter_by(pool=pool)
+    left = (session.query(model.first_id).
+            filter_by(pool=pool, last_id=first_id - 1).
+            with_for_update().scalar())
+    right = (session.query(model.last_id).
+             filter_by(pool=pool, first_id=last_id + 1).
+             with_for_update().scalar())
+    if right is not None:
+        query.filter_by(first_id=last_id + 1).delete(
+            synchronize_session=False)
+        last_id = right
+    if left is not None:
+        query.filter_by(first_id=left).update(
+            {'last_id': last_id}, synchronize_session=False)
+    else:
+        session.execute(model.__table__.insert(),
+                        {'pool': pool, 'first_id': first_id,
+                         'last_id': last_id})
+
+
+def add_free_id(session, pool, id_):
+    """Merge a released ID into the intervals of ``pool``."""
+    with session.begin(subtransactions=True):
+        if _containing(session, pool, id_) is not None:
+            return
+        _merge_run(session, pool, id_, id_)
+
+
+def claim_free_id(session, pool, id_column, id_, values):
+    """Take a free ID of ``pool`` and store its allocated row.
+
+    :param values: column values of the allocated row, besides the ID
+    :returns: False when the ID is not free
+    """
+    model = id_column.class_
+    with session.begin(subtransactions=True):
+        if not take_free_id(session, pool, id_):
+            return False
+        # A free row is left while the pool is being converted
+        if not session.query(model).filter(id_column == id_).update(
+                values, synchronize_session=False):
+            row = dict(values)
+            row[id_column.key] = id_
+            session.execute(model.__table__.insert(), row)
+        return True
+
+
+def claim_free_ids(session, pool, id_column, ids, values):
+    """Take the free IDs among ``ids`` and store their allocated rows.
+
+    Consecutive IDs are taken from their interval together and the rows
+    are inserted in a single statement.
+
+    :param ids: sorted IDs
+    :param values: column values of the allocated rows, besides the ID
+    :returns: the IDs claimed
+    """
+    model = id_column.class_
+    claimed = []
+    with session.begin(subtransactions=True):
+        for first_id, last_id in _runs(ids):
+            while first_id <= last_id:
+                taken = take_free_run(session, pool, first_id, last_id)
+                if taken is None:
+                    first_id += 1
+                    continue
+                claimed.extend(range(first_id, taken + 1))
+                first_id = taken + 1
+        if claimed:
+            # Free rows are left while the pool is being converted
+            session.query(model).filter(id_column.in_(claimed)).delete(
+                synchronize_session=False)
+            rows = []
+            for id_ in claimed:
+                row = dict(values)
+                row[id_column.key] = id_
+                rows.append(row)
+            session.execute(model.__table__.insert(), rows)
+    return claimed
+
+
+def add_free_ids(session, pool, ids):
+    """Merge released IDs into the intervals of ``pool``.
+
+    Runs of consecutive IDs are merged together.
+    """
+    model = aster_models_v2.AsterFreeRange
+    with session.begin(subtransactions=True):
+        for first_id, last_id in _runs(sorted(ids)):
+            if session.query(model.first_id).filter(
+                    model.pool == pool, model.first_id <= last_id,
+                    model.last_id >= first_id).with_for_update().first():
+                # Some of them are free already
+                for id_ in range(first_id, last_id + 1):
+                    add_free_id(session, pool, id_)
+            else:
+                _merge_run(session, pool, first_id, last_id)
+
+
+def clear_pool(session, pool):
+    model = aster_models_v2.AsterFreeRange
+    with session.begin(subtransactions=True):
+        session.query(model).filter_by(pool=pool).delete(
+            synchronize_session=False)
+
+
+def sync_pool(pool, id_column, free_clause, id_ranges,
+              batch_size=BATCH_SIZE):
+    """Store the free IDs of ``pool`` as intervals.
+
+    :param pool: pool name, one of the ``POOL_*`` constants
+    :param id_column: ID column of the allocation table
+    :param free_clause: filter matching the free rows of the table
+    :param id_ranges: configured ``[(min, max), ...]`` ranges of the pool
+    """
+    model = aster_models_v2.AsterFreeRange
+    session = lib_db_api.get_writer_session()
+    with session.begin(subtransactions=True):
+        # Claims insert their allocated row, which the lock on the
+        # allocated rows does not block, after locking the interval they
+        # take the ID from. Locking the intervals of the pool first makes
+        # them wait for the rebuilt intervals instead of committing an ID
+        # read as free below.
+        session.query(model.first_id).filter_by(pool=pool).\
+            with_for_update().all()
+        allocated_ids = [id_ for id_, in session.query(id_column).
+                         filter(sa.not_(free_clause)).with_for_update()]
+        intervals = free_intervals(id_ranges, allocated_ids)
+        clear_pool(session, pool)
+        for start in range(0, len(intervals), batch_size):
+            session.execute(model.__table__.insert(), [
+                {'pool': pool, 'first_id': first_id, 'last_id': last_id}
+                for first_id, last_id in intervals[start:start + batch_size]])
+
+    # Convert the row per ID layout. Allocations claim a remaining free
+    # row instead of inserting one, so the pool is usable meanwhile.
+    removed = 0
+    while True:
+        with session.begin(subtransactions=True):
+            ids = [id_ for id_, in session.query(id_column).
+                   filter(free_clause).limit(batch_size)]
+            if not ids:
+                break
+            removed += session.query(id_column.class_).filter(
+                free_clause, id_column.in_(ids)).delete(
+                    synchronize_session=False)
+    LOG.info("Stored %(count)d free intervals of pool %(pool)s, removed "
+             "%(removed)d free rows", {'count': len(intervals),
+                                       'pool': pool, 'removed': removed})
+
+
+def range_pool(pool, id_column, owner_values):
+    """Pool allocator of a pool stored as free intervals.
+
+    :param owner_values: ``owner_values(owner)`` returns the column values
+        of an allocated row
+    """
+
+    def load_free_ids(session):
+        return allocator.FreeIdSet(load_intervals(session, pool))
+
+    def claim(session, id_, owner):
+        with session.begin(subtransactions=True):
+            claimed = claim_free_id(session, pool, id_column, id_,
+                                    owner_values(owner))
+            if claimed:
+                pool_stats.adjust(session, pool, allocated=1)
+            return claimed
+
+    def claim_many(session, ids, owner):
+        with session.begin(subtransactions=True):
+            claimed = claim_free_ids(session, pool, id_column, ids,
+                                     owner_values(owner))
+            if claimed:
+                pool_stats.adjust(session, pool, allocated=len(claimed))
+            return claimed
+
+    return allocator.PoolAllocator(pool, load_free_ids, claim, claim_many)
+
+
+def router_pool(pool, model, id_column):
+    """Allocator of a pool whose rows are owned by a ``router_id``."""
+    if ranges_enabled():
+        return range_pool(pool, id_column,
+                          lambda router_id: {'router_id': router_id})
+    return allocator.router_pool(pool, model, id_column)
+
+
+def flag_pool(pool, model, id_column):
+    """Allocator of a pool whose rows have an ``allocated`` flag."""
+    if ranges_enabled():
+        return range_pool(pool, id_column,
+                          lambda owner: {'allocated': True})
+    return allocator.flag_pool(pool, model, id_column)
@@ -0,0 +1,146 @@
+"""Host to switch interface mappings of the CX switches.
+
+The mappings are kept in ``aster_ml2_cx_host_interface_mappings``, one row
+per switch and host, and looked up by host when ports are bound and
+configured. They are loaded from the ``[ml2_mech_aster_cx:<switch_ip>]``
+config sections at startup, or managed with ``neutron-afc-host-mappings``.
+"""
+
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_log import log as logging
+from neutron_lib.db import api as lib_db_api
+from sqlalchemy import orm
+
+from networking_afc.common import config
+from networking_afc.db.models import aster_models_v2
+
+
+LOG = logging.getLogger(__name__)
+
+INTERFACE_SEPARATOR = ","
+
+_CHUNK_SIZE = 500
+
+
+def _chunks(items, size=_CHUNK_SIZE):
+    items = list(items)
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def mappings_from_switch_infos(switch_infos):
+    """Flatten switch infos in the ``cx_switches`` format into rows.
+
+    :param switch_infos: ``{switch_ip: {"physnet": ...,
+        "host_ports_mapping": {host_id: [interface, ...]}}}``
+    :returns: ``{(switch_ip, host_id): (switch_interfaces,
+        physical_network)}``
+    """
+    mappings = {}
+    for switch_ip, switch_info in (switch_infos or {}).items():
+        physical_network = switch_info.get("physnet") or ""
+        host_ports_mapping = switch_info.get("host_ports_mapping") or {}
+        for host_id, interfaces in host_ports_mapping.items():
+            mappings[(switch_ip, host_id)] = (
+                INTERFACE_SEPARATOR.join(interfaces), physical_network)
+    return mappings
+
+
+def replace_host_mappings(mappings, switch_ips=None, session=None):
+    """Make the stored mappings of some switches equal to ``mappings``.
+
+    :param mappings: rows as returned by ``mappings_from_switch_infos``
+    :param switch_ips: switches whose rows are replaced, rows of other
+        switches are kept. None replaces the whole table.
+    :returns: the number of added, updated and removed rows
+    """
+    model = aster_models_v2.AsterCxHostMapping
+    session = session or lib_db_api.get_writer_session()
+    with session.begin(subtransactions=True):
+        query = session.query(model.id, model.switch_ip, model.host_id,
+                              model.switch_interfaces,
+                              model.physical_network)
+        if switch_ips is not None:
+            switch_ips = list(switch_ips)
+            if not switch_ips:
+                return 0, 0, 0
+            query = query.filter(model.switch_ip.in_(switch_ips))
+        stored = dict(((row.switch_ip, row.host_id), row) for row in query)
+
+        removed = [row.id for key, row in stored.items()
+                   if key not in mappings]
+        updated = []
+        added = []
+        for (switch_ip, host_id), (interfaces, physical_network) in (
+                mappings.items()):
+            row = stored.get((switch_ip, host_id))
+            if row is None:
+                added.append({"switch_ip": switch_ip, "host_id": host_id,
+                              "switch_interfaces": interfaces,
+                              "physical_network": physical_network})
+            elif (row.switch_interfaces, row.physical_network) != (
+                    interfaces, physical_network):
+                updated.append({"id": row.id,
+                                "switch_interfaces": interfaces,
+                                "physical_network": physical_network})
+
+        for ids in _chunks(removed):
+            session.query(model).filter(model.id.in_(ids)).delete(
+                synchronize_session=False)
+        if updated:
+            session.bulk_update_mappings(model, updated)
+        if added:
+            session.bulk_insert_mappings(model, added)
+    return len(added), len(updated), len(removed)
+
+
+def sync_from_config(session=None):
+    """Replace the stored mappings with the ``ml2_mech_aster_cx`` sections.
+
+    Does nothing when [aster_db] sync_host_mappings is disabled, the
+    mappings are then managed with ``neutron-afc-host-mappings``.
+    """
+    if not cfg.CONF.aster_db.sync_host_mappings:
+        return
+    mappings = mappings_from_switch_infos(config.cx_switches())
+    try:
+        added, updated, removed = replace_host_mappings(mappings,
+                                                        session=session)
+    except db_exc.DBDuplicateEntry:
+        # Another server synced the same config concurrently
+        LOG.info("Host mappings were synced by another server")
+        return
+    LOG.info("Synced host mappings from config: %(added)d added, "
+             "%(updated)d updated, %(removed)d removed",
+             {'added': added, 'updated': updated, 'removed': removed})
+
+
+def get_host_connections(host_id, session=None):
+    """Return the switches a host is connected to.
+
+    Each switch is returned as ``(switch_ip, {"physnet": ...,
+    "host_ports_mapping": {host_id: [interface, ...]}})`` with the mappings
+    of all hosts connected to the switch, sorted by switch_ip.
+    """
+    model = aster_models_v2.AsterCxHostMapping
+    host_rows = orm.aliased(model)
+    # Decides the switches to configure, not read from the replica
+    session = session or lib_db_api.get_reader_session()
+    with session.begin(subtransactions=True):
+        rows = (
+            session.query(model.switch_ip, model.host_id,
+                          model.switch_interfaces, model.physical_network).
+            join(host_rows, host_rows.switch_ip == model.switch_ip).
+            filter(host_rows.host_id == host_id).
+            order_by(model.switch_ip, model.host_id).all()
+        )
+
+    connections = []
+    for switch_ip, row_host_id, interfaces, physical_network in rows:
+        if not connections or connections[-1][0] != switch_ip:
+            connections.append((switch_ip, {"physnet": physical_network,
+                                            "host_ports_mapping": {}}))
+        connections[-1][1]["host_ports_mapping"][row_host_id] = (
+            interfaces.split(INTERFACE_SEPARATOR) if interfaces else [])
+    return connections
@@ -0,0 +1,109 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""normalize port bindings
+
+Back-fills the legacy port binding rows not migrated yet by
+neutron-afc-migrate-port-bindings, converts vlan_id to an integer and
+makes (switch_ip, subnet_id) unique. Legacy rows that could not be
+back-filled are kept with a NULL subnet_id. The migration fails, before
+changing the schema, when a vlan_id is not a number.
+
+Revision ID: 7f3a9c1d2e85
+Revises: 1d271ead4eb6
+Create Date: 2026-10-19 16:48:12.306751
+
+"""
+
+from alembic import op
+from oslo_log import log as logging
+import sqlalchemy as sa
+
+from networking_afc.db.migration import port_binding_data
+
+
+# revision identifiers, used by Alembic.
+revision = '7f3a9c1d2e85'
+down_revision = '1d271ead4eb6'
+# The physical network of the switches is read from the host mappings, or
+# from the ml2_mech_aster_cx sections when neutron-server did not store
+# them yet
+depends_on = ('3b8e6f0a7c21',)
+
+LOG = logging.getLogger(__name__)
+
+TABLE = 'aster_ml2_port_bindings'
+
+
+def upgrade():
+    connection = op.get_bind()
+    # Fails when the physical networks of the switches are unknown, the
+    # legacy bindings would all be left unresolved
+    physnets = port_binding_data.load_switch_physnets(connection)
+    after_id = 0
+    invalid = []
+    while True:
+        result = port_binding_data.migrate_batch(connection, after_id,
+                                                 physnets=physnets)
+        if result is None:
+            break
+        after_id = result.last_id
+        invalid.extend(result.invalid)
+
+    if invalid:
+        # The bindings cannot be read with an integer vlan_id, whether
+        # they can be deleted is up to the operator
+        raise port_binding_data.InvalidVlanIds(invalid)
+
+    # Only one binding per switch and subnet is ever created, drop the
+    # duplicates concurrent port binds may have left. The subquery is
+    # wrapped in a derived table for MySQL, which refuses to select from
+    # the table it deletes from.
+    op.execute(
+        "DELETE FROM {table} WHERE switch_ip IS NOT NULL "
+        "AND subnet_id IS NOT NULL AND subnet_id != '' "
+        "AND binding_id NOT IN ("
+        "SELECT keep_id FROM (SELECT MIN(binding_id) AS keep_id "
+        "FROM {table} GROUP BY switch_ip, subnet_id) AS keep)".format(
+            table=TABLE))
+
+    with op.batch_alter_table(TABLE) as batch_op:
+        # Drop the '' default first, it is no valid integer
+        batch_op.alter_column('vlan_id',
+                              existing_type=sa.String(36),
+                              existing_nullable=False,
+                              server_default=None)
+        batch_op.alter_column('vlan_id',
+                              type_=sa.Integer(),
+                              existing_type=sa.String(36),
+                              existing_nullable=False,
+                              postgresql_using='vlan_id::integer')
+        batch_op.alter_column('subnet_id',
+                              existing_type=sa.String(36),
+                              nullable=True)
+
+    bindings = port_binding_data.bindings
+    unresolved = connection.execute(bindings.update().where(
+        bindings.c.subnet_id == '').values(subnet_id=None)).rowcount
+    if unresolved:
+        # Several of them may be bound to the same switch
+        LOG.warning("%d legacy port bindings could not be back-filled, "
+                    "their subnet_id is set to NULL", unresolved)
+
+    with op.batch_alter_table(TABLE) as batch_op:
+        batch_op.drop_index('ix_aster_ml2_port_bindings_switch_ip_subnet_id')
+        batch_op.create_unique_constraint(
+            'uniq_aster_ml2_port_bindings0switch_ip0subnet_id',
+            ['switch_ip', 'subnet_id'])
@@ -0,0 +1,38 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add replica heartbeats
+
+Revision ID: 1e5a9b3c7d40
+Revises: 4f6b8d0e2c59
+Create Date: 2026-10-19 21:12:05.304417
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '1e5a9b3c7d40'
+down_revision = '4f6b8d0e2c59'
+
+
+def upgrade():
+    op.create_table(
+        'ml2_aster_replica_heartbeats',
+        sa.Column('id', sa.Integer(), autoincrement=False, nullable=False),
+        sa.Column('beat_at', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('id'))
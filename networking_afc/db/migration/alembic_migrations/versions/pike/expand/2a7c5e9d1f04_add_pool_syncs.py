@@ -0,0 +1,41 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add pool syncs
+
+Revision ID: 2a7c5e9d1f04
+Revises: 6d1f8a2b4c97
+Create Date: 2026-10-19 17:38:52.604117
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '2a7c5e9d1f04'
+down_revision = '6d1f8a2b4c97'
+
+
+def upgrade():
+    op.create_table(
+        'ml2_aster_pool_syncs',
+        sa.Column('pool', sa.String(64), nullable=False),
+        sa.Column('config_digest', sa.String(64), nullable=True),
+        sa.Column('owner', sa.String(255), nullable=True),
+        sa.Column('lease_expires', sa.DateTime(), nullable=True),
+        sa.Column('synced_at', sa.DateTime(), nullable=True),
+        sa.PrimaryKeyConstraint('pool'))
@@ -0,0 +1,40 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add host mapping indexes
+
+Revision ID: 3b8e6f0a7c21
+Revises: 9e4b1c7a2d6f
+Create Date: 2026-10-19 14:21:05.730412
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '3b8e6f0a7c21'
+down_revision = '9e4b1c7a2d6f'
+
+TABLE = 'aster_ml2_cx_host_interface_mappings'
+
+
+def upgrade():
+    # The table was never written before, it holds no duplicates
+    op.create_unique_constraint(
+        'uniq_aster_ml2_cx_host_interface_mappings0switch_ip0host_id',
+        TABLE, ['switch_ip', 'host_id'])
+    op.create_index('ix_aster_ml2_cx_host_interface_mappings_host_id',
+                    TABLE, ['host_id'])
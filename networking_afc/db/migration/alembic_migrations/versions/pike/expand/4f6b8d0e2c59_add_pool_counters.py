@@ -0,0 +1,42 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add pool counters
+
+Revision ID: 4f6b8d0e2c59
+Revises: 8c4d2e6f1a37
+Create Date: 2026-10-19 18:47:21.530912
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '4f6b8d0e2c59'
+down_revision = '8c4d2e6f1a37'
+
+
+def upgrade():
+    op.create_table(
+        'ml2_aster_pool_counters',
+        sa.Column('pool', sa.String(64), nullable=False),
+        sa.Column('shard', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('total', sa.Integer(), nullable=False),
+        sa.Column('allocated', sa.Integer(), nullable=False),
+        sa.Column('outside', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('pool', 'shard'))
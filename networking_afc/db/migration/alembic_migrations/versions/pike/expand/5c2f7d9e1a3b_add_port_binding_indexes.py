@@ -0,0 +1,48 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add port binding indexes
+
+Revision ID: 5c2f7d9e1a3b
+Revises: 083111d60f52
+Create Date: 2026-10-19 10:12:31.418203
+
+"""
+
+from alembic import op
+
+
+# revision identifiers, used by Alembic.
+revision = '5c2f7d9e1a3b'
+down_revision = '083111d60f52'
+
+TABLE = 'aster_ml2_port_bindings'
+
+
+def upgrade():
+    # Serves the lookups by (switch_ip, subnet_id[, is_config_l2]). Legacy
+    # bindings share subnet_id '' until they are back-filled, the contract
+    # migration 7f3a9c1d2e85 replaces it with a unique constraint.
+    op.create_index(
+        'ix_aster_ml2_port_bindings_switch_ip_subnet_id',
+        TABLE, ['switch_ip', 'subnet_id'])
+    # Bindings of a router on a switch
+    op.create_index(
+        'ix_aster_ml2_port_bindings_switch_ip_router_id',
+        TABLE, ['switch_ip', 'router_id'])
+    # Bindings of a subnet grouped by switch
+    op.create_index(
+        'ix_aster_ml2_port_bindings_subnet_id_switch_ip',
+        TABLE, ['subnet_id', 'switch_ip'])
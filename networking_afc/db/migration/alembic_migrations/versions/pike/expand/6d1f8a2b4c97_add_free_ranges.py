@@ -0,0 +1,42 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add free ranges
+
+Revision ID: 6d1f8a2b4c97
+Revises: 3b8e6f0a7c21
+Create Date: 2026-10-19 16:02:37.118245
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '6d1f8a2b4c97'
+down_revision = '3b8e6f0a7c21'
+
+
+def upgrade():
+    op.create_table(
+        'ml2_aster_free_ranges',
+        sa.Column('pool', sa.String(64), nullable=False),
+        sa.Column('first_id', sa.Integer(), autoincrement=False,
+                  nullable=False),
+        sa.Column('last_id', sa.Integer(), nullable=False),
+        sa.PrimaryKeyConstraint('pool', 'first_id'))
+    op.create_index('ix_ml2_aster_free_ranges_pool_last_id',
+                    'ml2_aster_free_ranges', ['pool', 'last_id'])
@@ -0,0 +1,42 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add allocation leases
+
+Revision ID: 8c4d2e6f1a37
+Revises: 2a7c5e9d1f04
+Create Date: 2026-10-19 18:12:05.318406
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '8c4d2e6f1a37'
+down_revision = '2a7c5e9d1f04'
+
+
+def upgrade():
+    op.create_table(
+        'ml2_aster_allocation_leases',
+        sa.Column('lease_id', sa.String(36), nullable=False),
+        sa.Column('pool', sa.String(64), nullable=False),
+        sa.Column('owner', sa.String(255), nullable=False),
+        sa.Column('expires', sa.DateTime(), nullable=False),
+        sa.PrimaryKeyConstraint('lease_id'))
+    op.create_index('ix_ml2_aster_allocation_leases_pool_expires',
+                    'ml2_aster_allocation_leases', ['pool', 'expires'])
@@ -0,0 +1,49 @@
+# Copyright 2020 Red Hat, Inc.
+#
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+#
+
+"""add allocation router_id indexes
+
+Revision ID: 9e4b1c7a2d6f
+Revises: 5c2f7d9e1a3b
+Create Date: 2026-10-19 11:03:47.215936
+
+"""
+
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9e4b1c7a2d6f'
+down_revision = '5c2f7d9e1a3b'
+
+# Indexes of the free rows, partial on the dialects supporting them and
+# plain on the others (MySQL), as declared on the models
+FREE_ROWS = sa.text("router_id = ''")
+
+
+def upgrade():
+    op.create_index('ix_ml2_aster_l3_vni_allocations_router_id',
+                    'ml2_aster_l3_vni_allocations', ['router_id'])
+    op.create_index('ix_ml2_leaf_l2_vni_allocations_router_id',
+                    'ml2_leaf_l2_vni_allocations', ['router_id'])
+    op.create_index('ix_ml2_leaf_vlan_allocations_switch_ip_router_id',
+                    'ml2_leaf_vlan_allocations', ['switch_ip', 'router_id'])
+    op.create_index('ix_ml2_aster_l3_vni_allocations_free',
+                    'ml2_aster_l3_vni_allocations', ['l3_vni'],
+                    postgresql_where=FREE_ROWS, sqlite_where=FREE_ROWS)
+    op.create_index('ix_ml2_leaf_l2_vni_allocations_free',
+                    'ml2_leaf_l2_vni_allocations', ['l2_vni'],
+                    postgresql_where=FREE_ROWS, sqlite_where=FREE_ROWS)
@@ -0,0 +1,242 @@
+"""Back-fill and normalization of legacy aster_ml2_port_bindings rows.
+
+Bindings created before revision a4fd5f0f33a5 have no subnet_id and no
+l2_vni, and vlan_id is stored as a string. Both are recovered from the
+dynamic VLAN segment of the binding: the segment with the binding's VLAN
+on the physical network of its switch belongs to the bound network, whose
+aster_vxlan segment holds the L2 VNI and whose subnet is the bound subnet.
+
+The physical network of a switch is read from the host mappings, which
+neutron-server stores when it starts, and from the ``ml2_mech_aster_cx``
+sections of the loaded config files for the switches not stored yet.
+
+Rows are processed in small batches ordered by binding_id, each batch is
+committed on its own by ``neutron-afc-migrate-port-bindings``, so the
+migration can run on a live database and be resumed after any batch. The
+contract migration 7f3a9c1d2e85 processes the remaining rows.
+
+Only SQLAlchemy core tables are used here, the models describe the schema
+after the migration.
+"""
+
+import collections
+
+import sqlalchemy as sa
+
+from networking_afc._i18n import _
+from networking_afc.common import config
+
+
+DEFAULT_BATCH_SIZE = 500
+
+TYPE_VLAN = 'vlan'
+TYPE_ASTER_VXLAN = 'aster_vxlan'
+
+bindings = sa.table(
+    'aster_ml2_port_bindings',
+    sa.column('binding_id', sa.Integer),
+    sa.column('switch_ip', sa.String),
+    sa.column('vlan_id', sa.String),
+    sa.column('l2_vni', sa.Integer),
+    sa.column('subnet_id', sa.String))
+host_mappings = sa.table(
+    'aster_ml2_cx_host_interface_mappings',
+    sa.column('switch_ip', sa.String),
+    sa.column('physical_network', sa.String))
+segments = sa.table(
+    'networksegments',
+    sa.column('network_id', sa.String),
+    sa.column('network_type', sa.String),
+    sa.column('physical_network', sa.String),
+    sa.column('segmentation_id', sa.Integer))
+subnets = sa.table(
+    'subnets',
+    sa.column('id', sa.String),
+    sa.column('network_id', sa.String))
+
+# Outcome of one batch. ``invalid`` are the ids of rows whose vlan_id is
+# not a number, ``unresolved`` the number of rows whose network could not
+# be found; both are left unchanged.
+BatchResult = collections.namedtuple(
+    'BatchResult', ('last_id', 'scanned', 'updated', 'deleted',
+                    'unresolved', 'invalid'))
+
+
+class MissingSwitchPhysnets(Exception):
+    """Legacy bindings exist but no switch has a physical network."""
+
+    def __init__(self, count):
+        super(MissingSwitchPhysnets, self).__init__(
+            _("%d legacy port bindings need the physical network of their "
+              "switch, which is neither in "
+              "aster_ml2_cx_host_interface_mappings nor in the "
+              "ml2_mech_aster_cx sections of the config. Pass the ML2 "
+              "config file with --config-file, or load the host mappings "
+              "with neutron-afc-host-mappings first.") % count)
+        self.count = count
+
+
+class InvalidVlanIds(Exception):
+    """Bindings have a vlan_id which is not a number."""
+
+    def __init__(self, binding_ids):
+        super(InvalidVlanIds, self).__init__(
+            _("The vlan_id of the port bindings %s in "
+              "aster_ml2_port_bindings is not a number. Fix or delete "
+              "them, neutron-afc-migrate-port-bindings lists them, before "
+              "running the migration again.") % binding_ids)
+        self.binding_ids = binding_ids
+
+
+def normalize_vlan_id(value):
+    """Return a stored vlan_id as an int, None if it is not a number."""
+    try:
+        return int(str(value).strip())
+    except ValueError:
+        return None
+
+
+def count_bindings(connection, after_id=0):
+    return connection.execute(
+        sa.select([sa.func.count()]).select_from(bindings).
+        where(bindings.c.binding_id > after_id)).scalar()
+
+
+def count_legacy_bindings(connection, after_id=0):
+    return connection.execute(
+        sa.select([sa.func.count()]).select_from(bindings).
+        where(sa.and_(bindings.c.binding_id > after_id,
+                      sa.or_(bindings.c.subnet_id == '',
+                             bindings.c.subnet_id.is_(None),
+                             bindings.c.l2_vni == 0,
+                             bindings.c.l2_vni.is_(None))))).scalar()
+
+
+def load_switch_physnets(connection, after_id=0):
+    """Return the physical network of each known switch.
+
+    :raises MissingSwitchPhysnets: when no switch is known and bindings
+        after ``after_id`` need to be back-filled
+    """
+    physnets = dict(
+        (switch_ip, switch_info.get("physnet"))
+        for switch_ip, switch_info in config.cx_switches().items())
+    physnets.update(connection.execute(
+        sa.select([host_mappings.c.switch_ip,
+                   host_mappings.c.physical_network]).distinct()).fetchall())
+    physnets = dict((switch_ip, physnet)
+                    for switch_ip, physnet in physnets.items() if physnet)
+    if not physnets:
+        count = count_legacy_bindings(connection, after_id)
+        if count:
+            raise MissingSwitchPhysnets(count)
+    return physnets
+
+
+def _resolve_networks(connection, wanted):
+    """Map (physical_network, vlan_id) to (network_id, l2_vni, subnet_id)."""
+    if not wanted:
+        return {}
+    physnets = set(physnet for physnet, _ in wanted)
+    vlans = set(vlan for _, vlan in wanted)
+    networks = {}
+    for network_id, physnet, vlan in connection.execute(
+            sa.select([segments.c.network_id, segments.c.physical_network,
+                       segments.c.segmentation_id]).
+            where(sa.and_(segments.c.network_type == TYPE_VLAN,
+                          segments.c.physical_network.in_(physnets),
+                          segments.c.segmentation_id.in_(vlans)))):
+        if (physnet, vlan) in wanted:
+            networks[(physnet, vlan)] = network_id
+    if not networks:
+        return {}
+
+    network_ids = set(networks.values())
+    l2_vnis = dict(connection.execute(
+        sa.select([segments.c.network_id, segments.c.segmentation_id]).
+        where(sa.and_(segments.c.network_type == TYPE_ASTER_VXLAN,
+                      segments.c.network_id.in_(network_ids)))).fetchall())
+    network_subnets = {}
+    for subnet_id, network_id in connection.execute(
+            sa.select([subnets.c.id, subnets.c.network_id]).
+            where(subnets.c.network_id.in_(network_ids)).
+            order_by(subnets.c.id)):
+        network_subnets.setdefault(network_id, subnet_id)
+
+    resolved = {}
+    for key, network_id in networks.items():
+        if network_id in l2_vnis and network_id in network_subnets:
+            resolved[key] = (network_id, l2_vnis[network_id],
+                             network_subnets[network_id])
+    return resolved
+
+
+def migrate_batch(connection, after_id=0, batch_size=DEFAULT_BATCH_SIZE,
+                  physnets=None):
+    """Back-fill and normalize the bindings following ``after_id``.
+
+    :param physnets: physical network of each switch, as returned by
+        ``load_switch_physnets``, loaded when None
+    :returns: a BatchResult, None when no binding follows ``after_id``
+    """
+    rows = connection.execute(
+        sa.select([bindings.c.binding_id, bindings.c.switch_ip,
+                   bindings.c.vlan_id, bindings.c.l2_vni,
+                   bindings.c.subnet_id]).
+        where(bindings.c.binding_id > after_id).
+        order_by(bindings.c.binding_id).limit(batch_size)).fetchall()
+    if not rows:
+        return None
+
+    invalid = []
+    legacy = []
+    updates = {}
+    for binding_id, switch_ip, vlan_id, l2_vni, subnet_id in rows:
+        vlan = normalize_vlan_id(vlan_id)
+        if vlan is None:
+            invalid.append(binding_id)
+            continue
+        if str(vlan) != str(vlan_id):
+            updates[binding_id] = {'vlan_id': str(vlan)}
+        if not subnet_id or not l2_vni:
+            legacy.append((binding_id, switch_ip, vlan))
+
+    deleted = []
+    unresolved = 0
+    if legacy:
+        if physnets is None:
+            physnets = load_switch_physnets(connection)
+        resolved = _resolve_networks(
+            connection, set((physnets[switch_ip], vlan)
+                            for _, switch_ip, vlan in legacy
+                            if switch_ip in physnets))
+        subnet_ids = set(subnet_id for _, _, subnet_id in resolved.values())
+        bound = set()
+        if subnet_ids:
+            bound = set(tuple(row) for row in connection.execute(
+                sa.select([bindings.c.switch_ip, bindings.c.subnet_id]).
+                where(bindings.c.subnet_id.in_(subnet_ids))))
+        for binding_id, switch_ip, vlan in legacy:
+            network = resolved.get((physnets.get(switch_ip), vlan))
+            if network is None:
+                unresolved += 1
+                continue
+            _, l2_vni, subnet_id = network
+            if (switch_ip, subnet_id) in bound:
+                # The subnet was bound to the switch again since, the
+                # legacy row is a leftover
+                deleted.append(binding_id)
+                updates.pop(binding_id, None)
+                continue
+            bound.add((switch_ip, subnet_id))
+            updates.setdefault(binding_id, {}).update(
+                {'l2_vni': l2_vni, 'subnet_id': subnet_id})
+
+    if deleted:
+        connection.execute(bindings.delete().where(
+            bindings.c.binding_id.in_(deleted)))
+    for binding_id, values in updates.items():
+        connection.execute(bindings.update().where(
+            bindings.c.binding_id == binding_id).values(**values))
+    return BatchResult(rows[-1][0], len(rows), len(updates), len(deleted),
+                       unresolved, invalid)
@@ -15,6 +15,14 @@ class AsterVxlanAllocation(model_base.BASEV2):
 class AsterL3VNIAllocation(model_base.BASEV2):
 
     __tablename__ = 'ml2_aster_l3_vni_allocations'
+    __table_args__ = (
+        sa.Index('ix_ml2_aster_l3_vni_allocations_router_id', 'router_id'),
+        # Free VNIs, partial on the backends supporting it
+        sa.Index('ix_ml2_aster_l3_vni_allocations_free', 'l3_vni',
+                 postgresql_where=sa.text("router_id = ''"),
+                 sqlite_where=sa.text("router_id = ''")),
+        model_base.BASEV2.__table_args__
+    )
 
     l3_vni = sa.Column(sa.Integer, nullable=False, primary_key=True,
                        autoincrement=False)
@@ -24,15 +32,95 @@ class AsterL3VNIAllocation(model_base.BASEV2):
 class AsterL2VNIAllocation(model_base.BASEV2):
 
     __tablename__ = 'ml2_leaf_l2_vni_allocations'
+    __table_args__ = (
+        sa.Index('ix_ml2_leaf_l2_vni_allocations_router_id', 'router_id'),
+        # Free VNIs, partial on the backends supporting it
+        sa.Index('ix_ml2_leaf_l2_vni_allocations_free', 'l2_vni',
+                 postgresql_where=sa.text("router_id = ''"),
+                 sqlite_where=sa.text("router_id = ''")),
+        model_base.BASEV2.__table_args__
+    )
 
     l2_vni = sa.Column(sa.Integer, nullable=False, primary_key=True,
                        autoincrement=False)
     router_id = sa.Column(sa.String(255), nullable=True, default="")
 
 
+class AsterFreeRange(model_base.BASEV2):
+    """Free interval of an ID pool stored as ranges."""
+
+    __tablename__ = 'ml2_aster_free_ranges'
+    __table_args__ = (
+        sa.Index('ix_ml2_aster_free_ranges_pool_last_id',
+                 'pool', 'last_id'),
+        model_base.BASEV2.__table_args__
+    )
+
+    pool = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    first_id = sa.Column(sa.Integer, nullable=False, primary_key=True,
+                         autoincrement=False)
+    last_id = sa.Column(sa.Integer, nullable=False)
+
+
+class AsterPoolSync(model_base.BASEV2):
+    """Synchronization state and lease of an allocation pool."""
+
+    __tablename__ = 'ml2_aster_pool_syncs'
+
+    pool = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    config_digest = sa.Column(sa.String(64), nullable=True)
+    owner = sa.Column(sa.String(255), nullable=True)
+    lease_expires = sa.Column(sa.DateTime, nullable=True)
+    synced_at = sa.Column(sa.DateTime, nullable=True)
+
+
+class AsterAllocationLease(model_base.BASEV2):
+    """Block of IDs of an allocation pool reserved by a worker."""
+
+    __tablename__ = 'ml2_aster_allocation_leases'
+    __table_args__ = (
+        sa.Index('ix_ml2_aster_allocation_leases_pool_expires',
+                 'pool', 'expires'),
+        model_base.BASEV2.__table_args__
+    )
+
+    lease_id = sa.Column(sa.String(36), nullable=False, primary_key=True)
+    pool = sa.Column(sa.String(64), nullable=False)
+    owner = sa.Column(sa.String(255), nullable=False)
+    expires = sa.Column(sa.DateTime, nullable=False)
+
+
+class AsterPoolCounter(model_base.BASEV2):
+    """Shard of the allocation counters of a pool."""
+
+    __tablename__ = 'ml2_aster_pool_counters'
+
+    pool = sa.Column(sa.String(64), nullable=False, primary_key=True)
+    shard = sa.Column(sa.Integer, nullable=False, primary_key=True,
+                      autoincrement=False)
+    total = sa.Column(sa.Integer, nullable=False, default=0)
+    allocated = sa.Column(sa.Integer, nullable=False, default=0)
+    outside = sa.Column(sa.Integer, nullable=False, default=0)
+
+
+class AsterReplicaHeartbeat(model_base.BASEV2):
+    """Time of the last write measuring the lag of the database replica."""
+
+    __tablename__ = 'ml2_aster_replica_heartbeats'
+
+    id = sa.Column(sa.Integer, nullable=False, primary_key=True,
+                   autoincrement=False)
+    beat_at = sa.Column(sa.DateTime, nullable=False)
+
+
 class AsterLeafVlanAllocation(model_base.BASEV2):
 
     __tablename__ = 'ml2_leaf_vlan_allocations'
+    __table_args__ = (
+        sa.Index('ix_ml2_leaf_vlan_allocations_switch_ip_router_id',
+                 'switch_ip', 'router_id'),
+        model_base.BASEV2.__table_args__
+    )
 
     switch_ip = sa.Column(sa.String(64), nullable=False,
                           primary_key=True)
@@ -45,6 +133,16 @@ class AsterPortBinding(model_base.BASEV2):
     """Represents a binding of VM's to physical_switch ports."""
 
     __tablename__ = "aster_ml2_port_bindings"
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'switch_ip', 'subnet_id',
+            name='uniq_aster_ml2_port_bindings0switch_ip0subnet_id'),
+        sa.Index('ix_aster_ml2_port_bindings_switch_ip_router_id',
+                 'switch_ip', 'router_id'),
+        sa.Index('ix_aster_ml2_port_bindings_subnet_id_switch_ip',
+                 'subnet_id', 'switch_ip'),
+        model_base.BASEV2.__table_args__
+    )
 
     binding_id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     switch_ip = sa.Column(sa.String(255))
@@ -64,7 +162,8 @@ class AsterPortBinding(model_base.BASEV2):
                  self.subnet_id, self.router_id, self.l3_vni))
 
     def __hash__(self):
-        return hash(self.__repr__())
+        # Consistent with __eq__, and without formatting __repr__
+        return hash((self.switch_ip, self.l2_vni, self.vlan_id))
 
     def __eq__(self, other):
         """Compare only the binding, without the id key."""
@@ -79,6 +178,15 @@ class AsterCxHostMapping(model_base.BASEV2):
     """Aster CX Host to interface Mappings."""
 
     __tablename__ = 'aster_ml2_cx_host_interface_mappings'
+    __table_args__ = (
+        sa.UniqueConstraint(
+            'switch_ip', 'host_id',
+            name='uniq_aster_ml2_cx_host_interface_mappings0'
+                 'switch_ip0host_id'),
+        sa.Index('ix_aster_ml2_cx_host_interface_mappings_host_id',
+                 'host_id'),
+        model_base.BASEV2.__table_args__
+    )
 
     id = sa.Column(sa.Integer, primary_key=True, autoincrement=True)
     switch_ip = sa.Column(sa.String(255), nullable=False)
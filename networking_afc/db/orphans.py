@@ -0,0 +1,188 @@
+"""Reclaim the router pool IDs held by routers that no longer exist.
+
+A router whose deletion failed half way, or whose creation was rolled back
+after its IDs were allocated, keeps its L3 VNI, L2 VNI and border VLANs
+forever. The sweeper reclaims them every ``[aster_db]
+orphan_sweep_interval`` seconds:
+
+* orphans are found with an anti-join of the allocation table on
+  ``routers``, so only the rows of the pool are scanned and ``routers``
+  is not locked;
+* they are reclaimed ``[aster_db] orphan_sweep_batch`` at a time, one
+  transaction per chunk, with an UPDATE or DELETE of the rows still held
+  by the same deleted routers;
+* the IDs within the configured ranges go back to the pool, the others
+  are removed;
+* rows reserved by a prefetch lease belong to no router, ``prefetch``
+  recovers them.
+"""
+
+import random
+
+from neutron.db.models import l3 as l3_models
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_service import loopingcall
+
+from networking_afc.common import config  # noqa
+from networking_afc.common import metrics
+from networking_afc.db import free_ranges
+from networking_afc.db import pool_stats
+from networking_afc.db import prefetch
+
+
+LOG = logging.getLogger(__name__)
+
+RELEASED = "released"
+REMOVED = "removed"
+
+
+def _pool_rows(session, model, filters):
+    return session.query(model).filter(
+        *[getattr(model, column) == value
+          for column, value in filters.items()])
+
+
+def find_orphans(session, model, id_column, after=None, limit=None,
+                 **filters):
+    """Return the ``(id, router_id)`` rows held by deleted routers.
+
+    :param after: only return the IDs above this one
+    :param limit: maximum number of rows, in ID order
+    :param filters: column values of the rows of the pool
+    """
+    routers = l3_models.Router
+    query = _pool_rows(session, model, filters).with_entities(
+        id_column, model.router_id).outerjoin(
+            routers, routers.id == model.router_id).filter(
+                routers.id.is_(None),
+                model.router_id != "",
+                ~model.router_id.startswith(prefetch.LEASE_PREFIX))
+    if after is not None:
+        query = query.filter(id_column > after)
+    query = query.order_by(id_column)
+    if limit is not None:
+        query = query.limit(limit)
+    return query.all()
+
+
+def _reclaim(session, pool, model, id_column, id_set, rows, free_pool,
+             filters):
+    router_ids = set(router_id for _, router_id in rows)
+    held = _pool_rows(session, model, filters).filter(
+        id_column.in_([id_ for id_, _ in rows]),
+        model.router_id.in_(router_ids))
+    # Rows released or reallocated since they were found are left alone
+    ids = [id_ for id_, in held.with_entities(id_column).with_for_update()]
+    released = [id_ for id_ in ids if id_ in id_set]
+    removed = [id_ for id_ in ids if id_ not in id_set]
+    if released:
+        query = held.filter(id_column.in_(released))
+        if free_pool is not None and free_ranges.ranges_enabled():
+            query.delete(synchronize_session=False)
+            for id_ in released:
+                free_ranges.add_free_id(session, free_pool, id_)
+        else:
+            query.update({"router_id": ""}, synchronize_session=False)
+    if removed:
+        held.filter(id_column.in_(removed)).delete(
+            synchronize_session=False)
+    if ids:
+        pool_stats.adjust(session, pool, allocated=-len(released),
+                          outside=-len(removed))
+    return released, removed
+
+
+def sweep(pool, model, id_column, id_set, free_pool=None, batch_size=None,
+          **filters):
+    """Reclaim the IDs of ``pool`` held by deleted routers.
+
+    :param pool: name of the pool, for its counters
+    :param model: allocation model whose rows are owned by a ``router_id``
+    :param id_column: ID column of the model
+    :param id_set: configured IDs of the pool
+    :param free_pool: ``free_ranges`` pool storing the free IDs as
+        intervals, None when the free IDs have a row
+    :param batch_size: IDs reclaimed per transaction, defaults to
+        ``[aster_db] orphan_sweep_batch``
+    :param filters: column values of the rows of the pool
+    :returns: ``(released, removed)`` lists of IDs
+    """
+    batch_size = batch_size or cfg.CONF.aster_db.orphan_sweep_batch
+    released, removed = [], []
+    after = None
+    while True:
+        session = lib_db_api.get_writer_session()
+        with session.begin(subtransactions=True):
+            rows = find_orphans(session, model, id_column, after=after,
+                                limit=batch_size, **filters)
+            if rows:
+                chunk_released, chunk_removed = _reclaim(
+                    session, pool, model, id_column, id_set, rows,
+                    free_pool, filters)
+        if not rows:
+            break
+        released.extend(chunk_released)
+        removed.extend(chunk_removed)
+        if len(rows) < batch_size:
+            break
+        after = rows[-1][0]
+    if released or removed:
+        metrics.ORPHANS_RECLAIMED.inc(pool, RELEASED, amount=len(released))
+        metrics.ORPHANS_RECLAIMED.inc(pool, REMOVED, amount=len(removed))
+        LOG.info("Reclaimed the IDs of deleted routers from pool %(pool)s, "
+                 "released: %(released)s, removed: %(removed)s",
+                 {'pool': pool, 'released': released, 'removed': removed})
+    return released, removed
+
+
+class OrphanSweeper(object):
+    """Run the orphan sweeps of the router pools periodically.
+
+    :param sweep_funcs: functions reclaiming the orphans of a pool and
+        returning the number of IDs reclaimed
+    """
+
+    def __init__(self, sweep_funcs):
+        self._sweep_funcs = list(sweep_funcs)
+        self._loop = None
+
+    def sweep(self):
+        """Run every sweep once.
+
+        :returns: the number of IDs reclaimed
+        """
+        count = 0
+        for sweep_func in self._sweep_funcs:
+            try:
+                count += sweep_func()
+            except Exception:
+                # The next sweep retries
+                LOG.exception("Failed to reclaim orphaned IDs with %s",
+                              sweep_func)
+        return count
+
+    def start(self, interval):
+        self._loop = loopingcall.FixedIntervalLoopingCall(self.sweep)
+        # Spread the sweeps of the workers started together
+        self._loop.start(interval, initial_delay=random.randint(
+            interval // 2, interval))
+
+    def stop(self):
+        if self._loop is not None:
+            self._loop.stop()
+            self._loop = None
+
+
+def start(sweep_funcs):
+    """Start sweeping when ``orphan_sweep_interval`` is set.
+
+    :returns: the ``OrphanSweeper``, None when sweeps are disabled
+    """
+    interval = cfg.CONF.aster_db.orphan_sweep_interval
+    if not interval:
+        return None
+    sweeper = OrphanSweeper(sweep_funcs)
+    sweeper.start(interval)
+    return sweeper
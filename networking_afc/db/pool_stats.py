@@ -0,0 +1,101 @@
+"""Allocation counters of the VNI and VLAN pools.
+
+Counting the free rows of the allocation tables scans them, which is slow
+for wide ranges and impossible in ``ranges`` storage mode. Each pool keeps
+counters in ``ml2_aster_pool_counters`` instead:
+
+* ``total`` is the number of IDs of the configured ranges;
+* ``allocated`` the number of allocated IDs inside the ranges;
+* ``outside`` the number of IDs still allocated outside of the ranges,
+  after the ranges were shrunk.
+
+The counters are recounted when a pool is synchronized and adjusted in the
+transaction of every allocation and release afterwards. They are split in
+``SHARDS`` rows updated at random so that concurrent allocations do not
+all lock the same row, reading them sums a few rows only.
+
+Pools are named like their allocator: ``aster_vxlan``, ``l2_vni``,
+``l3_vni`` and ``border_vlan:<switch_ip>``.
+"""
+
+import random
+
+from oslo_log import log as logging
+import sqlalchemy as sa
+
+from networking_afc.common import range_set
+from networking_afc.db.models import aster_models_v2
+
+
+LOG = logging.getLogger(__name__)
+
+SHARDS = 8
+
+
+def adjust(session, pool, allocated=0, outside=0):
+    """Add to the counters of ``pool`` in the transaction of ``session``.
+
+    Nothing is counted before the pool was recounted once.
+    """
+    model = aster_models_v2.AsterPoolCounter
+    with session.begin(subtransactions=True):
+        session.query(model).filter_by(
+            pool=pool, shard=random.randrange(SHARDS)).update(
+                {model.allocated: model.allocated + allocated,
+                 model.outside: model.outside + outside},
+                synchronize_session=False)
+
+
+def recount(session, pool, id_ranges, allocated_ids):
+    """Reset the counters of ``pool``.
+
+    :param id_ranges: configured ``[(min, max), ...]`` ranges of the pool
+    :param allocated_ids: iterable of the allocated IDs of the pool
+    """
+    model = aster_models_v2.AsterPoolCounter
+    ids = range_set.RangeSet(id_ranges)
+    allocated = outside = 0
+    for id_ in allocated_ids:
+        if id_ in ids:
+            allocated += 1
+        else:
+            outside += 1
+    with session.begin(subtransactions=True):
+        session.query(model).filter_by(pool=pool).delete(
+            synchronize_session=False)
+        session.execute(model.__table__.insert(), [
+            {'pool': pool, 'shard': shard, 'total': 0, 'allocated': 0,
+             'outside': 0} for shard in range(1, SHARDS)] + [
+            {'pool': pool, 'shard': 0, 'total': len(ids),
+             'allocated': allocated, 'outside': outside}])
+    LOG.debug("Pool %(pool)s has %(allocated)d of %(total)d IDs allocated "
+              "and %(outside)d outside of its ranges",
+              {'pool': pool, 'allocated': allocated, 'total': len(ids),
+               'outside': outside})
+
+
+def missing_pools(session, pools):
+    """Return the pools among ``pools`` that have no counters."""
+    model = aster_models_v2.AsterPoolCounter
+    counted = set(name for name, in session.query(model.pool).filter(
+        model.pool.in_(pools)).distinct())
+    return sorted(set(pools) - counted)
+
+
+def get_stats(session, pool=None):
+    """Return the counters of every pool, or of ``pool`` only.
+
+    :returns: list of ``{'pool', 'total', 'allocated', 'free',
+        'outside_allocated'}`` dicts sorted by pool
+    """
+    model = aster_models_v2.AsterPoolCounter
+    query = session.query(model.pool, sa.func.sum(model.total),
+                          sa.func.sum(model.allocated),
+                          sa.func.sum(model.outside)).group_by(model.pool)
+    if pool is not None:
+        query = query.filter(model.pool == pool)
+    return [{'pool': name, 'total': int(total),
+             'allocated': int(allocated),
+             'free': max(int(total) - int(allocated), 0),
+             'outside_allocated': int(outside)}
+            for name, total, allocated, outside in query.order_by(model.pool)]
@@ -0,0 +1,196 @@
+"""Synchronize the allocation pools once per deployment.
+
+Every neutron-server worker builds the VNI and VLAN allocation managers
+when it starts. Synchronizing the allocation tables with the configured
+ranges scans and locks whole tables, so instead of every worker doing it
+in its constructor:
+
+* the synchronization runs in a background thread;
+* one worker is elected per pool with a lease stored in
+  ``ml2_aster_pool_syncs``, the others wait for it to finish;
+* the digest of the configuration a pool was synchronized with is stored
+  with the lease, workers starting with the same configuration skip the
+  synchronization altogether, unless the counters of the pool are
+  missing (see ``pool_stats``);
+* allocations and releases wait for the synchronization of their own
+  pool only, see ``PoolSync.wait``.
+
+A lease left behind by a worker that died expires after
+``[aster_db] pool_sync_lease`` seconds and another worker takes over.
+"""
+
+import datetime
+import hashlib
+import json
+import os
+import socket
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+from neutron_lib.db import api as lib_db_api
+
+from networking_afc.common import config  # noqa
+from networking_afc.db import pool_stats
+from networking_afc.db.models import aster_models_v2
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
+
+
+LOG = logging.getLogger(__name__)
+
+ACQUIRED = "acquired"
+BUSY = "busy"
+SYNCED = "synced"
+
+# Seconds between two checks of a pool synchronized by another worker
+POLL_INTERVAL = 2
+
+# Changed when a synchronization stores more than before, so that pools
+# synchronized by an older release are synchronized again
+DIGEST_VERSION = 2
+
+
+def config_digest(pool_config):
+    """Digest of the JSON serializable configuration of a pool."""
+    return hashlib.sha1(json.dumps(
+        {"version": DIGEST_VERSION, "config": pool_config},
+        sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def try_acquire(pool, digest, owner, lease_seconds, counter_pools=()):
+    """Take the synchronization lease of ``pool``.
+
+    :param counter_pools: pools whose counters the synchronization
+        recounts, the pool is not SYNCED while some of them are missing
+    :returns: SYNCED when the pool was synchronized with ``digest``
+        already, BUSY when another worker holds the lease, ACQUIRED
+        otherwise
+    """
+    model = aster_models_v2.AsterPoolSync
+    now = timeutils.utcnow()
+    expires = now + datetime.timedelta(seconds=lease_seconds)
+    session = lib_db_api.get_writer_session()
+    try:
+        with session.begin(subtransactions=True):
+            row = session.query(model).filter_by(
+                pool=pool).with_for_update().first()
+            if row is None:
+                session.add(model(pool=pool, owner=owner,
+                                  lease_expires=expires))
+                return ACQUIRED
+            if row.config_digest == digest:
+                missing = (counter_pools and
+                           pool_stats.missing_pools(session, counter_pools))
+                if not missing:
+                    return SYNCED
+                LOG.info("Counters of pools %s are missing, synchronizing "
+                         "allocation pool %s again", missing, pool)
+            if (row.owner and row.lease_expires and
+                    row.lease_expires > now):
+                return BUSY
+            row.owner = owner
+            row.lease_expires = expires
+            return ACQUIRED
+    except db_exc.DBDuplicateEntry:
+        # Another worker inserted the row first
+        return BUSY
+
+
+def release(pool, owner, digest=None):
+    """Give the lease back, recording ``digest`` when the sync succeeded."""
+    model = aster_models_v2.AsterPoolSync
+    values = {"owner": None, "lease_expires": None}
+    if digest is not None:
+        values.update(config_digest=digest, synced_at=timeutils.utcnow())
+    session = lib_db_api.get_writer_session()
+    with session.begin(subtransactions=True):
+        session.query(model).filter_by(pool=pool, owner=owner).update(
+            values, synchronize_session=False)
+
+
+class PoolSync(object):
+    """Background synchronization of one allocation pool.
+
+    :param pool: pool name
+    :param digest: ``config_digest`` of the configuration of the pool
+    :param sync_func: synchronizes the allocation table of the pool
+    :param counter_pools: pools whose counters ``sync_func`` recounts
+    """
+
+    def __init__(self, pool, digest, sync_func, counter_pools=()):
+        self.pool = pool
+        self.digest = digest
+        self._sync_func = sync_func
+        self._counter_pools = list(counter_pools)
+        self._owner = "%s:%d:%s" % (socket.gethostname(), os.getpid(),
+                                    uuidutils.generate_uuid())
+        self._ready = threading.Event()
+
+    def start(self):
+        thread = threading.Thread(target=self._run,
+                                  name="afc-pool-sync-%s" % self.pool)
+        thread.daemon = True
+        thread.start()
+
+    def _run(self):
+        try:
+            self.synchronize()
+        except Exception:
+            # Allocations go on with the table as it is, a worker
+            # starting later retries the synchronization
+            LOG.exception("Failed to synchronize allocation pool %s",
+                          self.pool)
+        finally:
+            self._ready.set()
+
+    def synchronize(self):
+        lease = cfg.CONF.aster_db.pool_sync_lease
+        while True:
+            state = try_acquire(self.pool, self.digest, self._owner, lease,
+                                self._counter_pools)
+            if state == SYNCED:
+                LOG.debug("Allocation pool %s is synchronized", self.pool)
+                return
+            if state == ACQUIRED:
+                break
+            time.sleep(POLL_INTERVAL)
+
+        LOG.info("Synchronizing allocation pool %s", self.pool)
+        try:
+            self._sync_func()
+        except Exception:
+            release(self.pool, self._owner)
+            raise
+        release(self.pool, self._owner, self.digest)
+
+    @property
+    def ready(self):
+        return self._ready.is_set()
+
+    def wait(self):
+        """Wait for the synchronization of the pool to finish."""
+        if self._ready.is_set():
+            return
+        timeout = cfg.CONF.aster_db.pool_sync_wait or None
+        if not self._ready.wait(timeout):
+            raise ex.PoolSyncTimeout(pool=self.pool, timeout=timeout)
+
+
+def start(pool, pool_config, sync_func, counter_pools=None):
+    """Start the background synchronization of ``pool``.
+
+    :param pool_config: JSON serializable configuration of the pool, the
+        pool is synchronized again when it changes
+    :param counter_pools: pools whose counters ``sync_func`` recounts,
+        defaults to ``pool``
+    """
+    if counter_pools is None:
+        counter_pools = [pool]
+    pool_sync = PoolSync(pool, config_digest(pool_config), sync_func,
+                         counter_pools)
+    pool_sync.start()
+    return pool_sync
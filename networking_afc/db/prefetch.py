@@ -0,0 +1,246 @@
+"""Per-worker prefetching of the router allocation pools.
+
+Creating hundreds of routers at once makes every worker allocate its L2
+VNI, L3 VNI and border VLAN from the same few free rows. With
+``[aster_db] prefetch_size`` set, a worker instead reserves a block of
+free IDs in one transaction and hands them out to the routers it creates:
+
+* the reserved rows are owned by a lease, their ``router_id`` is the
+  marker of a row of ``ml2_aster_allocation_leases``, so other workers
+  and the synchronization of the pools leave them alone;
+* handing an ID out is a conditional UPDATE of a row nobody else claims,
+  a row recovered in the meantime is skipped;
+* a worker stops handing out the IDs of a block shortly before its lease
+  expires and returns them, the IDs of a block left behind by a worker
+  that died are returned by the next worker reserving a block of the same
+  pool once the lease expired;
+* the IDs a worker still holds are returned when it exits.
+"""
+
+import atexit
+import collections
+import datetime
+import os
+import socket
+import threading
+
+from oslo_config import cfg
+from oslo_log import log as logging
+from oslo_utils import timeutils
+from oslo_utils import uuidutils
+from neutron_lib.db import api as lib_db_api
+
+from networking_afc.common import config  # noqa
+from networking_afc.db import free_ranges
+from networking_afc.db import pool_stats
+from networking_afc.db.models import aster_models_v2
+
+
+LOG = logging.getLogger(__name__)
+
+LEASE_PREFIX = "lease:"
+
+# Seconds before the expiry of a lease its IDs are no longer handed out
+EXPIRY_MARGIN = 5
+
+
+def lease_marker(lease_id):
+    """``router_id`` of the rows reserved by a lease."""
+    return LEASE_PREFIX + lease_id
+
+
+def is_lease_marker(router_id):
+    return bool(router_id) and router_id.startswith(LEASE_PREFIX)
+
+
+class PrefetchingPool(object):
+    """Hand out the IDs of a router pool from blocks reserved in advance.
+
+    Same interface as ``allocator.PoolAllocator``.
+
+    :param pool: ``PoolAllocator`` of the pool, reserves the blocks
+    :param model: allocation model whose rows are owned by a ``router_id``
+    :param id_column: ID column of the model
+    :param size: number of IDs reserved at once
+    :param lease_seconds: lifetime of a block
+    :param free_pool: ``free_ranges`` pool storing the free IDs as
+        intervals, None when the free IDs have a row
+    :param filters: column values of the rows of the pool
+    """
+
+    def __init__(self, pool, model, id_column, size, lease_seconds,
+                 free_pool=None, **filters):
+        self.name = pool.name
+        self._pool = pool
+        self._model = model
+        self._id_column = id_column
+        self._size = size
+        self._lease_seconds = lease_seconds
+        self._free_pool = free_pool
+        self._filters = filters
+        self._owner = "%s:%d" % (socket.gethostname(), os.getpid())
+        self._lock = threading.Lock()
+        self._lease_id = None
+        self._expires = None
+        self._ids = collections.deque()
+        atexit.register(self.return_lease)
+
+    def reload(self, session):
+        self._pool.reload(session)
+
+    def invalidate(self):
+        self._pool.invalidate()
+
+    def release(self, id_):
+        self._pool.release(id_)
+
+    def remove(self, id_):
+        self._pool.remove(id_)
+
+    def allocate_many(self, session, count, owner=None):
+        # Blocks are for routers created one by one
+        return self._pool.allocate_many(session, count, owner)
+
+    def allocate(self, session, owner=None):
+        """Allocate an ID of the block of the worker, reserving a new one
+        when it is used up.
+
+        :returns: the allocated ID, None when the pool is exhausted
+        """
+        while True:
+            lease_id, id_, last = self._take(session)
+            if id_ is None:
+                if not self._reserve(session):
+                    # Other workers hold the remaining IDs in their blocks
+                    return self._pool.allocate(session, owner)
+                continue
+            if self._hand_over(session, lease_id, id_, owner, last):
+                return id_
+
+    def _take(self, session):
+        with self._lock:
+            lease_id = self._lease_id
+            if lease_id is None:
+                return None, None, False
+            expiring = timeutils.utcnow() >= self._expires - \
+                datetime.timedelta(seconds=EXPIRY_MARGIN)
+            if self._ids and not expiring:
+                id_ = self._ids.popleft()
+                last = not self._ids
+                if last:
+                    self._lease_id = None
+                return lease_id, id_, last
+            self._lease_id = None
+            self._ids.clear()
+        # Return what is left of an expiring block
+        with session.begin(subtransactions=True):
+            self._free_lease(session, lease_id)
+        return None, None, False
+
+    def _rows(self, session):
+        return session.query(self._model).filter_by(**self._filters)
+
+    def _hand_over(self, session, lease_id, id_, owner, last):
+        with session.begin(subtransactions=True):
+            updated = self._rows(session).filter(
+                self._id_column == id_,
+                self._model.router_id == lease_marker(lease_id)).update(
+                    {"router_id": owner}, synchronize_session=False)
+            if last:
+                session.query(aster_models_v2.AsterAllocationLease).\
+                    filter_by(lease_id=lease_id).delete(
+                        synchronize_session=False)
+        return updated == 1
+
+    def _reserve(self, session):
+        lease_id = uuidutils.generate_uuid(dashed=False)
+        expires = timeutils.utcnow() + datetime.timedelta(
+            seconds=self._lease_seconds)
+        with session.begin(subtransactions=True):
+            self.recover_expired(session)
+            ids = self._pool.allocate_many(session, self._size,
+                                           lease_marker(lease_id))
+            if not ids:
+                return False
+            session.add(aster_models_v2.AsterAllocationLease(
+                lease_id=lease_id, pool=self.name, owner=self._owner,
+                expires=expires))
+        LOG.debug("Reserved %(count)d IDs of pool %(pool)s until "
+                  "%(expires)s", {'count': len(ids), 'pool': self.name,
+                                  'expires': expires})
+        with self._lock:
+            self._lease_id = lease_id
+            self._expires = expires
+            self._ids = collections.deque(ids)
+        return True
+
+    def _free_lease(self, session, lease_id):
+        # Give the rows still reserved by the lease back to the pool
+        marker = lease_marker(lease_id)
+        rows = self._rows(session).filter(self._model.router_id == marker)
+        ids = [id_ for id_, in rows.with_entities(self._id_column)]
+        if self._free_pool is not None and free_ranges.ranges_enabled():
+            rows.delete(synchronize_session=False)
+            for id_ in ids:
+                free_ranges.add_free_id(session, self._free_pool, id_)
+        else:
+            rows.update({"router_id": ""}, synchronize_session=False)
+        session.query(aster_models_v2.AsterAllocationLease).filter_by(
+            lease_id=lease_id).delete(synchronize_session=False)
+        if ids:
+            pool_stats.adjust(session, self.name, allocated=-len(ids))
+        for id_ in ids:
+            self._pool.release(id_)
+        return ids
+
+    def recover_expired(self, session):
+        """Return the IDs of the expired leases of the pool.
+
+        :returns: the number of IDs returned
+        """
+        model = aster_models_v2.AsterAllocationLease
+        with session.begin(subtransactions=True):
+            lease_ids = [lease_id for lease_id, in session.query(
+                model.lease_id).filter(
+                    model.pool == self.name,
+                    model.expires < timeutils.utcnow()).with_for_update()]
+            count = 0
+            for lease_id in lease_ids:
+                count += len(self._free_lease(session, lease_id))
+        if lease_ids:
+            LOG.info("Returned %(count)d IDs of %(leases)d expired leases "
+                     "to pool %(pool)s", {'count': count,
+                                          'leases': len(lease_ids),
+                                          'pool': self.name})
+        return count
+
+    def return_lease(self):
+        """Return the IDs of the block of the worker to the pool."""
+        with self._lock:
+            lease_id = self._lease_id
+            self._lease_id = None
+            self._ids.clear()
+        if lease_id is None:
+            return
+        try:
+            session = lib_db_api.get_writer_session()
+            with session.begin(subtransactions=True):
+                self._free_lease(session, lease_id)
+        except Exception:
+            # The lease expires and is recovered by another worker
+            LOG.exception("Failed to return the IDs of lease %(lease)s of "
+                          "pool %(pool)s", {'lease': lease_id,
+                                            'pool': self.name})
+
+
+def router_pool(pool, model, id_column, free_pool=None, **filters):
+    """Prefetch the IDs of ``pool`` when ``prefetch_size`` is set.
+
+    :returns: ``pool`` itself when prefetching is disabled
+    """
+    size = cfg.CONF.aster_db.prefetch_size
+    if not size:
+        return pool
+    return PrefetchingPool(pool, model, id_column, size,
+                           cfg.CONF.aster_db.prefetch_lease,
+                           free_pool=free_pool, **filters)
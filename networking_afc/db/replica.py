@@ -0,0 +1,191 @@
+"""Routing of read-only lookups to a database replica.
+
+With [aster_db] replica_reads enabled, ``get_reader_session`` returns a
+session bound to [database] slave_connection. Reads fall back to the
+primary database:
+
+* when the replica lags more than [aster_db] replica_max_lag seconds
+  behind the primary. Each worker measures the lag every
+  [aster_db] replica_lag_check_interval seconds with a heartbeat row it
+  writes to the primary, and reads from the primary while the lag is not
+  known;
+* when the current thread wrote to the database within the last
+  [aster_db] read_after_write_window seconds, so lookups made while
+  handling an event see the event's own writes despite replication lag;
+* for [aster_db] replica_retry_interval seconds after the replica could
+  not be reached by a function decorated with ``replica_fallback``, which
+  also reruns the failed lookup on the primary.
+
+Lookups deciding the configuration of the switches do not use the
+replica, they read from the primary even with replica_reads enabled.
+"""
+
+import functools
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_log import log as logging
+from neutron_lib.db import api as lib_db_api
+import sqlalchemy as sa
+from sqlalchemy import event
+from sqlalchemy import orm
+
+from networking_afc.common import config  # noqa
+from networking_afc.db.models import aster_models_v2
+
+
+LOG = logging.getLogger(__name__)
+
+_clock = getattr(time, "monotonic", time.time)
+
+_local = threading.local()
+# Time before which the replica is not used after a connection failure
+_replica_down_until = [0]
+
+HEARTBEAT_ID = 1
+_heartbeats = aster_models_v2.AsterReplicaHeartbeat.__table__
+
+# Time of the last lag measurement of this worker and its verdict
+_lag_check = {"checked_at": None, "lag_ok": None}
+_lag_check_lock = threading.Lock()
+
+
+def record_write():
+    """Route the reads of this thread to the primary for a while."""
+    _local.last_write = _clock()
+
+
+def _on_write(*args):
+    record_write()
+
+
+for _event in ("after_flush", "after_bulk_update", "after_bulk_delete"):
+    event.listen(orm.Session, _event, _on_write)
+
+
+def _read_heartbeat(session, *columns):
+    return session.execute(
+        sa.select([_heartbeats.c.beat_at] + list(columns)).
+        where(_heartbeats.c.id == HEARTBEAT_ID)).first()
+
+
+def _measure_lag():
+    """Return the seconds the replica lags behind, None when unknown.
+
+    The replica lags at least since the primary's heartbeat was written
+    when it still misses it. A new heartbeat is written on the primary with
+    Core statements, it is not a write of the thread to read after.
+    """
+    replica_row = _read_heartbeat(_sessionmaker(use_slave=True)())
+    session = _sessionmaker(use_slave=False)()
+    with session.begin():
+        primary_row = _read_heartbeat(session, sa.func.now())
+        if primary_row is not None:
+            session.execute(
+                _heartbeats.update().
+                where(_heartbeats.c.id == HEARTBEAT_ID).
+                values(beat_at=sa.func.now()))
+    if primary_row is None:
+        try:
+            with session.begin():
+                session.execute(_heartbeats.insert().values(
+                    id=HEARTBEAT_ID, beat_at=sa.func.now()))
+        except db_exc.DBDuplicateEntry:
+            # Written by another worker first
+            pass
+        return None
+    if replica_row is None:
+        return None
+    primary_beat, now = primary_row
+    if replica_row[0] >= primary_beat:
+        return 0.0
+    return max((now - primary_beat).total_seconds(), 0.0)
+
+
+def _replica_lag_ok(now):
+    """Whether the last measured lag of the replica is acceptable."""
+    conf = cfg.CONF.aster_db
+    if not conf.replica_max_lag:
+        return True
+    checked_at = _lag_check["checked_at"]
+    if (checked_at is not None and
+            now - checked_at < conf.replica_lag_check_interval):
+        return _lag_check["lag_ok"]
+    # A single thread measures, the others use the previous verdict
+    if not _lag_check_lock.acquire(False):
+        return bool(_lag_check["lag_ok"])
+    try:
+        try:
+            lag = _measure_lag()
+        except db_exc.DBError as e:
+            LOG.debug("Could not measure the replica lag: %s", e)
+            lag = None
+        lag_ok = lag is not None and lag <= conf.replica_max_lag
+        if lag_ok != _lag_check["lag_ok"]:
+            if lag_ok:
+                LOG.info("Database replica lag within %.1f seconds, "
+                         "reading from the replica", conf.replica_max_lag)
+            elif lag is None:
+                LOG.warning("Database replica lag unknown, reading from "
+                            "the primary")
+            else:
+                LOG.warning("Database replica lags %.1f seconds behind, "
+                            "reading from the primary", lag)
+        _lag_check.update(checked_at=now, lag_ok=lag_ok)
+    finally:
+        _lag_check_lock.release()
+    return lag_ok
+
+
+def use_replica():
+    conf = cfg.CONF.aster_db
+    if not conf.replica_reads:
+        return False
+    now = _clock()
+    if now < _replica_down_until[0]:
+        return False
+    last_write = getattr(_local, "last_write", None)
+    if (last_write is not None and
+            now - last_write < conf.read_after_write_window):
+        return False
+    return _replica_lag_ok(now)
+
+
+def _sessionmaker(use_slave):
+    # The reader of the context manager is bound to slave_connection too,
+    # the legacy facade tells the primary and the replica apart
+    facade = lib_db_api.get_context_manager().get_legacy_facade()
+    return facade.get_sessionmaker(use_slave=use_slave)
+
+
+def get_reader_session():
+    """Return a reader session of the replica if it can be used."""
+    if not cfg.CONF.aster_db.replica_reads:
+        return lib_db_api.get_reader_session()
+    if use_replica():
+        _local.replica_used = True
+        return _sessionmaker(use_slave=True)()
+    return _sessionmaker(use_slave=False)()
+
+
+def replica_fallback(func):
+    """Rerun ``func`` on the primary when the replica is unreachable."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        outer_replica_used = getattr(_local, "replica_used", False)
+        _local.replica_used = False
+        try:
+            return func(*args, **kwargs)
+        except db_exc.DBConnectionError:
+            if not _local.replica_used:
+                raise
+            retry_interval = cfg.CONF.aster_db.replica_retry_interval
+            _replica_down_until[0] = _clock() + retry_interval
+            LOG.warning("Database replica unreachable, reading from the "
+                        "primary for %d seconds", retry_interval)
+        finally:
+            _local.replica_used = outer_replica_used or _local.replica_used
+        return func(*args, **kwargs)
+    return wrapper
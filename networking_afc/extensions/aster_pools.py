@@ -0,0 +1,66 @@
+"""Read-only admin API of the allocation counters of the Aster pools.
+
+    GET /v2.0/aster-pools
+    GET /v2.0/aster-pools/l3_vni
+
+The counters are maintained by the allocators, see
+``networking_afc.db.pool_stats``, reading them does not scan the
+allocation tables.
+"""
+
+from neutron.api.v2 import resource_helper
+from neutron_lib.api import extensions as api_extensions
+from neutron_lib.plugins import constants as plugin_constants
+
+
+ALIAS = 'aster-pools'
+COLLECTION_NAME = 'aster_pools'
+
+RESOURCE_ATTRIBUTE_MAP = {
+    COLLECTION_NAME: {
+        'id': {'allow_post': False, 'allow_put': False,
+               'is_visible': True},
+        'total': {'allow_post': False, 'allow_put': False,
+                  'is_visible': True},
+        'allocated': {'allow_post': False, 'allow_put': False,
+                      'is_visible': True},
+        'free': {'allow_post': False, 'allow_put': False,
+                 'is_visible': True},
+        'outside_allocated': {'allow_post': False, 'allow_put': False,
+                              'is_visible': True},
+    }
+}
+
+
+class Aster_pools(api_extensions.ExtensionDescriptor):
+    """Allocation counters of the Aster VNI and VLAN pools."""
+
+    @classmethod
+    def get_name(cls):
+        return "Aster allocation pools"
+
+    @classmethod
+    def get_alias(cls):
+        return ALIAS
+
+    @classmethod
+    def get_description(cls):
+        return ("Total, allocated and free IDs of the Aster VXLAN, L2 VNI, "
+                "L3 VNI and border VLAN pools.")
+
+    @classmethod
+    def get_updated(cls):
+        return "2026-10-19T00:00:00-00:00"
+
+    @classmethod
+    def get_resources(cls):
+        plural_mappings = resource_helper.build_plural_mappings(
+            {}, RESOURCE_ATTRIBUTE_MAP)
+        return resource_helper.build_resource_info(
+            plural_mappings, RESOURCE_ATTRIBUTE_MAP, plugin_constants.L3,
+            translate_name=True)
+
+    def get_extended_resources(self, version):
+        if version == "2.0":
+            return RESOURCE_ATTRIBUTE_MAP
+        return {}
@@ -1,23 +1,29 @@
-import json
 import copy
 
-from oslo_config import cfg
 from oslo_log import log as logging
 from neutron_lib.plugins import directory
 from neutron_lib import context as neutron_context
 from neutron.plugins.ml2.driver_context import NetworkContext
 
+from networking_afc.common import config
 from networking_afc.common import utils
+from networking_afc.common import log_utils
 from networking_afc.common import api as afc_api
 from networking_afc.l3_router import l3_vni_manager
 from networking_afc.l3_router import l2_vni_manager
 from networking_afc.l3_router import border_vlan_manager
+from networking_afc.db import orphans
 from networking_afc.db.models import aster_models_v2
 
 
 LOG = logging.getLogger(__name__)
 
 
+def _project_id(router_info):
+    # Requests are queued fairly across the projects owning the routers
+    return router_info.get("project_id") or router_info.get("tenant_id")
+
+
 def add_interface_to_router(add_vrf_params=None):
     switch_ip = add_vrf_params.get("switch_ip")
     l3_vni = add_vrf_params.get("l3_vni")
@@ -33,7 +39,7 @@ def add_interface_to_router(add_vrf_params=None):
 
     request_params = {
         "switch_ip": switch_ip,
-        "project_id": add_vrf_params.get("tenant_id"),
+        "project_id": _project_id(add_vrf_params),
         "network_id": add_vrf_params.get("network_id"),
         "router_id": add_vrf_params.get("id"),
         "router_vni": l3_vni,
@@ -48,9 +54,11 @@ def add_interface_to_router(add_vrf_params=None):
 
     session, read_ctx_manager = utils.get_read_session()
     with read_ctx_manager:
-        switch_vrf_binds = session.query(aster_models_v2.AsterPortBinding). \
-            filter_by(switch_ip=switch_ip, router_id=router_id).all()
-        if not switch_vrf_binds:
+        vrf_bound = session.query(
+            session.query(aster_models_v2.AsterPortBinding).
+            filter_by(switch_ip=switch_ip, router_id=router_id).exists()
+        ).scalar()
+        if not vrf_bound:
             # 1. Create vrf on the physical switch
             # 2. Bind Vlan{vlan_id} interface to vrf and config interface ip
             # 3. Add evpn map [ l3-VNI <----> Vnet{l3-VNI} ]
@@ -71,7 +79,7 @@ def delete_interface_from_router(del_vrf_params=None):
     subnet_mask = cidr.split('/')[1]
     gw_ip = del_vrf_params.get("gip")
 
-    project_id = del_vrf_params.get("tenant_id")
+    project_id = _project_id(del_vrf_params)
     network_id = del_vrf_params.get("network_id")
 
     request_params = {
@@ -91,9 +99,13 @@ def delete_interface_from_router(del_vrf_params=None):
 
     session, read_ctx_manager = utils.get_read_session()
     with read_ctx_manager:
-        switch_vrf_binds = session.query(aster_models_v2.AsterPortBinding).\
-            filter_by(switch_ip=switch_ip, router_id=router_id).all()
-        if len(switch_vrf_binds) == 1:
+        # Only whether a single binding uses the vrf matters, count at
+        # most two of them
+        switch_vrf_binds = session.query(
+            aster_models_v2.AsterPortBinding.binding_id).\
+            filter_by(switch_ip=switch_ip, router_id=router_id).\
+            limit(2).count()
+        if switch_vrf_binds == 1:
             # 1. Remove Vlan{vlan_id} interface ip and Unbind Vlan{vlan_id}
             #    interface from vrf
             # 2. Delete evpn map [ l3-VNI <----> Vnet{l3-VNI} ]
@@ -114,6 +126,11 @@ class AFCL3Driver(object):
         self.l2_vni_manager = l2_vni_manager.L2VniManager()
         # Init border leaf Manager class
         self.border_vlan_manager = border_vlan_manager.BorderVlanManager()
+        # Reclaim the IDs of the routers deleted while the driver failed
+        self.orphan_sweeper = orphans.start([
+            self.l3_vni_manager.release_orphans,
+            self.l2_vni_manager.release_orphans,
+            self.border_vlan_manager.release_orphans])
         self.afc_api = afc_api.AfcRestClient()
 
     def _prepare_network_default_gateway(self, gw_port_id):
@@ -142,21 +159,21 @@ class AFCL3Driver(object):
         #         "vlan_ranges": ["30:50"]
         #     }
         # }
-        return cfg.CONF.ml2_aster.border_switches
+        return config.border_switches()
 
     def _add_network_default_gateway(self, router_info):
         router_id = router_info.get("id")
         gw_port_id = router_info.get("gw_port_id")
         _router_info = self._prepare_network_default_gateway(gw_port_id)
         LOG.debug("_add_network_default_gateway info: \n %s \n ",
-                  json.dumps(_router_info, indent=3))
+                  log_utils.PrettyJson(_router_info))
         l3_vni = router_info.get("l3_vni")
         external_fixed_ip = _router_info.get("fixed_ip")
         gw_ip = _router_info.get("gip")
         cidr = _router_info.get("cidr")
         subnet_mask = cidr.split('/')[1]
 
-        project_id = router_info.get("tenant_id")
+        project_id = _project_id(router_info)
 
         ext_network_id = router_info["external_gateway_info"].\
             get("network_id")
@@ -177,7 +194,7 @@ class AFCL3Driver(object):
         self.l2_vni_manager.allocation_l2_vni(router_id)
         l2_vni = utils.get_l2_vni_by_route_id(router_id)
         border_leafs = self._get_border_leaf_infos()
-        LOG.debug(json.dumps(border_leafs, indent=3))
+        LOG.debug("Border leaf infos: %s", log_utils.PrettyJson(border_leafs))
 
         for border_leaf_ip, border_leaf in border_leafs.items():
             interface_names = border_leaf["physical_network_ports_mapping"].\
@@ -226,7 +243,7 @@ class AFCL3Driver(object):
         external_fixed_ips = ext_gateway.get("external_fixed_ips")
         external_fixed_ip = external_fixed_ips[0].get("ip_address")
 
-        project_id = router_info.get("tenant_id")
+        project_id = _project_id(router_info)
 
         subnet_id = external_fixed_ips[0].get("subnet_id")
         admin_ctx = neutron_context.get_admin_context()
@@ -253,6 +270,10 @@ class AFCL3Driver(object):
 
         border_fixed_ip = "{}/{}".format(external_fixed_ip, subnet_mask)
         default_router_fixed_ip = "{}/{}".format(gw_ip, subnet_mask)
+        # Vlans of the router on all border leafs, fetched before releasing
+        # them one by one
+        vlan_ids = utils.get_vlan_ids_by_router_ids([router_id]).get(
+            router_id, {})
         # Clean default route on border leaf
         border_leafs = self._get_border_leaf_infos()
         for border_leaf_ip, border_leaf in border_leafs.items():
@@ -260,9 +281,7 @@ class AFCL3Driver(object):
                 get(physical_network)
             if not interface_names:
                 continue
-            vlan_id = utils.get_vlan_id_by_route_id(
-                switch_ip=border_leaf_ip, router_id=router_id
-            )
+            vlan_id = vlan_ids.get(border_leaf_ip, -1)
             # Remove a default route to the external network on the vrf
             request_params = {
                 "switch_ip": border_leaf_ip,
@@ -280,7 +299,7 @@ class AFCL3Driver(object):
                 LOG.error("Remove the default gateway on the [%s] failed, "
                           "params >>> \n %s \n, Exception = %s",
                           border_leaf_ip,
-                          json.dumps(request_params, indent=3),
+                          log_utils.PrettyJson(request_params),
                           ex)
             # Remove router interface to VRouter
             config_params = {
@@ -299,7 +318,7 @@ class AFCL3Driver(object):
                 LOG.error("Remove the default gateway on the [%s] failed, "
                           "params >>> \n %s \n, Exception = %s",
                           border_leaf_ip,
-                          json.dumps(config_params, indent=3),
+                          log_utils.PrettyJson(config_params),
                           ex)
             LOG.debug("Remove the default gateway on the [%s], l3-VNI: %s ",
                       border_leaf_ip, l3_vni)
@@ -366,23 +385,18 @@ class AFCL3Driver(object):
         router_id = router_info.get("id")
         subnet_id = router_info.get("subnet_id")
 
-        session, read_ctx_manager = utils.get_read_session()
-        with read_ctx_manager:
-            l2_vni_member_mappings = session.\
-                query(aster_models_v2.AsterPortBinding).\
-                filter_by(subnet_id=subnet_id).\
-                group_by(aster_models_v2.AsterPortBinding.switch_ip).all()
+        l2_vni_member_mappings = utils.get_switch_vlans_by_subnet_id(
+            subnet_id)
 
-        for l2_vni_member_mapping in l2_vni_member_mappings:
-            switch_ip = l2_vni_member_mapping.get("switch_ip")
+        for switch_ip, vlan_id in l2_vni_member_mappings:
             _router_info = copy.deepcopy(router_info)
             add_vrf_params = {
                 "switch_ip": switch_ip,
-                "vlan_id": l2_vni_member_mapping.get("vlan_id")
+                "vlan_id": vlan_id
             }
             add_vrf_params.update(_router_info)
             LOG.debug("Add the vrf configuration on the [%s]: \n %s \n",
-                      switch_ip, json.dumps(add_vrf_params, indent=3))
+                      switch_ip, log_utils.PrettyJson(add_vrf_params))
 
             # Add the vrf configuration on specified physical switch
             add_interface_to_router(add_vrf_params=add_vrf_params)
@@ -400,23 +414,18 @@ class AFCL3Driver(object):
     def remove_router_interface(context, router_info):
         subnet_id = router_info.get("subnet_id")
 
-        session, read_ctx_manager = utils.get_read_session()
-        with read_ctx_manager:
-            l2_vni_member_mappings = session.\
-                query(aster_models_v2.AsterPortBinding).\
-                filter_by(subnet_id=subnet_id).\
-                group_by(aster_models_v2.AsterPortBinding.switch_ip).all()
+        l2_vni_member_mappings = utils.get_switch_vlans_by_subnet_id(
+            subnet_id)
 
-        for l2_vni_member_mapping in l2_vni_member_mappings:
-            switch_ip = l2_vni_member_mapping.get("switch_ip")
+        for switch_ip, vlan_id in l2_vni_member_mappings:
             _router_info = copy.deepcopy(router_info)
             del_vrf_params = {
                 "switch_ip": switch_ip,
-                "vlan_id": l2_vni_member_mapping.get("vlan_id")
+                "vlan_id": vlan_id
             }
             del_vrf_params.update(_router_info)
             LOG.debug("Remove the vrf configuration on the [%s]: \n %s \n",
-                      switch_ip, json.dumps(del_vrf_params, indent=3))
+                      switch_ip, log_utils.PrettyJson(del_vrf_params))
 
             # Clean the vrf configuration on this physical switch
             delete_interface_from_router(del_vrf_params=del_vrf_params)
@@ -1,28 +1,45 @@
 import sys
 
 from six import moves
-from oslo_config import cfg
 from oslo_log import log as logging
 
 from neutron_lib.db import api as lib_db_api
 from neutron_lib.plugins import utils as plugin_utils
+from networking_afc.common import config
+from networking_afc.common import range_set
+from networking_afc.db import allocator
+from networking_afc.db import orphans
+from networking_afc.db import pool_stats
+from networking_afc.db import pool_sync
+from networking_afc.db import prefetch
 from networking_afc.db.models import aster_models_v2
 from networking_afc.common import utils
-from oslo_db import exception as db_exc
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 
 
 LOG = logging.getLogger(__name__)
 
+BULK_SIZE = 100
+
 
 class BorderVlanManager(object):
 
     def __init__(self):
+        # Free vlan pool of each border leaf, keyed by switch_ip
+        self._pools = {}
+        # Configured vlans of each border leaf, keyed by switch_ip
+        self._vlan_sets = {}
         self._parse_network_vlan_ranges()
-        self._sync_vlan_allocations()
+        self.pool_sync = pool_sync.start(
+            "border_vlan", self.border_leaf_vlan_ranges,
+            self._sync_vlan_allocations,
+            [self._pool_name(switch_ip)
+             for switch_ip in self.border_leaf_vlan_ranges])
 
     def _parse_network_vlan_ranges(self):
         try:
-            border_switches = cfg.CONF.ml2_aster.border_switches
+            border_switches = config.border_switches()
             vlan_ranges = []
             for border_switch_ip,  border_switch in border_switches.items():
                 vlan_ranges.append(
@@ -31,19 +48,32 @@ class BorderVlanManager(object):
                 )
             self.border_leaf_vlan_ranges = plugin_utils.\
                 parse_network_vlan_ranges(vlan_ranges)
+            self._vlan_sets = dict(
+                (switch_ip, range_set.RangeSet(ranges))
+                for switch_ip, ranges in self.border_leaf_vlan_ranges.items())
         except Exception as ex:
             LOG.exception("Failed to parse border_leaf_vlan_ranges. ex: %s "
                           "Service terminated!", ex)
             sys.exit(1)
 
+    def _vlan_set(self, leaf_ip):
+        # Follows the ranges when they are replaced
+        vlan_set = range_set.get(self.border_leaf_vlan_ranges.get(leaf_ip, []),
+                                 self._vlan_sets.get(leaf_ip))
+        self._vlan_sets[leaf_ip] = vlan_set
+        return vlan_set
+
     @lib_db_api.retry_db_errors
     def _sync_vlan_allocations(self):
         session, writer_ctx_manager = utils.get_writer_session()
         with writer_ctx_manager:
             # get existing allocations for all physical networks
             allocations = dict()
-            allocs = session.\
-                query(aster_models_v2.AsterLeafVlanAllocation).all()
+            # Plain (switch_ip, vlan_id, router_id) rows, no ORM instances
+            # are needed
+            model = aster_models_v2.AsterLeafVlanAllocation
+            allocs = session.query(model.switch_ip, model.vlan_id,
+                                   model.router_id).all()
             for alloc in allocs:
                 if alloc.switch_ip not in allocations:
                     allocations[alloc.switch_ip] = list()
@@ -54,9 +84,7 @@ class BorderVlanManager(object):
                     self.border_leaf_vlan_ranges.items():
                 # determine current configured allocatable vlans for
                 # this border leaf
-                vlan_ids = set()
-                for vlan_min, vlan_max in vlan_ranges:
-                    vlan_ids |= set(moves.range(vlan_min, vlan_max + 1))
+                vlan_ids = set(self._vlan_set(switch_ip))
 
                 # remove from table unallocated vlans not currently
                 # allocatable
@@ -89,15 +117,13 @@ class BorderVlanManager(object):
                                 session.flush()
                     del allocations[switch_ip]
 
-                # add missing allocatable vlans to table
-                for vlan_id in sorted(vlan_ids):
-                    binding = aster_models_v2.AsterLeafVlanAllocation(
-                        switch_ip=switch_ip,
-                        vlan_id=vlan_id,
-                        router_id=""
-                    )
-                    session.add(binding)
-                    session.flush()
+                # add missing allocatable vlans to table in bulk
+                vlan_ids = sorted(vlan_ids)
+                for i in moves.range(0, len(vlan_ids), BULK_SIZE):
+                    session.execute(model.__table__.insert(), [
+                        {'switch_ip': switch_ip, 'vlan_id': vlan_id,
+                         'router_id': ""}
+                        for vlan_id in vlan_ids[i: i + BULK_SIZE]])
             # remove from table unallocated vlans for any unconfigured
             # switch_ip
             for allocs in allocations.values():
@@ -113,39 +139,86 @@ class BorderVlanManager(object):
                             filter_by(switch_ip=alloc.switch_ip,
                                       vlan_id=alloc.vlan_id,
                                       router_id=alloc.router_id).delete()
+            for switch_ip, vlan_ranges in \
+                    self.border_leaf_vlan_ranges.items():
+                pool_stats.recount(
+                    session, self._pool_name(switch_ip), vlan_ranges,
+                    (vlan_id for vlan_id, in session.query(
+                        model.vlan_id).filter(model.switch_ip == switch_ip,
+                                              model.router_id != "")))
+        # Rows were added or removed
+        for pool in self._pools.values():
+            pool.invalidate()
+
+    @staticmethod
+    def _pool_name(leaf_ip):
+        return "border_vlan:%s" % leaf_ip
+
+    def _get_pool(self, leaf_ip):
+        pool = self._pools.get(leaf_ip)
+        if pool is None:
+            model = aster_models_v2.AsterLeafVlanAllocation
+            pool = self._pools.setdefault(leaf_ip, prefetch.router_pool(
+                allocator.router_pool(self._pool_name(leaf_ip), model,
+                                      model.vlan_id, switch_ip=leaf_ip),
+                model, model.vlan_id, switch_ip=leaf_ip))
+        return pool
 
     def allocate_segment(self, leaf_ip=None, router_id=None):
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
-        try:
-            with ctx_manager:
-                allocations = session.\
-                    query(aster_models_v2.AsterLeafVlanAllocation).\
-                    filter_by(switch_ip=leaf_ip, router_id="").all()
-                if not allocations:
-                    # No resource available
-                    raise Exception
-                alloc = allocations[-1]
-                session.query(aster_models_v2.AsterLeafVlanAllocation).\
-                    filter_by(switch_ip=leaf_ip, vlan_id=alloc.vlan_id).\
-                    update({"router_id": router_id})
-                session.flush()
-        except db_exc.DBDuplicateEntry as ex:
-            # Segment already allocated (insert failure)
-            raise ex
+        with ctx_manager:
+            vlan_id = self._get_pool(leaf_ip).allocate(session, router_id)
+            if vlan_id is None:
+                raise ex.AllocationPoolExhausted(pool=self._pool_name(leaf_ip))
 
     def release_segment(self, leaf_ip=None, router_id=None):
-        ranges = self.border_leaf_vlan_ranges.get(leaf_ip, [])
-        vlan_ids = set()
-        for vlan_id_min, vlan_id_max in ranges:
-            vlan_ids |= set(moves.range(vlan_id_min, vlan_id_max + 1))
-
+        vlan_ids = self._vlan_set(leaf_ip)
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
         with ctx_manager:
             alloc = session.query(aster_models_v2.AsterLeafVlanAllocation).\
                 filter_by(switch_ip=leaf_ip, router_id=router_id).first()
+            released_vlan = None
             if alloc and alloc.vlan_id in vlan_ids:
                 alloc.router_id = ""
+                released_vlan = alloc.vlan_id
+                pool_stats.adjust(session, self._pool_name(leaf_ip),
+                                  allocated=-1)
             else:
-                session.query(aster_models_v2.AsterLeafVlanAllocation).\
+                removed = session.query(
+                    aster_models_v2.AsterLeafVlanAllocation).\
                     filter_by(switch_ip=leaf_ip, router_id=router_id).delete()
+                if removed:
+                    pool_stats.adjust(session, self._pool_name(leaf_ip),
+                                      outside=-removed)
             session.flush()
+        if released_vlan is not None:
+            self._get_pool(leaf_ip).release(released_vlan)
+
+    def release_orphans(self):
+        """Release the vlans of the routers that no longer exist, on the
+        configured border leaves and the ones removed from the
+        configuration.
+
+        :returns: the number of vlans reclaimed
+        """
+        self.pool_sync.wait()
+        model = aster_models_v2.AsterLeafVlanAllocation
+        session, ctx_manager = utils.get_writer_session()
+        with ctx_manager:
+            leaf_ips = set(switch_ip for switch_ip, in session.query(
+                model.switch_ip).distinct())
+        count = 0
+        for leaf_ip in sorted(leaf_ips):
+            released, removed = orphans.sweep(
+                self._pool_name(leaf_ip), model, model.vlan_id,
+                self._vlan_set(leaf_ip), switch_ip=leaf_ip)
+            for vlan_id in released:
+                self._get_pool(leaf_ip).release(vlan_id)
+            count += len(released) + len(removed)
+        if count:
+            utils.invalidate_allocation_memo()
+        return count
@@ -1,10 +1,15 @@
-import six
-
 from oslo_config import cfg
 from oslo_log import log as logging
-from oslo_db import exception as db_exc
+from networking_afc.db import free_ranges
+from networking_afc.db import orphans
+from networking_afc.db import pool_stats
+from networking_afc.db import pool_sync
+from networking_afc.db import prefetch
 from networking_afc.db.models import aster_models_v2
+from networking_afc.common import range_set
 from networking_afc.common import utils
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 from neutronclient._i18n import _
 
 
@@ -26,12 +31,21 @@ class L2VniManager(object):
 
     def __init__(self):
         self.l2_vni_ranges = []
+        self._l2_vni_set = None
+        model = aster_models_v2.AsterL2VNIAllocation
+        self._pool = prefetch.router_pool(
+            free_ranges.router_pool(free_ranges.POOL_L2_VNI,
+                                    model, model.l2_vni),
+            model, model.l2_vni, free_pool=free_ranges.POOL_L2_VNI)
         self._verify_vni_ranges()
-        self.sync_allocations()
+        self.pool_sync = pool_sync.start(
+            free_ranges.POOL_L2_VNI,
+            (self.l2_vni_ranges, cfg.CONF.aster_db.vni_pool_storage),
+            self.sync_allocations)
 
     def _verify_vni_ranges(self):
         try:
-            self._parse_aster_l2_vni_ranges(
+            self._l2_vni_set = self._parse_aster_l2_vni_ranges(
                 cfg.CONF.ml2_type_aster_vxlan.l2_vni_ranges,
                 self.l2_vni_ranges
             )
@@ -52,25 +66,45 @@ class L2VniManager(object):
                 raise ex
             current_range.append(tunnel_range)
 
+        # Raises ValueError for a range whose max is lower than its min
+        vni_set = range_set.RangeSet(current_range)
+        if vni_set.overlapping:
+            LOG.warning("Aster CX Switch L2 VNI ranges %s overlap",
+                        current_range)
         LOG.info("Aster CX Switch L3 VNI ranges: %(range)s",
-                 {'range': current_range})
+                 {'range': vni_set})
+        return vni_set
+
+    def _vni_set(self):
+        # Follows the ranges when they are replaced
+        self._l2_vni_set = range_set.get(self.l2_vni_ranges,
+                                         self._l2_vni_set)
+        return self._l2_vni_set
 
     def sync_allocations(self):
         """
         Synchronize vxlan_allocations table with configured tunnel ranges.
         """
+        if free_ranges.ranges_enabled():
+            model = aster_models_v2.AsterL2VNIAllocation
+            free_ranges.sync_pool(free_ranges.POOL_L2_VNI, model.l2_vni,
+                                  model.router_id == "", self.l2_vni_ranges)
+            self._recount()
+            self._pool.invalidate()
+            return
 
         # determine current configured allocatable vnis
-        l2_vnis = set()
-        for l2_vni_min, l2_vni_max in self.l2_vni_ranges:
-            l2_vnis |= set(six.moves.range(l2_vni_min, l2_vni_max + 1))
+        l2_vnis = self._vni_set()
 
         session, writer_ctx_manager = utils.get_writer_session()
         with writer_ctx_manager:
+            free_ranges.clear_pool(session, free_ranges.POOL_L2_VNI)
             # remove from table unallocated tunnels not currently allocatable
             # fetch results as list via all() because we'll be iterating
-            # through them twice
-            allocs = (session.query(aster_models_v2.AsterL2VNIAllocation).
+            # through them twice, as plain (l2_vni, router_id) rows since no
+            # ORM instances are needed
+            model = aster_models_v2.AsterL2VNIAllocation
+            allocs = (session.query(model.l2_vni, model.router_id).
                       with_lockmode("update").all())
             # collect all vnis present in db
             existing_vnis = set(alloc.l2_vni for alloc in allocs)
@@ -89,7 +123,7 @@ class L2VniManager(object):
                     l2_vni.in_(vni_list)).delete(
                         synchronize_session=False)
             # collect vnis that need to be added
-            vnis = list(l2_vnis - existing_vnis)
+            vnis = [vni for vni in l2_vnis if vni not in existing_vnis]
             chunked_vnis = (vnis[i: i + bulk_size] for i in
                             range(0, len(vnis), bulk_size))
             for vni_list in chunked_vnis:
@@ -97,41 +131,75 @@ class L2VniManager(object):
                         for vni in vni_list]
                 session.execute(aster_models_v2.AsterL2VNIAllocation.
                                 __table__.insert(), bulk)
+        self._recount()
+        # Rows were added or removed
+        self._pool.invalidate()
+
+    def _recount(self):
+        model = aster_models_v2.AsterL2VNIAllocation
+        session, writer_ctx_manager = utils.get_writer_session()
+        with writer_ctx_manager:
+            pool_stats.recount(
+                session, free_ranges.POOL_L2_VNI, self.l2_vni_ranges,
+                (l2_vni for l2_vni, in session.query(model.l2_vni).filter(
+                    model.router_id != "")))
 
     def allocation_l2_vni(self, router_id):
         # Allocations one l2 vni to VRouter
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
-        try:
-            with ctx_manager:
-                all_l2_vni = session.query(
-                    aster_models_v2.AsterL2VNIAllocation).\
-                    filter_by(router_id="").all()
-                if not all_l2_vni:
-                    # No resource available
-                    raise Exception
-                one_l2_vni = all_l2_vni[-1]
-                session.query(aster_models_v2.AsterL2VNIAllocation).\
-                    filter_by(l2_vni=one_l2_vni.l2_vni).\
-                    update({"router_id": router_id})
-                session.flush()
-        except db_exc.DBDuplicateEntry as ex:
-            # Segment already allocated (insert failure)
-            raise ex
+        with ctx_manager:
+            l2_vni = self._pool.allocate(session, router_id)
+            if l2_vni is None:
+                raise ex.AllocationPoolExhausted(
+                    pool=free_ranges.POOL_L2_VNI)
 
     def release_l2_vni(self, router_id):
         # do not pass unit test
         # Release l2 vni from VRouter
-        l2_vnis = set()
-        for l2_vni_min, l2_vni_max in self.l2_vni_ranges:
-            l2_vnis |= set(six.moves.range(l2_vni_min, l2_vni_max + 1))
+        l2_vnis = self._vni_set()
 
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
         with ctx_manager:
             alloc = session.query(aster_models_v2.AsterL2VNIAllocation). \
                 filter_by(router_id=router_id).first()
+            released_vni = None
             if alloc and alloc.l2_vni in l2_vnis:
-                alloc.router_id = ""
+                released_vni = alloc.l2_vni
+                if free_ranges.ranges_enabled():
+                    session.delete(alloc)
+                    free_ranges.add_free_id(
+                        session, free_ranges.POOL_L2_VNI, released_vni)
+                else:
+                    alloc.router_id = ""
+                pool_stats.adjust(session, free_ranges.POOL_L2_VNI,
+                                  allocated=-1)
             else:
-                session.query(aster_models_v2.AsterL2VNIAllocation). \
+                removed = session.query(
+                    aster_models_v2.AsterL2VNIAllocation). \
                     filter_by(router_id=router_id).delete()
+                if removed:
+                    pool_stats.adjust(session, free_ranges.POOL_L2_VNI,
+                                      outside=-removed)
             session.flush()
+        if released_vni is not None:
+            self._pool.release(released_vni)
+
+    def release_orphans(self):
+        """Release the vnis of the routers that no longer exist.
+
+        :returns: the number of vnis reclaimed
+        """
+        self.pool_sync.wait()
+        model = aster_models_v2.AsterL2VNIAllocation
+        released, removed = orphans.sweep(
+            free_ranges.POOL_L2_VNI, model, model.l2_vni, self._vni_set(),
+            free_pool=free_ranges.POOL_L2_VNI)
+        for vni in released:
+            self._pool.release(vni)
+        if released or removed:
+            utils.invalidate_allocation_memo()
+        return len(released) + len(removed)
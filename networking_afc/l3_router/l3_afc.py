@@ -1,6 +1,8 @@
 
 import copy
 
+from neutron_lib.db import utils as db_utils
+from neutron_lib import exceptions as n_exc
 from neutron_lib.plugins import constants as plugin_constants
 from neutron_lib.plugins import directory
 from neutron_lib.services import base as service_base
@@ -9,13 +11,19 @@ from oslo_log import log as logging
 from oslo_utils import excutils
 
 from networking_afc._i18n import _LE
+from neutron.api import extensions
 from neutron.db import extraroute_db
 from neutron.db import l3_agentschedulers_db
 from neutron.db import l3_gwmode_db
 from neutron.plugins.ml2.driver_context import NetworkContext  # noqa
 
+from networking_afc import extensions as afc_extensions
+from networking_afc.db import pool_stats
+from networking_afc.extensions import aster_pools
 from networking_afc.l3_router import afc_l3_driver
 from networking_afc.common import utils
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 
 
 LOG = logging.getLogger(__name__)
@@ -32,10 +40,11 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
     """
 
     supported_extension_aliases = ["router", "ext-gw-mode",
-                                   "extraroute"]
+                                   "extraroute", aster_pools.ALIAS]
 
     def __init__(self):
         super(AsterL3ServicePlugin, self).__init__()
+        extensions.append_api_extensions_path(afc_extensions.__path__)
         self.driver = afc_l3_driver.AFCL3Driver()
 
     def get_plugin_type(self):
@@ -47,6 +56,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
                 "based routing")
 
     @log_helpers.log_method_call
+    @utils.memoize_allocation_lookups
     def create_router(self, context, router):
         """Create a new router entry in DB, and create it Aster HW."""
 
@@ -69,6 +79,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
                 )
 
     @log_helpers.log_method_call
+    @utils.memoize_allocation_lookups
     def update_router(self, context, router_id, router):
         """Update an existing router in DB, and update it in Aster HW."""
 
@@ -89,6 +100,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
                       new_router, exc)
 
     @log_helpers.log_method_call
+    @utils.memoize_allocation_lookups
     def delete_router(self, context, router_id):
         """Delete an existing router from Aster HW as well as from the DB."""
 
@@ -105,6 +117,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
         super(AsterL3ServicePlugin, self).delete_router(context, router_id)
 
     @log_helpers.log_method_call
+    @utils.memoize_allocation_lookups
     def add_router_interface(self, context, router_id, interface_info):
         """Add a subnet of a network to an existing router."""
 
@@ -139,6 +152,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
         router_info = copy.deepcopy(new_router)
         router_info['seg_id'] = seg_id
         router_info['name'] = router['name']
+        router_info['project_id'] = router['tenant_id']
         router_info['cidr'] = subnet['cidr']
         router_info['gip'] = subnet['gateway_ip']
         router_info['fixed_ip'] = fixed_ip
@@ -162,6 +176,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
                 )
 
     @log_helpers.log_method_call
+    @utils.memoize_allocation_lookups
     def remove_router_interface(self, context, router_id, interface_info):
         """Remove a subnet of a network from an existing router."""
 
@@ -185,6 +200,7 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
         router_info = copy.deepcopy(router_to_del)
         router_info['seg_id'] = seg_id
         router_info['name'] = router['name']
+        router_info['project_id'] = router['tenant_id']
         router_info['cidr'] = subnet['cidr']
         router_info['gip'] = subnet['gateway_ip']
         router_info['ip_version'] = subnet['ip_version']
@@ -199,3 +215,27 @@ class AsterL3ServicePlugin(service_base.ServicePluginBase,
                           "Exception =%(exc)s"),
                       {'interface': interface_info, 'router_id': router_id,
                        'exc': exc})
+
+    def _get_pool_stats(self, context, pool=None):
+        if not context.is_admin:
+            raise n_exc.AdminRequired(
+                reason="allocation pools are visible to admins only")
+        pools = pool_stats.get_stats(context.session, pool=pool)
+        for stats in pools:
+            stats['id'] = stats.pop('pool')
+        return pools
+
+    def get_aster_pools(self, context, filters=None, fields=None,
+                        sorts=None, limit=None, marker=None,
+                        page_reverse=False):
+        pools = self._get_pool_stats(context)
+        ids = (filters or {}).get('id')
+        if ids:
+            pools = [pool for pool in pools if pool['id'] in ids]
+        return [db_utils.resource_fields(pool, fields) for pool in pools]
+
+    def get_aster_pool(self, context, id, fields=None):
+        pools = self._get_pool_stats(context, pool=id)
+        if not pools:
+            raise ex.AllocationPoolNotFound(pool=id)
+        return db_utils.resource_fields(pools[0], fields)
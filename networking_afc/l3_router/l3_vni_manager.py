@@ -1,11 +1,15 @@
-import six
-
 from oslo_config import cfg
 from oslo_log import log as logging
-from oslo_db import exception as db_exc
-from neutron.db.models import l3 as l3_models
+from networking_afc.db import free_ranges
+from networking_afc.db import orphans
+from networking_afc.db import pool_stats
+from networking_afc.db import pool_sync
+from networking_afc.db import prefetch
 from networking_afc.db.models import aster_models_v2
+from networking_afc.common import range_set
 from networking_afc.common import utils
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 from neutronclient._i18n import _
 
 
@@ -27,12 +31,21 @@ class L3VniManager(object):
 
     def __init__(self):
         self.l3_vni_ranges = []
+        self._l3_vni_set = None
+        model = aster_models_v2.AsterL3VNIAllocation
+        self._pool = prefetch.router_pool(
+            free_ranges.router_pool(free_ranges.POOL_L3_VNI,
+                                    model, model.l3_vni),
+            model, model.l3_vni, free_pool=free_ranges.POOL_L3_VNI)
         self._verify_vni_ranges()
-        self.sync_allocations()
+        self.pool_sync = pool_sync.start(
+            free_ranges.POOL_L3_VNI,
+            (self.l3_vni_ranges, cfg.CONF.aster_db.vni_pool_storage),
+            self.sync_allocations)
 
     def _verify_vni_ranges(self):
         try:
-            self._parse_aster_l3_vni_ranges(
+            self._l3_vni_set = self._parse_aster_l3_vni_ranges(
                 cfg.CONF.ml2_type_aster_vxlan.l3_vni_ranges,
                 self.l3_vni_ranges
             )
@@ -54,23 +67,43 @@ class L3VniManager(object):
                 raise ex
             current_range.append(tunnel_range)
 
+        # Raises ValueError for a range whose max is lower than its min
+        vni_set = range_set.RangeSet(current_range)
+        if vni_set.overlapping:
+            LOG.warning("Aster CX Switch L3 VNI ranges %s overlap",
+                        current_range)
         LOG.debug("Aster CX Switch L3 VNI ranges: %(range)s",
-                  {'range': current_range})
+                  {'range': vni_set})
+        return vni_set
+
+    def _vni_set(self):
+        # Follows the ranges when they are replaced
+        self._l3_vni_set = range_set.get(self.l3_vni_ranges,
+                                         self._l3_vni_set)
+        return self._l3_vni_set
 
     def sync_allocations(self):
         """
         Synchronize vxlan_allocations table with configured tunnel ranges.
         """
-        l3_vnis = set()
-        for l3_vni_min, l3_vni_max in self.l3_vni_ranges:
-            l3_vnis |= set(six.moves.range(l3_vni_min, l3_vni_max + 1))
+        if free_ranges.ranges_enabled():
+            self._sync_free_ranges()
+            self._sweep_orphans()
+            self._recount()
+            self._pool.invalidate()
+            return
+
+        l3_vnis = self._vni_set()
 
         session, writer_ctx_manager = utils.get_writer_session()
         with writer_ctx_manager:
+            free_ranges.clear_pool(session, free_ranges.POOL_L3_VNI)
             # remove from table unallocated tunnels not currently allocatable
             # fetch results as list via all() because we'll be iterating
-            # through them twice
-            allocs = (session.query(aster_models_v2.AsterL3VNIAllocation).
+            # through them twice, as plain (l3_vni, router_id) rows since no
+            # ORM instances are needed
+            model = aster_models_v2.AsterL3VNIAllocation
+            allocs = (session.query(model.l3_vni, model.router_id).
                       with_lockmode("update").all())
             # collect all vnis present in db
             existing_vnis = set(alloc.l3_vni for alloc in allocs)
@@ -89,7 +122,7 @@ class L3VniManager(object):
                     l3_vni.in_(vni_list)).delete(
                         synchronize_session=False)
             # collect vnis that need to be added
-            vnis = list(l3_vnis - existing_vnis)
+            vnis = [vni for vni in l3_vnis if vni not in existing_vnis]
             chunked_vnis = (vnis[i: i + bulk_size] for i in
                             range(0, len(vnis), bulk_size))
             for vni_list in chunked_vnis:
@@ -97,58 +130,86 @@ class L3VniManager(object):
                         for vni in vni_list]
                 session.execute(aster_models_v2.AsterL3VNIAllocation.
                                 __table__.insert(), bulk)
-
-            existing_router_ids = set(
-                alloc.router_id for alloc in allocs if alloc.router_id)
-            routers = (session.query(
-                l3_models.Router).with_lockmode("update").all())
-            router_ids = set(router.id for router in routers if router)
-            not_exist_router_ids = list(existing_router_ids - router_ids)
-            session.flush()
-            for not_exist_router_id in not_exist_router_ids:
-                _alloc = session.query(aster_models_v2.AsterL3VNIAllocation).\
-                    filter_by(router_id=not_exist_router_id).first()
-                if _alloc and _alloc.l3_vni in l3_vnis:
-                    _alloc.router_id = ""
-                else:
-                    session.query(aster_models_v2.AsterL3VNIAllocation).\
-                        filter_by(router_id=not_exist_router_id).delete()
-                session.flush()
+        # Release the vnis of deleted routers
+        self._sweep_orphans()
+        self._recount()
+        # Rows were added or removed
+        self._pool.invalidate()
+
+    def _recount(self):
+        model = aster_models_v2.AsterL3VNIAllocation
+        session, writer_ctx_manager = utils.get_writer_session()
+        with writer_ctx_manager:
+            pool_stats.recount(
+                session, free_ranges.POOL_L3_VNI, self.l3_vni_ranges,
+                (l3_vni for l3_vni, in session.query(model.l3_vni).filter(
+                    model.router_id != "")))
+
+    def _sync_free_ranges(self):
+        model = aster_models_v2.AsterL3VNIAllocation
+        free_ranges.sync_pool(free_ranges.POOL_L3_VNI, model.l3_vni,
+                              model.router_id == "", self.l3_vni_ranges)
+
+    def _sweep_orphans(self):
+        model = aster_models_v2.AsterL3VNIAllocation
+        released, removed = orphans.sweep(
+            free_ranges.POOL_L3_VNI, model, model.l3_vni, self._vni_set(),
+            free_pool=free_ranges.POOL_L3_VNI)
+        for vni in released:
+            self._pool.release(vni)
+        return len(released) + len(removed)
+
+    def release_orphans(self):
+        """Release the vnis of the routers that no longer exist.
+
+        :returns: the number of vnis reclaimed
+        """
+        self.pool_sync.wait()
+        count = self._sweep_orphans()
+        if count:
+            utils.invalidate_allocation_memo()
+        return count
 
     def allocation_l3_vni(self, router_id):
         # Allocations one l3 vni to VRouter
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
-        try:
-            with ctx_manager:
-                all_l3_vni = session.\
-                    query(aster_models_v2.AsterL3VNIAllocation).\
-                    filter_by(router_id="").all()
-                if not all_l3_vni:
-                    # No resource available
-                    raise Exception
-                one_l3_vni = all_l3_vni[-1]
-                session.query(aster_models_v2.AsterL3VNIAllocation).\
-                    filter_by(l3_vni=one_l3_vni.l3_vni).\
-                    update({"router_id": router_id})
-                session.flush()
-        except db_exc.DBDuplicateEntry as ex:
-            # Segment already allocated (insert failure)
-            raise ex
+        with ctx_manager:
+            l3_vni = self._pool.allocate(session, router_id)
+            if l3_vni is None:
+                raise ex.AllocationPoolExhausted(
+                    pool=free_ranges.POOL_L3_VNI)
 
     def release_l3_vni(self, router_id):
         # do not pass unit test
         # Release l3 vni from VRouter
-        l3_vnis = set()
-        for l3_vni_min, l3_vni_max in self.l3_vni_ranges:
-            l3_vnis |= set(six.moves.range(l3_vni_min, l3_vni_max + 1))
+        l3_vnis = self._vni_set()
 
+        self.pool_sync.wait()
+        utils.invalidate_allocation_memo()
         session, ctx_manager = utils.get_writer_session()
         with ctx_manager:
             alloc = session.query(aster_models_v2.AsterL3VNIAllocation).\
                 filter_by(router_id=router_id).first()
+            released_vni = None
             if alloc and alloc.l3_vni in l3_vnis:
-                alloc.router_id = ""
+                released_vni = alloc.l3_vni
+                if free_ranges.ranges_enabled():
+                    session.delete(alloc)
+                    free_ranges.add_free_id(
+                        session, free_ranges.POOL_L3_VNI, released_vni)
+                else:
+                    alloc.router_id = ""
+                pool_stats.adjust(session, free_ranges.POOL_L3_VNI,
+                                  allocated=-1)
             else:
-                session.query(aster_models_v2.AsterL3VNIAllocation).\
+                removed = session.query(
+                    aster_models_v2.AsterL3VNIAllocation).\
                     filter_by(router_id=router_id).delete()
+                if removed:
+                    pool_stats.adjust(session, free_ranges.POOL_L3_VNI,
+                                      outside=-removed)
             session.flush()
+        if released_vni is not None:
+            self._pool.release(released_vni)
@@ -47,3 +47,25 @@ class NoFoundPhysicalSwitch(exceptions.NeutronException):
 class AsterDisallowCreateSubnet(exceptions.NeutronException):
     """Limit a network to only one subnet."""
     message = _("Disallow the creation of multiple subnets under a network.")
+
+
+class AfcRequestQueueTimeout(exceptions.NeutronException):
+    """Request waited too long for the AFC rate limiter."""
+    message = _("Request to Aster switch %(switch_ip)s was not sent to AFC "
+                "after waiting %(timeout)s seconds for the rate limiter.")
+
+
+class PoolSyncTimeout(exceptions.NeutronException):
+    """Allocation waited too long for the synchronization of its pool."""
+    message = _("Allocation pool %(pool)s was not synchronized after "
+                "waiting %(timeout)s seconds.")
+
+
+class AllocationPoolExhausted(exceptions.ResourceExhausted):
+    """No free ID is left in an allocation pool."""
+    message = _("No free ID is left in allocation pool %(pool)s.")
+
+
+class AllocationPoolNotFound(exceptions.NotFound):
+    """No counters are stored for an allocation pool."""
+    message = _("Allocation pool %(pool)s could not be found.")
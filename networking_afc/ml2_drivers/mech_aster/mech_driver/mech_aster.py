@@ -14,12 +14,13 @@
 # limitations under the License.
 import os
 import copy
-import json
 import threading
 
+import sqlalchemy as sa
 from oslo_log import log
 from oslo_config import cfg
 from oslo_concurrency import lockutils
+from oslo_db import exception as db_exc
 from neutron_lib import constants
 from neutron_lib.plugins.ml2 import api
 from neutron_lib.api.definitions import portbindings
@@ -31,6 +32,8 @@ from neutron_lib.db import api as lib_db_api
 
 from networking_afc.common import api as afc_api
 from networking_afc.common import utils
+from networking_afc.common import log_utils
+from networking_afc.db import host_mappings
 from networking_afc.db.models import aster_models_v2
 from networking_afc.ml2_drivers.mech_aster.mech_driver import (
     exceptions as exc)
@@ -55,6 +58,8 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
     def initialize(self):
         self.context = neutron_context.Context()
         self._ppid = os.getpid()
+        utils.subscribe_subnet_cache_invalidation()
+        host_mappings.sync_from_config()
         LOG.debug("AsterCXSwitchMechanismDriver: initialize() "
                   "called pid %(pid)d thid %(tid)d",
                   {'pid': self._ppid, 'tid': threading.current_thread().ident}
@@ -160,80 +165,86 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
     #         }
     #     }
     # }
-    @staticmethod
-    def _get_server_connect_switch_infos():
-        switch_infos = CONF.ml2_aster.cx_switches
-        LOG.debug("Server and cx switch connect infos: %s", switch_infos)
-        #   switch_ip     switch_interfaces  host_id      physical_network
-        #  192.168.4.102      ['X25']       controller     physnet_4_102
-        #  192.168.4.102      ['X23']       computer1      physnet_4_102
-        #  192.168.4.102                    computer2      physnet_4_102
-        #  192.168.4.105                    controller     physnet_4_105
-        #  192.168.4.105                    computer1      physnet_4_105
-        #  192.168.4.105      ['X37']       computer2      physnet_4_105
-        return [(k, v) for k, v in switch_infos.items()]
-
-    def _get_port_connections(self, port, host_id):
+    def _get_port_connections(self, port, host_id, session=None):
         LOG.debug("Getting server connection's cx switches. "
                   "port %(port)s on host_id %(host_id)s",
                   {'port': port,
                    'host_id': host_id})
         # Get sever connect server port info and physical_network info
-        switch_infos = self._get_server_connect_switch_infos()
-        ret = []
-        for switch_ip, switch_info in switch_infos:
-            if host_id in switch_info.get("host_ports_mapping").keys():
-                ret.append((switch_ip, switch_info))
-        return ret
+        #   switch_ip     switch_interfaces  host_id      physical_network
+        #  192.168.4.102      X25           controller     physnet_4_102
+        #  192.168.4.102      X29           computer1      physnet_4_102
+        #  192.168.4.105      X37           computer2      physnet_4_105
+        return host_mappings.get_host_connections(host_id, session=session)
+
+    def _get_host_switches(self, port, host_id, physical_network,
+                           session=None):
+        # Switches connected to the host on the segment's physical network
+        return [(switch_ip, host_connection)
+                for switch_ip, host_connection in
+                self._get_port_connections(port, host_id, session=session)
+                if host_connection.get("physnet") == physical_network]
 
     def _configure_physical_switch_db(self, port=None, vxlan_segment=None,
-                                      vlan_segment=None):
+                                      vlan_segment=None, session=None):
         # Check that both segments are valid
         if not self._is_valid_segment(vxlan_segment=vxlan_segment,
                                       vlan_segment=vlan_segment):
             return
-        network_id = port.get("network_id")
-        subnet_detail = utils.get_subnet_detail_by_network_id(
-            network_id=network_id)
-        if not subnet_detail:
-            return
-        subnet_id = subnet_detail.get("subnet_id")
-
-        host_id = port.get(portbindings.HOST_ID)
-        l2_vni = vxlan_segment.get(api.SEGMENTATION_ID)
-        vlan_id = vlan_segment.get(api.SEGMENTATION_ID)
-        physical_network = vlan_segment.get(api.PHYSICAL_NETWORK)
-
-        # Get host connection physical switch infos
-        host_connections = self._get_port_connections(port, host_id)
-        for switch_ip, host_connection in host_connections:
-            if host_connection.get("physnet") != physical_network:
-                continue
-            session = lib_db_api.get_reader_session()
-            with session.begin():
-                vni_member_mappings = session.\
-                    query(aster_models_v2.AsterPortBinding).\
-                    filter_by(switch_ip=switch_ip, subnet_id=subnet_id).all()
-                if not vni_member_mappings:
-                    session = lib_db_api.get_writer_session()
-                    binding = aster_models_v2.AsterPortBinding(
-                        switch_ip=switch_ip,
-                        vlan_id=vlan_id,
-                        l2_vni=l2_vni,
-                        subnet_id=subnet_id
-                    )
-                    session.add(binding)
-                    session.flush()
-
-    def _configure_physical_switch(self, port=None,
-                                   vxlan_segment=None, vlan_segment=None):
+        session = session or lib_db_api.get_writer_session()
+        with session.begin(subtransactions=True):
+            network_id = port.get("network_id")
+            subnet_detail = utils.get_subnet_detail_by_network_id(
+                network_id=network_id, session=session)
+            if not subnet_detail:
+                return
+            subnet_id = subnet_detail.get("subnet_id")
+
+            host_id = port.get(portbindings.HOST_ID)
+            l2_vni = vxlan_segment.get(api.SEGMENTATION_ID)
+            vlan_id = vlan_segment.get(api.SEGMENTATION_ID)
+            physical_network = vlan_segment.get(api.PHYSICAL_NETWORK)
+
+            # Get host connection physical switch infos
+            switch_ips = [switch_ip for switch_ip, _ in
+                          self._get_host_switches(port, host_id,
+                                                  physical_network,
+                                                  session=session)]
+            if not switch_ips:
+                return
+            model = aster_models_v2.AsterPortBinding
+            bound_switch_ips = set(
+                switch_ip for switch_ip, in session.query(model.switch_ip).
+                filter(model.switch_ip.in_(switch_ips),
+                       model.subnet_id == subnet_id))
+            for switch_ip in switch_ips:
+                if switch_ip in bound_switch_ips:
+                    continue
+                session.add(model(
+                    switch_ip=switch_ip,
+                    vlan_id=vlan_id,
+                    l2_vni=l2_vni,
+                    subnet_id=subnet_id
+                ))
+            try:
+                session.flush()
+            except db_exc.DBDuplicateEntry:
+                # Another port on the subnet bound the switch concurrently,
+                # Neutron retries the whole operation
+                LOG.debug("Binding of subnet %s on switches %s already "
+                          "exists", subnet_id, switch_ips)
+                raise
+
+    def _configure_physical_switch(self, port=None, vxlan_segment=None,
+                                   vlan_segment=None, session=None):
         # Check that both segments are valid
         if not self._is_valid_segment(vxlan_segment=vxlan_segment,
                                       vlan_segment=vlan_segment):
             return
+        session = session or lib_db_api.get_writer_session()
         network_id = port.get("network_id")
         subnet_detail = utils.get_subnet_detail_by_network_id(
-            network_id=network_id)
+            network_id=network_id, session=session)
         if not subnet_detail:
             return
         subnet_id = subnet_detail.get("subnet_id")
@@ -242,22 +253,36 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
         physical_network = vlan_segment.get(api.PHYSICAL_NETWORK)
         l2_vni = vxlan_segment.get(api.SEGMENTATION_ID)
         vlan_id = vlan_segment.get(api.SEGMENTATION_ID)
-        host_connections = self._get_port_connections(
-            port, port.get(portbindings.HOST_ID))
-
-        for switch_ip, host_connection in host_connections:
-            if host_connection.get("physnet") != physical_network:
-                continue
-            session = lib_db_api.get_reader_session()
-            vni_member_mappings = session.query(
-                aster_models_v2.AsterPortBinding).filter_by(
-                    switch_ip=switch_ip,
-                    is_config_l2=False,
-                    subnet_id=subnet_id).all()
+        host_connections = self._get_host_switches(
+            port, port.get(portbindings.HOST_ID), physical_network,
+            session=session)
+        if not host_connections:
+            return
 
-            # Determine if the configuration of L2-VNI needs to be configured
-            host_ports_mapping = host_connection.get("host_ports_mapping")
-            if vni_member_mappings and host_ports_mapping:
+        model = aster_models_v2.AsterPortBinding
+        with session.begin(subtransactions=True):
+            # Switches bound to the subnet and not configured yet
+            unconfigured_switch_ips = set(
+                switch_ip for switch_ip, in session.query(model.switch_ip).
+                filter(model.switch_ip.in_(
+                    [switch_ip for switch_ip, _ in host_connections]),
+                    model.is_config_l2 == sa.false(),
+                    model.subnet_id == subnet_id))
+
+        # The AFC is configured outside of the transaction, the bindings of
+        # the configured switches are updated at once afterwards, including
+        # when configuring a later switch fails
+        configured_switch_ips = []
+        conn_router_interface = None
+        try:
+            for switch_ip, host_connection in host_connections:
+                # Determine if the configuration of L2-VNI needs to be
+                # configured
+                host_ports_mapping = host_connection.get(
+                    "host_ports_mapping")
+                if (switch_ip not in unconfigured_switch_ips or
+                        not host_ports_mapping):
+                    continue
                 # Get the interface_names that the physical
                 # switch needs to be configured
                 interface_names = []
@@ -277,12 +302,14 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
                 self.afc_api.send_config_to_afc(config_params)
                 LOG.debug("Distribution configuration succeeded on "
                           "[%s] Aster Switch, config_params: \n %s \n",
-                          switch_ip, json.dumps(config_params, indent=3))
+                          switch_ip, log_utils.PrettyJson(config_params))
 
                 # Determines whether the subnet is connected to a VRouter
-                conn_router_interface = utils.\
-                    get_router_interface_by_subnet_id(self,
-                                                      subnet_id=subnet_id)
+                if conn_router_interface is None:
+                    conn_router_interface = utils.\
+                        get_router_interface_by_subnet_id(
+                            self, subnet_id=subnet_id)
+                    conn_router_interface = conn_router_interface or {}
                 if conn_router_interface:
                     # The corresponding VRF needs to be configured on
                     # this switch
@@ -293,42 +320,45 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
                     })
                     LOG.debug("Add the VRF configuration on the [%s],"
                               "params: \n %s \n",
-                              switch_ip, json.dumps(add_vrf_params, indent=3))
+                              switch_ip,
+                              log_utils.PrettyJson(add_vrf_params))
 
-                    # Add the VRF configuration on specified physical switch
+                    # Add the VRF configuration on specified physical
+                    # switch
                     # TODO config exception handing
                     add_interface_to_router(add_vrf_params=add_vrf_params)
-                    router_id = add_vrf_params.get("id")
-                    l3_vni = add_vrf_params.get("l3_vni")
-                    # Record the configuration of the L3-VNI on the specified
-                    # physical switch by switch_ip
-                    session, ctx_manager = utils.get_writer_session()
-                    with ctx_manager:
-                        session.query(aster_models_v2.AsterPortBinding).\
-                            filter_by(switch_ip=switch_ip,
-                                      is_config_l2=False,
-                                      subnet_id=subnet_id).\
-                            update({"router_id": router_id,
-                                    "l3_vni": l3_vni})
-                        session.flush()
-
-                # Record had config
-                session, ctx_manager = utils.get_writer_session()
-                with ctx_manager:
-                    session.query(
-                        aster_models_v2.AsterPortBinding).\
-                        filter_by(switch_ip=switch_ip,
-                                  is_config_l2=False,
-                                  subnet_id=subnet_id).\
-                        update({"is_config_l2": True})
-                    session.flush()
-
-    def _delete_physical_switch_config(self, port=None,
-                                       vxlan_segment=None, vlan_segment=None):
+                configured_switch_ips.append(switch_ip)
+        finally:
+            if configured_switch_ips:
+                self._record_switches_configured(
+                    session, subnet_id, configured_switch_ips,
+                    conn_router_interface)
+
+    @staticmethod
+    def _record_switches_configured(session, subnet_id, switch_ips,
+                                    router_interface):
+        # Record had config and the configuration of the L3-VNI on the
+        # configured physical switches
+        model = aster_models_v2.AsterPortBinding
+        values = {"is_config_l2": True}
+        if router_interface:
+            values.update({"router_id": router_interface.get("id"),
+                           "l3_vni": router_interface.get("l3_vni")})
+        with session.begin(subtransactions=True):
+            session.query(model).filter(
+                model.switch_ip.in_(switch_ips),
+                model.is_config_l2 == sa.false(),
+                model.subnet_id == subnet_id).update(
+                    values, synchronize_session=False)
+            session.flush()
+
+    def _delete_physical_switch_config(self, port=None, vxlan_segment=None,
+                                       vlan_segment=None, session=None):
         if vxlan_segment is None or vlan_segment is None:
             return
+        session = session or lib_db_api.get_writer_session()
         subnet_detail = utils.get_subnet_detail_by_network_id(
-            network_id=port.get("network_id")
+            network_id=port.get("network_id"), session=session
         )
         if not subnet_detail:
             return
@@ -339,87 +369,101 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
         vlan_id = vlan_segment.get(api.SEGMENTATION_ID)
         physical_network = vlan_segment.get(api.PHYSICAL_NETWORK)
         host_id = port.get(portbindings.HOST_ID)
-        host_connections = self._get_port_connections(port, host_id)
+        host_connections = self._get_host_switches(port, host_id,
+                                                   physical_network,
+                                                   session=session)
+        if not host_connections:
+            return
 
+        model = aster_models_v2.AsterPortBinding
+        with session.begin(subtransactions=True):
+            bound_switch_ips = set(
+                switch_ip for switch_ip, in session.query(model.switch_ip).
+                filter(model.switch_ip.in_(
+                    [switch_ip for switch_ip, _ in host_connections]),
+                    model.subnet_id == subnet_id))
+
+        # The AFC is configured outside of the transaction, the bindings of
+        # the unconfigured switches are deleted at once afterwards
+        unconfigured_switch_ips = []
+        conn_router_interface = None
         for switch_ip, host_connection in host_connections:
-            if host_connection.get("physnet") != physical_network:
-                continue
             host_ids = host_connection.get("host_ports_mapping").keys()
             # One cx switch can connect more server nodes
             # Get all ports for subnet on the specified hosts,
             # maybe have more host
             subnet_ports_on_host = utils.get_ports_by_subnet(
-                subnet_id=subnet_id, host_ids=host_ids
+                subnet_id=subnet_id, host_ids=host_ids, session=session
             )
             LOG.debug("Switch_ip: [%s] <--> host_ids: %s"
                       "subnet_ports_on_host number is [ %s ]",
                       switch_ip, host_ids, len(subnet_ports_on_host))
 
-            session = lib_db_api.get_reader_session()
-            vni_member_mappings = session.query(
-                aster_models_v2.AsterPortBinding).\
-                filter_by(switch_ip=switch_ip,
-                          subnet_id=subnet_id).all()
             host_ports_mapping = host_connection.get("host_ports_mapping")
-            if (not subnet_ports_on_host and
-                    vni_member_mappings and
-                    host_ports_mapping):
-                interface_names = []
-                list(interface_names.extend(switch_ports)
-                     for switch_ports in host_ports_mapping.values())
-                # Remove the VRF configuration
-                # Find VRouter L3-VNI by subnet_id if exist clean the VRF
+            if (subnet_ports_on_host or
+                    switch_ip not in bound_switch_ips or
+                    not host_ports_mapping):
+                continue
+            interface_names = []
+            list(interface_names.extend(switch_ports)
+                 for switch_ports in host_ports_mapping.values())
+            # Remove the VRF configuration
+            # Find VRouter L3-VNI by subnet_id if exist clean the VRF
+            if conn_router_interface is None:
                 conn_router_interface = utils.\
                     get_router_interface_by_subnet_id(self,
                                                       subnet_id=subnet_id)
-                if conn_router_interface:
-                    del_vrf_params = copy.deepcopy(conn_router_interface)
-                    del_vrf_params.update({
-                        "switch_ip": switch_ip,
-                        "vlan_id": vlan_id
-                    })
-                    try:
-                        # Clean the VRF configuration on
-                        # specified physical switch
-                        delete_interface_from_router(
-                            del_vrf_params=del_vrf_params)
-                        LOG.debug("Remove the VRF configuration on the [%s], "
-                                  "params: \n %s \n",
-                                  switch_ip, json.dumps(del_vrf_params,
-                                                        indent=3))
-                    except Exception as ex:
-                        LOG.error("Remove the VRF configuration on the [%s] "
-                                  "failed, params: \n %s \n, Exception = %s",
-                                  switch_ip,
-                                  json.dumps(del_vrf_params, indent=3), ex)
-
-                delete_params = {
+                conn_router_interface = conn_router_interface or {}
+            if conn_router_interface:
+                del_vrf_params = copy.deepcopy(conn_router_interface)
+                del_vrf_params.update({
                     "switch_ip": switch_ip,
-                    "project_id": port.get("project_id"),
-                    "network_id": port.get("network_id"),
-                    "vni": l2_vni,
-                    "vlan_id": vlan_id,
-                    "interfaces": interface_names,
-                    "gw_ip": l2_gw_ip
-                }
+                    "vlan_id": vlan_id
+                })
                 try:
-                    self.afc_api.delete_config_from_afc(delete_params)
-                    LOG.debug("Delete configuration succeeded on [%s] Aster"
-                              "Switch, config_params: \n %s \n",
-                              switch_ip, json.dumps(delete_params, indent=3))
+                    # Clean the VRF configuration on
+                    # specified physical switch
+                    delete_interface_from_router(
+                        del_vrf_params=del_vrf_params)
+                    LOG.debug("Remove the VRF configuration on the [%s], "
+                              "params: \n %s \n",
+                              switch_ip,
+                              log_utils.PrettyJson(del_vrf_params))
                 except Exception as ex:
-                    LOG.error("Delete configuration failed on [%s] Aster "
-                              "Switch, config_params: \n %s \n,"
-                              "Exception = %s", switch_ip,
-                              json.dumps(delete_params, indent=3), ex)
-
-                session = lib_db_api.get_writer_session()
-                session.query(
-                    aster_models_v2.AsterPortBinding
-                    ).filter_by(
-                        switch_ip=switch_ip, subnet_id=subnet_id
-                        ).delete()
-                session.flush()
+                    LOG.error("Remove the VRF configuration on the [%s] "
+                              "failed, params: \n %s \n, Exception = %s",
+                              switch_ip,
+                              log_utils.PrettyJson(del_vrf_params), ex)
+
+            delete_params = {
+                "switch_ip": switch_ip,
+                "project_id": port.get("project_id"),
+                "network_id": port.get("network_id"),
+                "vni": l2_vni,
+                "vlan_id": vlan_id,
+                "interfaces": interface_names,
+                "gw_ip": l2_gw_ip
+            }
+            try:
+                self.afc_api.delete_config_from_afc(delete_params)
+                LOG.debug("Delete configuration succeeded on [%s] Aster"
+                          "Switch, config_params: \n %s \n",
+                          switch_ip, log_utils.PrettyJson(delete_params))
+            except Exception as ex:
+                LOG.error("Delete configuration failed on [%s] Aster "
+                          "Switch, config_params: \n %s \n,"
+                          "Exception = %s", switch_ip,
+                          log_utils.PrettyJson(delete_params), ex)
+            unconfigured_switch_ips.append(switch_ip)
+
+        if not unconfigured_switch_ips:
+            return
+        with session.begin(subtransactions=True):
+            session.query(model).filter(
+                model.switch_ip.in_(unconfigured_switch_ips),
+                model.subnet_id == subnet_id).delete(
+                    synchronize_session=False)
+            session.flush()
 
     @lockutils.synchronized('aster-cx-port')
     def update_port_precommit(self, context):
@@ -440,7 +484,8 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
         elif self._is_supported_device_owner(context.current):
             self._configure_physical_switch_db(
                 port=context.current, vxlan_segment=vxlan_segment,
-                vlan_segment=vlan_segment
+                vlan_segment=vlan_segment,
+                session=utils.get_context_session(context)
             )
 
     @lockutils.synchronized('aster-cx-port')
@@ -463,7 +508,8 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
             self._delete_physical_switch_config(
                 port=context.original,
                 vxlan_segment=original_vxlan_segment,
-                vlan_segment=original_vlan_segment
+                vlan_segment=original_vlan_segment,
+                session=utils.get_context_session(context)
             )
         elif self._is_supported_device_owner(context.current):
             # Multiple physical switches are connected according to the
@@ -475,7 +521,8 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
             self._configure_physical_switch(
                 port=context.current,
                 vxlan_segment=vxlan_segment,
-                vlan_segment=vlan_segment
+                vlan_segment=vlan_segment,
+                session=utils.get_context_session(context)
             )
 
     @lockutils.synchronized('aster-cx-port')
@@ -501,7 +548,8 @@ class AsterCXSwitchMechanismDriver(api.MechanismDriver):
             self._delete_physical_switch_config(
                 port=context.current,
                 vxlan_segment=vxlan_segment,
-                vlan_segment=vlan_segment
+                vlan_segment=vlan_segment,
+                session=utils.get_context_session(context)
             )
 
     def bind_port(self, context):
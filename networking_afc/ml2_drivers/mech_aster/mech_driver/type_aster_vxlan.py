@@ -1,15 +1,26 @@
-import six
 # import netaddr
+import collections
+import weakref
 
-# import sqlalchemy as sa
+import sqlalchemy as sa
 from oslo_log import log
 from oslo_config import cfg
 # from oslo_utils import excutils
 
 from neutron._i18n import _
+from neutron_lib.api.definitions import multiprovidernet as mpnet_apidef
+from neutron_lib.api.definitions import provider_net as pnet
+from neutron_lib.api import validators
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
 from neutron_lib import constants as p_const
 from neutron_lib.plugins.ml2 import api
 from neutron.plugins.ml2.drivers import type_tunnel
+from networking_afc.common import range_set
+from networking_afc.db import free_ranges
+from networking_afc.db import pool_stats
+from networking_afc.db import pool_sync
 from networking_afc.db.models import aster_models_v2
 from neutron_lib import exceptions as exc
 from neutron_lib.db import api as lib_db_api
@@ -47,6 +58,9 @@ cfg.CONF.register_opts(aster_vxlan_opts, "ml2_type_aster_vxlan")
 
 TYPE_ASTER_VXLAN = "aster_vxlan"
 
+# Session info key of the bulk requests waiting for their transaction
+BULK_ALLOCATIONS = "aster_vxlan_bulk_allocations"
+
 
 class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
 
@@ -54,6 +68,16 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
         super(AsterCXVxlanTypeDriver, self).__init__(
             aster_models_v2.AsterVxlanAllocation
         )
+        model = aster_models_v2.AsterVxlanAllocation
+        self._pool = free_ranges.flag_pool(free_ranges.POOL_VXLAN, model,
+                                           model.vxlan_vni)
+        self.tunnel_ranges = []
+        self.pool_sync = None
+        self._tunnel_set = None
+        # Tenant networks announced by a request and the vnis allocated
+        # for them in advance, keyed by the request context
+        self._pending_networks = weakref.WeakKeyDictionary()
+        self._batches = weakref.WeakKeyDictionary()
 
     def get_type(self):
         return TYPE_ASTER_VXLAN
@@ -62,13 +86,23 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
         self.tunnel_ranges = []
         self.conf_mcast_ranges = cfg.CONF.ml2_type_aster_vxlan.mcast_ranges
         self._verify_vni_ranges()
-        self.sync_allocations()
+        self.pool_sync = pool_sync.start(
+            free_ranges.POOL_VXLAN,
+            (self.tunnel_ranges, cfg.CONF.aster_db.vni_pool_storage),
+            self.sync_allocations)
+        registry.subscribe(self._count_tenant_network, resources.NETWORK,
+                           events.BEFORE_CREATE)
+
+    def _wait_for_sync(self):
+        if self.pool_sync is not None:
+            self.pool_sync.wait()
 
     def _verify_vni_ranges(self):
         try:
             self.conf_vxlan_ranges = self._parse_afc_vni_ranges(
                 cfg.CONF.ml2_type_aster_vxlan.vni_ranges, self.tunnel_ranges)
             LOG.info("Aster CX Switch VNI ranges: %s", self.conf_vxlan_ranges)
+            self._tunnel_set = self.conf_vxlan_ranges
         except Exception:
             LOG.exception("Failed to parse vni_ranges. "
                           "Service terminated!")
@@ -89,8 +123,18 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
             self._parse_aster_vni_range(tunnel_range)
             current_range.append(tunnel_range)
 
+        vni_set = range_set.RangeSet(current_range)
+        if vni_set.overlapping:
+            LOG.warning("Aster VXLAN ID ranges %s overlap", current_range)
         LOG.info("Aster VXLAN ID ranges: %(range)s",
-                 {'range': current_range})
+                 {'range': vni_set})
+        return vni_set
+
+    def _vni_set(self):
+        # Follows the ranges when they are replaced
+        self._tunnel_set = range_set.get(self.tunnel_ranges,
+                                         self._tunnel_set)
+        return self._tunnel_set
 
     def _parse_aster_vni_range(self, tunnel_range):
         """Raise an exception for invalid tunnel range or malformed range."""
@@ -111,25 +155,163 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
         # 4096 - 2 ** 24 - 1
         return MIN_ASTER_VNI <= vni <= p_const.MAX_VXLAN_VNI
 
-    def allocate_tenant_segment(self, context):
-        alloc = self.allocate_partially_specified_segment(context)
-        if not alloc:
+    def allocate_partially_specified_segment(self, context, **filters):
+        self._wait_for_sync()
+        if filters:
+            alloc = super(AsterCXVxlanTypeDriver, self).\
+                allocate_partially_specified_segment(context, **filters)
+            if alloc:
+                pool_stats.adjust(context.session, free_ranges.POOL_VXLAN,
+                                  allocated=1)
+            return alloc
+        vxlan_vni = self._pool.allocate(context.session)
+        if vxlan_vni is None:
             return
+        return aster_models_v2.AsterVxlanAllocation(vxlan_vni=vxlan_vni,
+                                                    allocated=True)
+
+    def allocate_fully_specified_segment(self, context, **raw_segment):
+        self._wait_for_sync()
+        vxlan_vni = raw_segment.get("vxlan_vni")
+        if free_ranges.ranges_enabled() and vxlan_vni is not None:
+            model = aster_models_v2.AsterVxlanAllocation
+            if free_ranges.claim_free_id(context.session,
+                                         free_ranges.POOL_VXLAN,
+                                         model.vxlan_vni, vxlan_vni,
+                                         {"allocated": True}):
+                self._pool.remove(vxlan_vni)
+                pool_stats.adjust(context.session, free_ranges.POOL_VXLAN,
+                                  allocated=1)
+                return model(vxlan_vni=vxlan_vni, allocated=True)
+        # Allocated, outside of the pool or stored as rows
+        alloc = super(AsterCXVxlanTypeDriver, self).\
+            allocate_fully_specified_segment(context, **raw_segment)
+        if alloc:
+            self._pool.remove(alloc.vxlan_vni)
+            if alloc.vxlan_vni in self._vni_set():
+                pool_stats.adjust(context.session, free_ranges.POOL_VXLAN,
+                                  allocated=1)
+            else:
+                pool_stats.adjust(context.session, free_ranges.POOL_VXLAN,
+                                  outside=1)
+        return alloc
+
+    @staticmethod
+    def _segment(vxlan_vni):
         return {api.NETWORK_TYPE: TYPE_ASTER_VXLAN,
                 api.PHYSICAL_NETWORK: None,
-                api.SEGMENTATION_ID: alloc.vxlan_vni}
+                api.SEGMENTATION_ID: vxlan_vni}
+
+    def _count_tenant_network(self, resource, event, trigger, context=None,
+                              network=None, **kwargs):
+        # ML2 announces every network of a bulk request before creating
+        # them in a single transaction
+        if context is None or network is None:
+            return
+        if (validators.is_attr_set(network.get(pnet.NETWORK_TYPE)) or
+                validators.is_attr_set(network.get(mpnet_apidef.SEGMENTS))):
+            return
+        self._pending_networks[context] = (
+            self._pending_networks.get(context, 0) + 1)
+
+    def _allocate_batched(self, context):
+        # Allocate the vnis of all the tenant networks of a bulk request
+        # with the first one, the vnis left over are released before the
+        # transaction commits
+        pending = self._pending_networks.pop(context, 0)
+        batch = self._batches.get(context)
+        if batch:
+            return batch.popleft()
+        if pending < 2:
+            return None
+        self._wait_for_sync()
+        session = context.session
+        vnis = self._pool.allocate_many(session, pending)
+        if not vnis:
+            return None
+        batch = self._batches[context] = collections.deque(vnis[1:])
+        committed = []
+
+        def release_left_over(session):
+            if self._batches.get(context) is batch:
+                del self._batches[context]
+            left_over = list(batch)
+            batch.clear()
+            if left_over:
+                self._release_vnis(session, left_over)
+
+        def commit(session):
+            committed.append(True)
+
+        def forget(session):
+            sa.event.remove(session, "before_commit", release_left_over)
+            sa.event.remove(session, "after_commit", commit)
+            if self._batches.get(context) is batch:
+                del self._batches[context]
+            if not committed:
+                # The allocations were rolled back
+                for vni in vnis:
+                    self._pool.release(vni)
+
+        sa.event.listen(session, "before_commit", release_left_over)
+        sa.event.listen(session, "after_commit", commit)
+        session.info.setdefault(BULK_ALLOCATIONS, []).append(forget)
+        if not sa.event.contains(session, "after_transaction_end",
+                                 self._end_bulk_allocations):
+            sa.event.listen(session, "after_transaction_end",
+                            self._end_bulk_allocations)
+        LOG.debug("Allocated %(count)d vxlan vnis for a bulk request",
+                  {'count': len(vnis)})
+        return vnis[0]
+
+    @staticmethod
+    def _end_bulk_allocations(session, transaction):
+        # The listeners of a bulk request can't remove themselves while
+        # their event is dispatched, they are removed once the transaction
+        # is over, committed, rolled back or closed
+        if transaction.parent is not None:
+            return
+        for forget in session.info.pop(BULK_ALLOCATIONS, ()):
+            forget(session)
+
+    def allocate_tenant_segment(self, context):
+        vxlan_vni = self._allocate_batched(context)
+        if vxlan_vni is None:
+            alloc = self.allocate_partially_specified_segment(context)
+            if not alloc:
+                return
+            vxlan_vni = alloc.vxlan_vni
+        return self._segment(vxlan_vni)
+
+    def allocate_tenant_segments(self, context, count):
+        """Allocate ``count`` tenant segments together.
+
+        :returns: the segments, fewer than ``count`` when the pool is
+            exhausted
+        """
+        self._wait_for_sync()
+        return [self._segment(vxlan_vni) for vxlan_vni in
+                self._pool.allocate_many(context.session, count)]
 
     def sync_allocations(self):
         """
         Synchronize vxlan_allocations table with configured tunnel ranges.
         """
+        if free_ranges.ranges_enabled():
+            model = aster_models_v2.AsterVxlanAllocation
+            free_ranges.sync_pool(free_ranges.POOL_VXLAN, model.vxlan_vni,
+                                  sa.not_(model.allocated),
+                                  self.tunnel_ranges)
+            self._recount()
+            self._pool.invalidate()
+            return
+
         # determine current configured allocatable vnis
-        vxlan_vnis = set()
-        for tun_min, tun_max in self.tunnel_ranges:
-            vxlan_vnis |= set(six.moves.range(tun_min, tun_max + 1))
+        vxlan_vnis = self._vni_set()
 
         session = lib_db_api.get_writer_session()
         with session.begin(subtransactions=True):
+            free_ranges.clear_pool(session, free_ranges.POOL_VXLAN)
             # remove from table unallocated tunnels not currently allocatable
             # fetch results as list via all() because we'll be iterating
             # through them twice
@@ -152,7 +334,7 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
                     vxlan_vni.in_(vni_list)).delete(
                         synchronize_session=False)
             # collect vnis that need to be added
-            vnis = list(vxlan_vnis - existing_vnis)
+            vnis = [vni for vni in vxlan_vnis if vni not in existing_vnis]
             chunked_vnis = (vnis[i:i + bulk_size] for i in
                             range(0, len(vnis), bulk_size))
             for vni_list in chunked_vnis:
@@ -160,6 +342,18 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
                         for vni in vni_list]
                 session.execute(aster_models_v2.AsterVxlanAllocation.
                                 __table__.insert(), bulk)
+        self._recount()
+        # Rows were added or removed
+        self._pool.invalidate()
+
+    def _recount(self):
+        model = aster_models_v2.AsterVxlanAllocation
+        session = lib_db_api.get_writer_session()
+        with session.begin(subtransactions=True):
+            pool_stats.recount(
+                session, free_ranges.POOL_VXLAN, self.tunnel_ranges,
+                (vxlan_vni for vxlan_vni, in session.query(
+                    model.vxlan_vni).filter(model.allocated)))
 
     def reserve_provider_segment(self, context, segment):
         if self.is_partial_segment(segment):
@@ -178,29 +372,58 @@ class AsterCXVxlanTypeDriver(type_tunnel.ML2TunnelTypeDriver):
                 api.SEGMENTATION_ID: alloc.vxlan_vni}
 
     def release_segment(self, context, segment):
-        vxlan_vni = segment[api.SEGMENTATION_ID]
-
-        inside = any(lo <= vxlan_vni <= hi for lo, hi in self.tunnel_ranges)
-
-        session = context.session
+        self.release_segments(context, [segment])
+
+    def release_segments(self, context, segments):
+        """Release ``segments`` together."""
+        self._wait_for_sync()
+        self._release_vnis(context.session, [
+            segment[api.SEGMENTATION_ID] for segment in segments])
+
+    def _release_vnis(self, session, vxlan_vnis):
+        vni_set = self._vni_set()
+        inside = sorted(set(vni for vni in vxlan_vnis if vni in vni_set))
+        outside = sorted(set(vxlan_vnis) - set(inside))
+        model = aster_models_v2.AsterVxlanAllocation
+        released = []
+        removed = 0
         with session.begin(subtransactions=True):
-            query = (session.query(
-                aster_models_v2.AsterVxlanAllocation).
-                     filter_by(vxlan_vni=vxlan_vni))
             if inside:
-                count = query.update({"allocated": False})
-                if count:
-                    pass
-                    # session.delete(mcast_row)
-                    # LOG.debug("Releasing vxlan tunnel %s to pool",
-                    #           vxlan_vni)
-            else:
-                count = query.delete()
-                if count:
-                    LOG.debug("Releasing vxlan tunnel %s outside pool",
-                              vxlan_vni)
-        if not count:
-            LOG.warning("vxlan_vni %s not found", vxlan_vni)
+                query = session.query(model).filter(
+                    model.vxlan_vni.in_(inside))
+                if not free_ranges.ranges_enabled():
+                    # Only count a release of an allocated vni
+                    query = query.filter(model.allocated)
+                released = [vni for vni, in query.with_entities(
+                    model.vxlan_vni).order_by(
+                        model.vxlan_vni).with_for_update()]
+            if released and free_ranges.ranges_enabled():
+                session.query(model).filter(
+                    model.vxlan_vni.in_(released)).delete(
+                        synchronize_session=False)
+                free_ranges.add_free_ids(session, free_ranges.POOL_VXLAN,
+                                         released)
+            elif released:
+                session.query(model).filter(
+                    model.vxlan_vni.in_(released)).update(
+                        {"allocated": False}, synchronize_session=False)
+            if outside:
+                removed = session.query(model).filter(
+                    model.vxlan_vni.in_(outside)).delete(
+                        synchronize_session=False)
+                if removed:
+                    LOG.debug("Releasing vxlan tunnels %s outside pool",
+                              outside)
+            if released or removed:
+                pool_stats.adjust(session, free_ranges.POOL_VXLAN,
+                                  allocated=-len(released),
+                                  outside=-removed)
+        missing = len(inside) + len(outside) - len(released) - removed
+        if missing:
+            LOG.warning("%(missing)d of the vxlan_vnis %(vnis)s not found",
+                        {'missing': missing, 'vnis': inside + outside})
+        for vni in released:
+            self._pool.release(vni)
 
     def add_endpoint(self, ip, udp_port):
         pass
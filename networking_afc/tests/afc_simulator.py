@@ -0,0 +1,307 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""In-process stand-in for the Aster AFC REST API.
+
+Only the endpoints used by ``networking_afc.common.api.AfcRestClient`` are
+implemented: ``GET /devices`` and ``PUT /devices/<id>/neutron_*``. State is
+kept in memory per device so tests can assert on what the drivers pushed to
+the switches, and latency and error injection make it usable for load and
+retry testing.
+
+Run standalone with::
+
+    python -m networking_afc.tests.afc_simulator --port 9696 --devices 8
+"""
+
+import argparse
+import collections
+import json
+import random
+import re
+import threading
+import time
+import uuid
+
+import fixtures
+from oslo_config import cfg
+from six.moves import BaseHTTPServer
+from six.moves import socketserver
+from six.moves.urllib import parse as urlparse
+
+
+API_PREFIX = "/v2.0"
+
+_DEVICE_ACTION_RE = re.compile(
+    r"^%s/devices/(?P<device_id>[^/]+)/(?P<action>neutron_\w+)$" % API_PREFIX)
+
+
+class AfcDevice(object):
+    """Configuration state of one simulated switch."""
+
+    def __init__(self, device_id, ip_address, name):
+        self.id = device_id
+        self.ip_address = ip_address
+        self.name = name
+        # (vni, vlan_id) -> network config
+        self.networks = {}
+        # router_vni -> {vlan_id: router interface config}
+        self.vrfs = {}
+        self.lock = threading.Lock()
+
+    def to_dict(self):
+        return {"id": self.id,
+                "ip_address": self.ip_address,
+                "name": self.name}
+
+    def neutron_create_network(self, body):
+        key = (body.get("vni"), body.get("vlan_id"))
+        network = self.networks.setdefault(key, {
+            "interfaces": set(),
+            "network_id": body.get("network_id"),
+            "project_id": body.get("project_id"),
+        })
+        network["interfaces"].update(body.get("interfaces") or [])
+        network["gw_ip"] = body.get("gw_ip")
+
+    def neutron_delete_network(self, body):
+        self.networks.pop((body.get("vni"), body.get("vlan_id")), None)
+
+    def neutron_create_router(self, body):
+        vrf = self.vrfs.setdefault(body.get("router_vni"), {})
+        vrf[body.get("vlan_id")] = {
+            "gw_ip": body.get("gw_ip"),
+            "l2_vni": body.get("l2_vni"),
+            "if_ext_gw": body.get("if_ext_gw", False),
+        }
+
+    def neutron_delete_router(self, body):
+        router_vni = body.get("router_vni")
+        vrf = self.vrfs.get(router_vni)
+        if vrf is None:
+            return
+        vrf.pop(body.get("vlan_id"), None)
+        if not vrf:
+            # The last vlan interface left the vrf, the switch drops it
+            del self.vrfs[router_vni]
+
+    def apply(self, action, body):
+        handler = getattr(self, action, None)
+        with self.lock:
+            if handler is not None:
+                handler(body)
+
+
+class AfcSimulator(object):
+    """Threaded HTTP server emulating the AFC controller.
+
+    :param device_ips: management IPs of the simulated switches.
+    :param device_count: number of switches to generate when
+        ``device_ips`` is not given.
+    :param latency: seconds added to every request.
+    :param jitter: upper bound of a random delay added to ``latency``.
+    :param error_rate: probability in [0, 1] that a request fails with
+        ``error_status``.
+    :param error_status: HTTP status code of injected failures.
+    :param seed: seed of the random generator used for jitter and errors.
+    """
+
+    def __init__(self, host="127.0.0.1", port=0, device_ips=None,
+                 device_count=1, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=500, seed=None):
+        if device_ips is None:
+            device_ips = ["10.0.%d.%d" % (i // 250, i % 250 + 1)
+                          for i in range(device_count)]
+        self.devices = collections.OrderedDict()
+        for index, ip_address in enumerate(device_ips):
+            device = AfcDevice(str(uuid.uuid4()), ip_address,
+                               "leaf-%d" % index)
+            self.devices[device.id] = device
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.requests = collections.Counter()
+        self.failures = collections.Counter()
+        self._random = random.Random(seed)
+        self._random_lock = threading.Lock()
+        self._server = _ThreadingHTTPServer((host, port), _AfcRequestHandler)
+        self._server.simulator = self
+        self._thread = None
+
+    @property
+    def endpoint(self):
+        host, port = self._server.server_address[:2]
+        return "http://%s:%d" % (host, port)
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def get_device_by_ip(self, ip_address):
+        for device in self.devices.values():
+            if device.ip_address == ip_address:
+                return device
+
+    def _should_fail(self):
+        with self._random_lock:
+            delay = self.latency + self._random.uniform(0, self.jitter)
+            failed = self._random.random() < self.error_rate
+        if delay:
+            time.sleep(delay)
+        return failed
+
+    def handle(self, method, path, query, body):
+        """Dispatch one request, returning ``(status, response_body)``."""
+        if path == API_PREFIX + "/devices" and method == "GET":
+            endpoint = "list_devices"
+        else:
+            match = _DEVICE_ACTION_RE.match(path)
+            if not match or method != "PUT":
+                return 404, _error_body("NotFound",
+                                        "No route for %s %s" % (method, path))
+            endpoint = match.group("action")
+
+        self.requests[endpoint] += 1
+        if self._should_fail():
+            self.failures[endpoint] += 1
+            return self.error_status, _error_body(
+                "AfcSimulatedFailure",
+                "Injected failure for %s" % endpoint)
+
+        if endpoint == "list_devices":
+            ip_filter = query.get("ip_address")
+            devices = [device.to_dict() for device in self.devices.values()
+                       if not ip_filter or device.ip_address in ip_filter]
+            return 200, {"devices": devices}
+
+        device = self.devices.get(match.group("device_id"))
+        if device is None:
+            return 404, _error_body(
+                "DeviceNotFound",
+                "Device %s could not be found" % match.group("device_id"))
+        device.apply(endpoint, body or {})
+        return 200, {"result": "success", "device_id": device.id}
+
+
+def _error_body(error_type, message):
+    return {"NeutronError": {"type": error_type,
+                             "message": message,
+                             "detail": ""}}
+
+
+class _ThreadingHTTPServer(socketserver.ThreadingMixIn,
+                           BaseHTTPServer.HTTPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class _AfcRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def _dispatch(self, method):
+        parsed = urlparse.urlparse(self.path)
+        length = int(self.headers.get("Content-Length") or 0)
+        raw_body = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw_body.decode("utf-8")) if raw_body else None
+        except ValueError:
+            status, reply = 400, _error_body("BadRequest",
+                                             "Malformed JSON body")
+        else:
+            status, reply = self.server.simulator.handle(
+                method, parsed.path, urlparse.parse_qs(parsed.query), body)
+        payload = json.dumps(reply).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(payload)))
+        self.send_header("X-Openstack-Request-Id",
+                         "req-%s" % uuid.uuid4())
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def do_GET(self):
+        self._dispatch("GET")
+
+    def do_PUT(self):
+        self._dispatch("PUT")
+
+    def log_message(self, fmt, *args):
+        # Keep test and benchmark output clean
+        pass
+
+
+class AfcSimulatorFixture(fixtures.Fixture):
+    """Run an AfcSimulator and point ``[aster_authtoken]`` at it."""
+
+    def __init__(self, **simulator_kwargs):
+        super(AfcSimulatorFixture, self).__init__()
+        self.simulator_kwargs = simulator_kwargs
+        self.simulator = None
+
+    def _setUp(self):
+        self.simulator = AfcSimulator(**self.simulator_kwargs)
+        self.simulator.start()
+        self.addCleanup(self.simulator.stop)
+        cfg.CONF.set_override("auth_uri", self.simulator.endpoint,
+                              group="aster_authtoken")
+        cfg.CONF.set_override("is_send_afc", True, group="aster_authtoken")
+        self.addCleanup(cfg.CONF.clear_override, "auth_uri",
+                        group="aster_authtoken")
+        self.addCleanup(cfg.CONF.clear_override, "is_send_afc",
+                        group="aster_authtoken")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run a simulated Aster AFC controller.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9696)
+    parser.add_argument("--devices", type=int, default=1,
+                        help="Number of simulated switches.")
+    parser.add_argument("--device-ip", action="append", dest="device_ips",
+                        help="Management IP of a simulated switch, may be "
+                             "repeated. Overrides --devices.")
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--jitter", type=float, default=0.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--error-status", type=int, default=500)
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    simulator = AfcSimulator(
+        host=args.host, port=args.port, device_ips=args.device_ips,
+        device_count=args.devices, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=args.error_status,
+        seed=args.seed)
+    for device in simulator.devices.values():
+        print("%s %s" % (device.ip_address, device.id))
+    print("AFC simulator listening on %s" % simulator.endpoint)
+    try:
+        simulator._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        simulator._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,123 @@
+"""Cost of allocating L3 VNIs from the table versus the in-memory pool.
+
+Fills an in-memory SQLite database with 100k, then 1M L3 VNI allocations
+of which the lower half is already allocated, then allocates and releases
+VNIs:
+
+* ``table``: the former lowest free row ``SELECT ... ORDER BY`` followed
+  by an ``UPDATE``
+* ``pool``: ``PoolAllocator`` picking the ID in memory and claiming it
+  with a conditional ``UPDATE``
+
+The pool is loaded once before timing, as a running server would have.
+The time and tracemalloc peak of that load are reported too, so Python 3
+is required.
+
+    python -m networking_afc.tests.benchmark.bench_allocator
+"""
+
+import timeit
+import tracemalloc
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from six import moves
+
+from networking_afc.db import allocator
+from networking_afc.db.models import aster_models_v2
+
+
+ROWS = 100000
+LARGE_ROWS = 1 << 20
+ALLOCATIONS = 200
+
+_INSERT_BATCH = 100000
+
+
+def _create_session(rows=ROWS):
+    engine = sa.create_engine("sqlite://")
+    table = aster_models_v2.AsterL3VNIAllocation.__table__
+    table.create(engine)
+    aster_models_v2.AsterPoolCounter.__table__.create(engine)
+    for first in moves.range(0, rows, _INSERT_BATCH):
+        engine.execute(table.insert(), [
+            {"l3_vni": i,
+             "router_id": "router-%d" % i if i < rows // 2 else ""}
+            for i in moves.range(first, min(first + _INSERT_BATCH, rows))])
+    return orm.sessionmaker(bind=engine, autocommit=True)()
+
+
+def allocate_table(session, router_id):
+    model = aster_models_v2.AsterL3VNIAllocation
+    with session.begin(subtransactions=True):
+        alloc = session.query(model).filter_by(router_id="").order_by(
+            model.l3_vni).first()
+        session.query(model).filter_by(l3_vni=alloc.l3_vni).update(
+            {"router_id": router_id})
+        return alloc.l3_vni
+
+
+def allocate_pool(pool, session, router_id):
+    with session.begin(subtransactions=True):
+        return pool.allocate(session, router_id)
+
+
+def _release_all(session, pool=None):
+    model = aster_models_v2.AsterL3VNIAllocation
+    released = [vni for vni, in session.query(model.l3_vni).filter(
+        model.router_id.like("bench-%"))]
+    with session.begin(subtransactions=True):
+        session.query(model).filter(model.l3_vni.in_(released)).update(
+            {"router_id": ""}, synchronize_session=False)
+    if pool is not None:
+        for vni in released:
+            pool.release(vni)
+
+
+def _allocations(allocate):
+    for i in moves.range(ALLOCATIONS):
+        allocate("bench-%d" % i)
+
+
+def run(rows=ROWS, number=3):
+    session = _create_session(rows)
+    model = aster_models_v2.AsterL3VNIAllocation
+    pool = allocator.router_pool("bench", model, model.l3_vni)
+
+    load_msec = timeit.timeit(lambda: pool.reload(session), number=1) * 1e3
+    tracemalloc.start()
+    try:
+        pool.reload(session)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    results = {}
+    for variant, allocate, release in (
+            ("table", lambda r: allocate_table(session, r),
+             lambda: _release_all(session)),
+            ("pool", lambda r: allocate_pool(pool, session, r),
+             lambda: _release_all(session, pool))):
+        elapsed = 0
+        for _ in moves.range(number):
+            elapsed += timeit.timeit(lambda: _allocations(allocate),
+                                     number=1)
+            release()
+        results[variant] = elapsed / number / ALLOCATIONS * 1e3
+    return (results, load_msec, peak / 1024.0,
+            len(pool._free_ids.intervals()))
+
+
+def main():
+    for rows in (ROWS, LARGE_ROWS):
+        results, load_msec, peak, intervals = run(rows)
+        print("%d rows" % rows)
+        print("%-8s %12s" % ("variant", "ms/alloc"))
+        for variant, msec in sorted(results.items()):
+            print("%-8s %12.3f" % (variant, msec))
+        print("pool load %.1f ms, peak %.1f KiB, %d free intervals" %
+              (load_msec, peak, intervals))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+"""Cost of ORM instances versus column and EXISTS queries on big tables.
+
+Fills an in-memory SQLite database with 100k port bindings and 100k L3
+VNI allocations, then compares for each hot path the former ORM query
+with the column-only query now used:
+
+* ``exists``: ``.all()`` used as a truth test versus ``EXISTS``
+* ``sync``: loading every allocation as ORM instances, as
+  ``sync_allocations`` did, versus ``(l3_vni, router_id)`` tuples
+* ``hash``: hashing every binding with the former ``__repr__`` based
+  hash versus the column tuple hash
+
+Memory is the tracemalloc peak of one run, so Python 3 is required.
+
+    python -m networking_afc.tests.benchmark.bench_db_queries
+"""
+
+import timeit
+import tracemalloc
+
+import sqlalchemy as sa
+from sqlalchemy import orm
+from six import moves
+
+from networking_afc.db.models import aster_models_v2
+
+
+ROWS = 100000
+SWITCHES = 10
+
+
+def _create_session(rows=ROWS):
+    engine = sa.create_engine("sqlite://")
+    for model in (aster_models_v2.AsterPortBinding,
+                  aster_models_v2.AsterL3VNIAllocation):
+        model.__table__.create(engine)
+    engine.execute(aster_models_v2.AsterPortBinding.__table__.insert(), [
+        {"switch_ip": "10.0.0.%d" % (i % SWITCHES), "vlan_id": i % 4094,
+         "l2_vni": i, "subnet_id": "subnet-%d" % i,
+         "router_id": "router-%d" % (i % 1000), "l3_vni": 0}
+        for i in moves.range(rows)])
+    engine.execute(aster_models_v2.AsterL3VNIAllocation.__table__.insert(), [
+        {"l3_vni": i, "router_id": "router-%d" % i if i % 2 else ""}
+        for i in moves.range(rows)])
+    return orm.sessionmaker(bind=engine)()
+
+
+def exists_orm(session):
+    return bool(session.query(aster_models_v2.AsterPortBinding).
+                filter_by(switch_ip="10.0.0.1").all())
+
+
+def exists_column(session):
+    return session.query(
+        session.query(aster_models_v2.AsterPortBinding).
+        filter_by(switch_ip="10.0.0.1").exists()).scalar()
+
+
+def sync_orm(session):
+    return session.query(aster_models_v2.AsterL3VNIAllocation).all()
+
+
+def sync_column(session):
+    model = aster_models_v2.AsterL3VNIAllocation
+    return session.query(model.l3_vni, model.router_id).all()
+
+
+def hash_repr(bindings):
+    # The former __hash__
+    return [hash(binding.__repr__()) for binding in bindings]
+
+
+def hash_column(bindings):
+    return [hash(binding) for binding in bindings]
+
+
+def _measure(func, number):
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    elapsed = timeit.timeit(func, number=number) / number
+    return elapsed * 1e3, peak / 1024.0
+
+
+def run(rows=ROWS, number=3):
+    session = _create_session(rows)
+    results = {}
+    for case, variant, func in (
+            ("exists", "orm", lambda: exists_orm(session)),
+            ("exists", "column", lambda: exists_column(session)),
+            ("sync", "orm", lambda: sync_orm(session)),
+            ("sync", "column", lambda: sync_column(session))):
+        # Do not let the identity map of the previous run skew the next
+        session.expunge_all()
+        results[(case, variant)] = _measure(func, number)
+
+    bindings = session.query(aster_models_v2.AsterPortBinding).all()
+    results[("hash", "repr")] = _measure(lambda: hash_repr(bindings),
+                                         number)
+    results[("hash", "column")] = _measure(lambda: hash_column(bindings),
+                                           number)
+    return results
+
+
+def main():
+    results = run()
+    print("%-8s %-8s %12s %12s" % ("case", "query", "ms/run", "peak KiB"))
+    for (case, variant), (msec, peak) in sorted(results.items()):
+        print("%-8s %-8s %12.1f %12.1f" % (case, variant, msec, peak))
+
+
+if __name__ == "__main__":
+    main()
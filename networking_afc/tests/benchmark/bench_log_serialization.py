@@ -0,0 +1,127 @@
+"""Per port-update cost of debug logging request params and router dicts.
+
+Replays the log calls made by ``_configure_physical_switch`` for one port
+update, once with eager ``json.dumps`` arguments and once with
+``PrettyJson``, with the logger at DEBUG and at INFO.
+
+    python -m networking_afc.tests.benchmark.bench_log_serialization
+"""
+
+import json
+import logging
+import timeit
+
+from six import moves
+
+from networking_afc.common import log_utils
+
+
+LOG = logging.getLogger("networking_afc.benchmark.log_serialization")
+
+
+def _router_payload(interfaces=20):
+    # Shaped like the router interface dicts returned by
+    # utils.get_router_interface_by_subnet_id
+    return {
+        "id": "0b7ed3c4-7e5f-4e31-9a4d-8d4c1fe2a4a1",
+        "name": "bench-router",
+        "tenant_id": "6f3c1f1c4f3b4c7e8a4b2d3e1f0a9b8c",
+        "status": "ACTIVE",
+        "admin_state_up": True,
+        "l3_vni": 10000,
+        "seg_id": 10008,
+        "cidr": "10.10.10.0/24",
+        "gip": "10.10.10.1",
+        "fixed_ip": "10.10.10.1",
+        "ip_version": 4,
+        "subnet_id": "d9e7c5e6-1b5e-4f0a-8f3b-2f0c1d2e3f4a",
+        "external_gateway_info": {
+            "network_id": "5a0c7d6e-2c1b-4a3f-9e8d-7c6b5a4f3e2d",
+            "enable_snat": True,
+            "external_fixed_ips": [
+                {"subnet_id": "e1d2c3b4-a596-4788-99aa-bbccddeeff00",
+                 "ip_address": "172.24.4.%d" % i}
+                for i in moves.range(2)]
+        },
+        "routes": [{"destination": "192.168.%d.0/24" % i,
+                    "nexthop": "10.10.10.%d" % (i + 2)}
+                   for i in moves.range(interfaces)],
+    }
+
+
+def _config_params():
+    return {
+        "switch_ip": "192.168.4.105",
+        "project_id": "6f3c1f1c4f3b4c7e8a4b2d3e1f0a9b8c",
+        "network_id": "5a0c7d6e-2c1b-4a3f-9e8d-7c6b5a4f3e2d",
+        "vni": 10008,
+        "vlan_id": 105,
+        "interfaces": ["X%d" % i for i in moves.range(48)],
+        "gw_ip": "10.10.10.1/24"
+    }
+
+
+def port_update_eager(config_params, add_vrf_params):
+    LOG.debug("Neutron create_network config_params is: \n %s \n ",
+              json.dumps(config_params, indent=3))
+    LOG.debug("Distribution configuration succeeded on "
+              "[%s] Aster Switch, config_params: \n %s \n",
+              "192.168.4.105", json.dumps(config_params, indent=3))
+    LOG.debug("Add the VRF configuration on the [%s],"
+              "params: \n %s \n",
+              "192.168.4.105", json.dumps(add_vrf_params, indent=3))
+    LOG.debug("Neutron create_router config_params is: \n %s \n ",
+              json.dumps(add_vrf_params, indent=3))
+
+
+def port_update_lazy(config_params, add_vrf_params):
+    LOG.debug("Neutron create_network config_params is: \n %s \n ",
+              log_utils.PrettyJson(config_params))
+    LOG.debug("Distribution configuration succeeded on "
+              "[%s] Aster Switch, config_params: \n %s \n",
+              "192.168.4.105", log_utils.PrettyJson(config_params))
+    LOG.debug("Add the VRF configuration on the [%s],"
+              "params: \n %s \n",
+              "192.168.4.105", log_utils.PrettyJson(add_vrf_params))
+    LOG.debug("Neutron create_router config_params is: \n %s \n ",
+              log_utils.PrettyJson(add_vrf_params))
+
+
+class _FormattingHandler(logging.Handler):
+    """Format every record like a real handler would, then drop it."""
+
+    def emit(self, record):
+        self.format(record)
+
+
+def run(number=2000):
+    handler = _FormattingHandler()
+    LOG.addHandler(handler)
+    LOG.propagate = False
+    config_params = _config_params()
+    add_vrf_params = _router_payload()
+    results = {}
+    try:
+        for level in (logging.DEBUG, logging.INFO):
+            LOG.setLevel(level)
+            for name, func in (("eager", port_update_eager),
+                               ("lazy", port_update_lazy)):
+                elapsed = timeit.timeit(
+                    lambda: func(config_params, add_vrf_params),
+                    number=number)
+                results[(logging.getLevelName(level), name)] = (
+                    elapsed / number * 1e6)
+    finally:
+        LOG.removeHandler(handler)
+    return results
+
+
+def main():
+    results = run()
+    print("%-8s %-8s %14s" % ("level", "args", "us/port-update"))
+    for (level, name), usec in sorted(results.items()):
+        print("%-8s %-8s %14.1f" % (level, name, usec))
+
+
+if __name__ == "__main__":
+    main()
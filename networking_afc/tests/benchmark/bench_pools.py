@@ -0,0 +1,242 @@
+"""Scenarios of the allocation pool benchmarks.
+
+Each scenario runs the allocation managers against a fresh SQLite
+database, in memory or in a file:
+
+* ``sync_cold``: ``L2VniManager.sync_allocations`` filling an empty table
+  from ``size`` configured VNIs
+* ``sync_warm``: the same synchronization again once the table is in sync
+  and a tenth of the VNIs, at most ``WARM_ALLOCATED``, allocated, as at a
+  server restart
+* ``alloc_seq``: ``L3VniManager.allocation_l3_vni`` then ``release_l3_vni``
+  of ``ROUTERS`` routers one after another, from a pool of ``size`` VNIs
+* ``alloc_concurrent``: the same split across ``THREADS`` threads, file
+  databases only since an in-memory database has a single connection
+* ``border_sync_cold`` and ``border_sync_warm``: the border VLAN
+  synchronization of ``size`` border leaves with VLANs 2 to 4094 each
+
+The sync and allocation scenarios run for both ``vni_pool_storage``
+modes. The L2 pool is used for the synchronization because the L3 one
+also releases the VNIs of routers missing from the neutron ``routers``
+table, which would make the warm run release the allocations of the
+cold one.
+
+A scenario is a ``setup(db, size, storage)`` function doing the untimed
+preparation and returning the function to time. See ``run`` for the
+runner, baselines and regression checks.
+"""
+
+import os
+import shutil
+import tempfile
+import threading
+
+import mock
+from neutron.db.migration.models import head  # noqa
+from neutron_lib.db import api as lib_db_api
+from neutron_lib.db import model_base
+from oslo_config import cfg
+import sqlalchemy as sa
+from sqlalchemy import orm
+from sqlalchemy import pool as sa_pool
+
+from networking_afc.common import utils
+from networking_afc.db import free_ranges
+from networking_afc.db import pool_sync
+from networking_afc.db import replica
+from networking_afc.l3_router import border_vlan_manager
+from networking_afc.l3_router import l2_vni_manager
+from networking_afc.l3_router import l3_vni_manager
+
+
+MEMORY = "memory"
+FILE = "file"
+
+SIZES = (1000, 100000, 1000000)
+LEAVES = (4, 32)
+ROUTERS = 200
+WARM_ALLOCATED = 2000
+THREADS = 8
+
+# First VLAN of the border leaves, 1 is the default VLAN
+BORDER_VLANS = "2:4094"
+
+
+class Database(object):
+    """SQLite database the allocation code runs against while patched.
+
+    Counts the statements executed on it.
+    """
+
+    def __init__(self, kind=MEMORY):
+        self.kind = kind
+        self._dir = None
+        if kind == FILE:
+            self._dir = tempfile.mkdtemp(prefix="afc-bench-")
+            self.engine = sa.create_engine(
+                "sqlite:///%s" % os.path.join(self._dir, "bench.db"),
+                connect_args={"timeout": 60})
+        else:
+            self.engine = sa.create_engine(
+                "sqlite://", poolclass=sa_pool.StaticPool,
+                connect_args={"check_same_thread": False})
+        model_base.BASEV2.metadata.create_all(self.engine)
+        self._sessionmaker = orm.sessionmaker(bind=self.engine,
+                                              autocommit=True)
+        self.queries = 0
+        sa.event.listen(self.engine, "after_cursor_execute", self._count)
+        self._patchers = [
+            mock.patch.object(lib_db_api, "get_writer_session",
+                              self.session),
+            mock.patch.object(lib_db_api, "get_reader_session",
+                              self.session),
+            mock.patch.object(replica, "get_reader_session", self.session),
+        ]
+
+    def _count(self, *args):
+        self.queries += 1
+
+    def session(self):
+        return self._sessionmaker()
+
+    def __enter__(self):
+        for patcher in self._patchers:
+            patcher.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        for patcher in reversed(self._patchers):
+            patcher.stop()
+        self.engine.dispose()
+        if self._dir:
+            shutil.rmtree(self._dir, ignore_errors=True)
+
+
+def _configure(storage, group, name, value):
+    cfg.CONF.set_override("vni_pool_storage", storage, group="aster_db")
+    cfg.CONF.set_override(name, value, group=group)
+
+
+def _manager(manager_class):
+    # The synchronization is timed on its own, not started in background
+    with mock.patch.object(pool_sync, "start"):
+        return manager_class()
+
+
+def _l2_manager(size, storage):
+    _configure(storage, "ml2_type_aster_vxlan", "l2_vni_ranges",
+               ["1:%d" % size])
+    return _manager(l2_vni_manager.L2VniManager)
+
+
+def sync_cold(db, size, storage):
+    return _l2_manager(size, storage).sync_allocations
+
+
+def sync_warm(db, size, storage):
+    manager = _l2_manager(size, storage)
+    manager.sync_allocations()
+    for i in range(min(size // 10, WARM_ALLOCATED)):
+        manager.allocation_l2_vni("router-%d" % i)
+    return manager.sync_allocations
+
+
+def _l3_manager(size, storage):
+    _configure(storage, "ml2_type_aster_vxlan", "l3_vni_ranges",
+               ["1:%d" % size])
+    manager = _manager(l3_vni_manager.L3VniManager)
+    manager.sync_allocations()
+    # Load the in-memory pool as a running server would have
+    manager.allocation_l3_vni("bench-warmup")
+    manager.release_l3_vni("bench-warmup")
+    return manager
+
+
+def _allocate_release(manager, router_ids):
+    for router_id in router_ids:
+        manager.allocation_l3_vni(router_id)
+    for router_id in router_ids:
+        manager.release_l3_vni(router_id)
+
+
+def alloc_seq(db, size, storage):
+    manager = _l3_manager(size, storage)
+    router_ids = ["router-%d" % i for i in range(ROUTERS)]
+    return lambda: _allocate_release(manager, router_ids)
+
+
+def alloc_concurrent(db, size, storage):
+    manager = _l3_manager(size, storage)
+
+    def run():
+        errors = []
+
+        def worker(index):
+            try:
+                _allocate_release(manager, [
+                    "router-%d-%d" % (index, i)
+                    for i in range(ROUTERS // THREADS)])
+            except Exception as exc:
+                errors.append(exc)
+
+        threads = [threading.Thread(target=worker, args=(index,))
+                   for index in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+    return run
+
+
+def _border_manager(leaves):
+    cfg.CONF.set_override(
+        "border_switches",
+        dict(("10.0.%d.%d" % (i // 256, i % 256),
+              {"vlan_ranges": [BORDER_VLANS]}) for i in range(leaves)),
+        group="ml2_aster")
+    return _manager(border_vlan_manager.BorderVlanManager)
+
+
+def border_sync_cold(db, leaves, storage=None):
+    return _border_manager(leaves)._sync_vlan_allocations
+
+
+def border_sync_warm(db, leaves, storage=None):
+    manager = _border_manager(leaves)
+    manager._sync_vlan_allocations()
+    for switch_ip in manager.border_leaf_vlan_ranges:
+        for i in range(100):
+            manager.allocate_segment(switch_ip, "router-%d" % i)
+    return manager._sync_vlan_allocations
+
+
+def scenarios(sizes=SIZES, leaves=LEAVES, databases=(MEMORY, FILE)):
+    """Yield ``(name, database, setup, size, storage)`` of every run."""
+    storages = (free_ranges.ROWS, free_ranges.RANGES)
+    for kind in databases:
+        for setup in (sync_cold, sync_warm, alloc_seq, alloc_concurrent):
+            if setup is alloc_concurrent and kind == MEMORY:
+                continue
+            for storage in storages:
+                for size in sizes:
+                    if setup in (alloc_seq, alloc_concurrent) and \
+                            size < ROUTERS + 1:
+                        continue
+                    yield ("%s.%s.%d.%s" % (setup.__name__, storage, size,
+                                            kind), kind, setup, size,
+                           storage)
+        for setup in (border_sync_cold, border_sync_warm):
+            for count in leaves:
+                yield ("%s.%d.%s" % (setup.__name__, count, kind), kind,
+                       setup, count, None)
+
+
+def reset():
+    """Forget the state left by a scenario."""
+    cfg.CONF.clear_override("vni_pool_storage", group="aster_db")
+    cfg.CONF.clear_override("l2_vni_ranges", group="ml2_type_aster_vxlan")
+    cfg.CONF.clear_override("l3_vni_ranges", group="ml2_type_aster_vxlan")
+    cfg.CONF.clear_override("border_switches", group="ml2_aster")
+    utils.invalidate_allocation_memo()
@@ -0,0 +1,192 @@
+"""Run the allocation pool benchmarks and check them against baselines.
+
+    python -m networking_afc.tests.benchmark.run [--sizes 1000,100000] \
+        [--leaves 4,32] [--databases memory,file] [--only alloc_] \
+        [--threshold 0.2] [--time-threshold 1.0] [--update-baselines]
+
+or ``tox -e bench``. See ``bench_pools`` for the scenarios. For each one
+the runner reports:
+
+* ``wall_ms``: wall time of the timed function;
+* ``queries``: statements executed on the database;
+* ``peak_kib``: tracemalloc peak of the timed function, measured in a
+  second run since tracing slows Python down.
+
+Results are compared with ``baselines.json`` next to this module. A
+scenario regresses when its queries or peak memory grow by more than
+``--threshold`` (20%) or its wall time by more than ``--time-threshold``
+(100%, wall time depends on the machine), and by more than a small
+absolute ``SLACK``. The command exits with status 1
+on a regression. Record new baselines with ``--update-baselines`` when a
+change is expected, and commit them with the change so the evidence is
+reviewed with it. 1M VNI pools are measured with ``--sizes 1000000``.
+"""
+
+import argparse
+import fnmatch
+import gc
+import json
+import os
+import platform
+import sqlite3
+import sys
+import timeit
+import tracemalloc
+
+import sqlalchemy as sa
+
+from networking_afc.db import free_ranges
+from networking_afc.tests.benchmark import bench_pools
+
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                         "baselines.json")
+
+DEFAULT_SIZES = (1000, 100000)
+
+METRICS = ("wall_ms", "queries", "peak_kib")
+
+# Growth below these is noise, whatever the threshold
+SLACK = {"wall_ms": 50, "queries": 0, "peak_kib": 64}
+
+
+def measure(kind, setup, size, storage):
+    """Run a scenario twice, timed then traced.
+
+    :returns: ``{'wall_ms', 'queries', 'peak_kib'}``
+    """
+    result = {}
+    try:
+        with bench_pools.Database(kind) as db:
+            func = setup(db, size, storage)
+            gc.collect()
+            db.queries = 0
+            start = timeit.default_timer()
+            func()
+            result['wall_ms'] = round(
+                (timeit.default_timer() - start) * 1e3, 1)
+            result['queries'] = db.queries
+        bench_pools.reset()
+
+        with bench_pools.Database(kind) as db:
+            func = setup(db, size, storage)
+            gc.collect()
+            tracemalloc.start()
+            try:
+                func()
+                _, peak = tracemalloc.get_traced_memory()
+            finally:
+                tracemalloc.stop()
+            result['peak_kib'] = round(peak / 1024.0, 1)
+    finally:
+        bench_pools.reset()
+    return result
+
+
+def warm_up():
+    """Load the modules and caches the first scenario would pay for."""
+    measure(bench_pools.MEMORY, bench_pools.sync_cold, 100,
+            free_ranges.ROWS)
+
+
+def compare(name, result, baseline, threshold, time_threshold):
+    """Return the regressions of ``result`` over ``baseline``."""
+    regressions = []
+    for metric in METRICS:
+        if metric not in baseline:
+            continue
+        allowed = time_threshold if metric == 'wall_ms' else threshold
+        limit = max(baseline[metric] * (1 + allowed),
+                    baseline[metric] + SLACK[metric])
+        if result[metric] > limit:
+            regressions.append(
+                "%s: %s %s > %s (baseline %s)" % (
+                    name, metric, result[metric], round(limit, 1),
+                    baseline[metric]))
+    return regressions
+
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as baselines_file:
+        return json.load(baselines_file).get("scenarios", {})
+
+
+def save_baselines(results, path=BASELINES):
+    scenarios = load_baselines(path)
+    scenarios.update(results)
+    with open(path, "w") as baselines_file:
+        json.dump({"environment": {
+                       "python": platform.python_version(),
+                       "sqlalchemy": sa.__version__,
+                       "sqlite": sqlite3.sqlite_version},
+                   "scenarios": scenarios},
+                  baselines_file, indent=2, sort_keys=True)
+        baselines_file.write("\n")
+
+
+def _ints(value):
+    return tuple(int(item) for item in value.split(",") if item)
+
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(
+        description="Benchmark the VNI and VLAN allocation pools.")
+    parser.add_argument("--sizes", type=_ints, default=DEFAULT_SIZES,
+                        help="Pool sizes, comma separated.")
+    parser.add_argument("--leaves", type=_ints,
+                        default=bench_pools.LEAVES,
+                        help="Border leaf counts, comma separated.")
+    parser.add_argument("--databases", default="memory,file",
+                        help="SQLite databases, memory and/or file.")
+    parser.add_argument("--only", default="*",
+                        help="Run the scenarios matching this pattern.")
+    parser.add_argument("--threshold", type=float, default=0.2,
+                        help="Allowed growth of queries and peak memory.")
+    parser.add_argument("--time-threshold", type=float, default=1.0,
+                        help="Allowed growth of wall time.")
+    parser.add_argument("--update-baselines", action="store_true",
+                        help="Store the results as the new baselines.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    baselines = load_baselines()
+    pattern = args.only if any(c in args.only for c in "*?[") else \
+        "*%s*" % args.only
+    results = {}
+    regressions = []
+    warm_up()
+    print("%-44s %10s %8s %10s  %s" % ("scenario", "wall ms", "queries",
+                                       "peak KiB", "baseline"))
+    for name, kind, setup, size, storage in bench_pools.scenarios(
+            sizes=args.sizes, leaves=args.leaves,
+            databases=args.databases.split(",")):
+        if not fnmatch.fnmatch(name, pattern):
+            continue
+        result = measure(kind, setup, size, storage)
+        results[name] = result
+        baseline = baselines.get(name)
+        found = compare(name, result, baseline or {}, args.threshold,
+                        args.time_threshold)
+        regressions.extend(found)
+        status = "new" if baseline is None else (
+            "REGRESSED" if found else "ok")
+        print("%-44s %10.1f %8d %10.1f  %s" % (
+            name, result['wall_ms'], result['queries'],
+            result['peak_kib'], status))
+        sys.stdout.flush()
+
+    if args.update_baselines:
+        save_baselines(results)
+        print("Stored %d baselines in %s" % (len(results), BASELINES))
+        return 0
+    for regression in regressions:
+        print("REGRESSION %s" % regression)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
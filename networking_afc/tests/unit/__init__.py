@@ -0,0 +1,5 @@
+from neutron.common import eventlet_utils
+
+
+# As neutron.tests.unit, before any test module imports threading or socket
+eventlet_utils.monkey_patch()
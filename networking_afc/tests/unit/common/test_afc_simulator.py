@@ -0,0 +1,66 @@
+from neutron.tests import base
+
+from networking_afc.common import api as afc_api
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
+from networking_afc.tests import afc_simulator
+
+
+SWITCH_IP = "192.168.4.105"
+
+
+class AfcSimulatorTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(AfcSimulatorTestCase, self).setUp()
+        self.afc = self.useFixture(afc_simulator.AfcSimulatorFixture(
+            device_ips=[SWITCH_IP, "192.168.4.106"])).simulator
+        self.client = afc_api.AfcRestClient()
+        self.device = self.afc.get_device_by_ip(SWITCH_IP)
+
+    def _network_params(self):
+        return {
+            "switch_ip": SWITCH_IP,
+            "project_id": "fake_project",
+            "network_id": "fake_network",
+            "vni": 10008,
+            "vlan_id": 105,
+            "interfaces": ["X37"],
+            "gw_ip": "10.10.10.1/24"
+        }
+
+    def _router_params(self):
+        return {
+            "switch_ip": SWITCH_IP,
+            "router_vni": 10000,
+            "l2_vni": 10008,
+            "vlan_id": 105,
+            "gw_ip": "10.10.10.1/24"
+        }
+
+    def test_create_and_delete_network(self):
+        self.client.send_config_to_afc(self._network_params())
+        self.assertIn((10008, 105), self.device.networks)
+        self.client.delete_config_from_afc(self._network_params())
+        self.assertEqual({}, self.device.networks)
+        self.assertEqual(2, self.afc.requests["list_devices"])
+
+    def test_create_and_delete_router(self):
+        self.client.create_or_update_vrf_on_physical_switch(
+            self._router_params())
+        self.assertIn(105, self.device.vrfs[10000])
+        self.client.delete_or_update_vrf_on_physical_switch(
+            self._router_params())
+        self.assertEqual({}, self.device.vrfs)
+
+    def test_unknown_switch(self):
+        params = self._network_params()
+        params["switch_ip"] = "10.255.255.1"
+        self.assertRaises(ex.NoFoundPhysicalSwitch,
+                          self.client.send_config_to_afc, params)
+
+    def test_injected_failure(self):
+        self.afc.error_rate = 1.0
+        self.assertRaises(Exception,
+                          self.client.send_config_to_afc,
+                          self._network_params())
+        self.assertEqual(1, self.afc.failures["list_devices"])
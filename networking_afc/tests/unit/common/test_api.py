@@ -0,0 +1,52 @@
+import mock
+from neutron.tests import base
+from oslo_config import cfg
+
+from networking_afc.common import api
+from networking_afc.common import metrics
+from networking_afc.common.neutronclient.v2_0 import client
+
+
+class CallAfcTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(CallAfcTestCase, self).setUp()
+        self.sleep = mock.patch.object(api.time, "sleep").start()
+
+    def test_retries_back_off(self):
+        cfg.CONF.set_override("request_retries", 7, group="aster_afc")
+        func = mock.Mock(side_effect=[client.exceptions.ConnectionFailed(
+            reason="down")] * 7 + ["result"])
+        self.assertEqual("result", api.AfcRestClient._call_afc(
+            "list_devices", "10.0.0.1", func))
+        self.assertEqual([0.5, 1, 2, 4, 8, 16, 30],
+                         [call[0][0] for call in self.sleep.call_args_list])
+
+    def test_retries_exhausted(self):
+        cfg.CONF.set_override("request_retries", 1, group="aster_afc")
+        func = mock.Mock(side_effect=client.exceptions.ConnectionFailed(
+            reason="down"))
+        self.assertRaises(client.exceptions.ConnectionFailed,
+                          api.AfcRestClient._call_afc,
+                          "list_devices", "10.0.0.1", func)
+        self.assertEqual(2, func.call_count)
+        self.assertEqual(1, self.sleep.call_count)
+
+    def _bytes_sent(self):
+        return metrics.AFC_BYTES_SENT.value("create_network", "10.0.0.1")
+
+    def test_bytes_sent_not_counted_without_exporter(self):
+        sent = self._bytes_sent()
+        with mock.patch.object(api.json, "dumps") as dumps:
+            api.AfcRestClient._call_afc("create_network", "10.0.0.1",
+                                        mock.Mock(), body={"vni": 10})
+        dumps.assert_not_called()
+        self.assertEqual(sent, self._bytes_sent())
+
+    def test_bytes_sent(self):
+        cfg.CONF.set_override("metrics_file", "/tmp/afc.prom",
+                              group="aster_afc")
+        sent = self._bytes_sent()
+        api.AfcRestClient._call_afc("create_network", "10.0.0.1",
+                                    mock.Mock(), body={"vni": 10})
+        self.assertEqual(sent + len('{"vni": 10}'), self._bytes_sent())
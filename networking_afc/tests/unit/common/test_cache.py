@@ -0,0 +1,63 @@
+from neutron.tests import base
+
+from networking_afc.common import cache
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class LRUCacheTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(LRUCacheTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.cache = cache.LRUCache(2, ttl=10, clock=self.clock)
+
+    def test_get_counts_hits_and_misses(self):
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.put("a", None)
+        self.assertIsNone(self.cache.get("a", "default"))
+        self.assertEqual(1, self.cache.hits)
+        self.assertEqual(1, self.cache.misses)
+        self.assertEqual(0.5, self.cache.hit_rate)
+
+    def test_least_recently_used_is_evicted(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.get("a")
+        self.cache.put("c", 3)
+        self.assertEqual(2, len(self.cache))
+        self.assertEqual(1, self.cache.get("a"))
+        self.assertIsNone(self.cache.get("b"))
+
+    def test_entries_expire(self):
+        self.cache.put("a", 1)
+        self.clock.now += 9
+        self.assertEqual(1, self.cache.get("a"))
+        self.clock.now += 1
+        self.assertIsNone(self.cache.get("a"))
+        self.assertEqual(0, len(self.cache))
+
+    def test_no_ttl_and_no_size(self):
+        no_ttl = cache.LRUCache(1, clock=self.clock)
+        no_ttl.put("a", 1)
+        self.clock.now += 10 ** 6
+        self.assertEqual(1, no_ttl.get("a"))
+        disabled = cache.LRUCache(0)
+        disabled.put("a", 1)
+        self.assertIsNone(disabled.get("a"))
+
+    def test_invalidate(self):
+        self.cache.put("a", 1)
+        self.cache.put("b", 2)
+        self.cache.invalidate("a")
+        self.cache.invalidate("missing")
+        self.assertIsNone(self.cache.get("a"))
+        self.cache.clear()
+        self.assertEqual(0, len(self.cache))
@@ -0,0 +1,89 @@
+import os
+
+import mock
+from neutron.tests import base
+from oslo_config import cfg
+
+from networking_afc.common import config
+
+
+CONFIG = """
+[ml2_border_leaf:10.0.0.1]
+vlan_ranges = %s
+physical_network_ports_mapping = fw1:[X28]
+
+[ml2_mech_aster_cx:10.0.0.2]
+physnet = physnet1
+host_ports_mapping = host1:[X25, X26]
+"""
+
+
+class SwitchSectionsTestCase(base.BaseTestCase):
+
+    def _config_file(self, vlan_ranges):
+        path = os.path.join(self.get_default_temp_dir().path, "aster.conf")
+        with open(path, "w") as conf_file:
+            conf_file.write(CONFIG % vlan_ranges)
+        return path
+
+    def setup_config(self, args=None):
+        super(SwitchSectionsTestCase, self).setup_config(
+            args=["--config-file", self._config_file("30:50")])
+        config.reset_switch_sections()
+        self.addCleanup(config.reset_switch_sections)
+
+    def test_sections_are_parsed_once(self):
+        with mock.patch.object(config, "get_sub_section_dict",
+                               wraps=config.get_sub_section_dict) as parse:
+            self.assertEqual(
+                {"10.0.0.1": {"vlan_ranges": ("30:50",),
+                              "physical_network_ports_mapping": {
+                                  "fw1": ("X28",)}}},
+                config.border_switches())
+            self.assertIs(config.border_switches(),
+                          config.border_switches())
+            self.assertEqual(
+                {"10.0.0.2": {"physnet": "physnet1",
+                              "host_ports_mapping": {
+                                  "host1": ("X25", "X26")}}},
+                config.cx_switches())
+        self.assertEqual(2, parse.call_count)
+
+    def test_sections_are_read_only(self):
+        switches = config.border_switches()
+        self.assertRaises(TypeError, switches.update, {})
+        self.assertRaises(TypeError, switches["10.0.0.1"].__setitem__,
+                          "vlan_ranges", ["60:70"])
+
+    def test_mutate_parses_again(self):
+        switches = config.cx_switches()
+        config.border_switches()
+        self._config_file("60:70")
+        cfg.CONF.mutate_config_files()
+        self.assertIsNot(switches, config.cx_switches())
+        self.assertEqual(switches, config.cx_switches())
+        self.assertEqual(("60:70",),
+                         config.border_switches()["10.0.0.1"]["vlan_ranges"])
+
+    def test_reload_parses_again(self):
+        config.border_switches()
+        self._config_file("60:70")
+        self.assertTrue(cfg.CONF.reload_config_files())
+        self.assertEqual(("60:70",),
+                         config.border_switches()["10.0.0.1"]["vlan_ranges"])
+
+    def test_parse_parses_again(self):
+        config.border_switches()
+        cfg.CONF(["--config-file", self._config_file("60:70")])
+        self.assertEqual(("60:70",),
+                         config.border_switches()["10.0.0.1"]["vlan_ranges"])
+
+    def test_reset(self):
+        switches = config.cx_switches()
+        config.reset_switch_sections()
+        self.assertIsNot(switches, config.cx_switches())
+        self.assertEqual(switches, config.cx_switches())
+
+    def test_override(self):
+        cfg.CONF.set_override("border_switches", {}, group="ml2_aster")
+        self.assertEqual({}, config.border_switches())
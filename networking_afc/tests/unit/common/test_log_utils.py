@@ -0,0 +1,24 @@
+import json
+
+import mock
+from neutron.tests import base
+
+from networking_afc.common import log_utils
+
+
+class PrettyJsonTestCase(base.BaseTestCase):
+
+    def test_str_is_indented_json(self):
+        params = {"switch_ip": "192.168.4.105", "vlan_id": 105}
+        self.assertEqual(json.dumps(params, indent=3),
+                         str(log_utils.PrettyJson(params)))
+
+    def test_not_serialized_until_formatted(self):
+        with mock.patch.object(log_utils.json, "dumps") as mock_dumps:
+            log_utils.PrettyJson({"vni": 10008})
+        self.assertFalse(mock_dumps.called)
+
+    def test_non_json_values(self):
+        params = {"host_ids": {"host-1": None}.keys()}
+        self.assertEqual(json.dumps({"host_ids": ["host-1"]}, indent=3),
+                         str(log_utils.PrettyJson(params)))
@@ -0,0 +1,78 @@
+from neutron.tests import base
+from oslo_config import cfg
+
+from networking_afc.common import api as afc_api
+from networking_afc.common import metrics
+from networking_afc.tests import afc_simulator
+
+
+SWITCH_IP = "192.168.4.105"
+
+
+class MetricsRegistryTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(MetricsRegistryTestCase, self).setUp()
+        self.registry = metrics.MetricsRegistry()
+
+    def test_counter_render(self):
+        counter = self.registry.register(metrics.Counter(
+            "test_total", "Test counter.", ("switch",)))
+        counter.inc("10.0.0.1")
+        counter.inc("10.0.0.1", amount=2)
+        self.assertEqual(3, counter.value("10.0.0.1"))
+        self.assertIn('test_total{switch="10.0.0.1"} 3',
+                      self.registry.render())
+
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = self.registry.register(metrics.Histogram(
+            "test_seconds", "Test histogram.", ("switch",),
+            buckets=(0.1, 1.0)))
+        for value in (0.05, 0.5, 5.0):
+            histogram.observe(value, "10.0.0.1")
+        output = self.registry.render()
+        self.assertIn('test_seconds_bucket{switch="10.0.0.1",le="0.1"} 1',
+                      output)
+        self.assertIn('test_seconds_bucket{switch="10.0.0.1",le="1.0"} 2',
+                      output)
+        self.assertIn('test_seconds_bucket{switch="10.0.0.1",le="+Inf"} 3',
+                      output)
+        self.assertIn('test_seconds_count{switch="10.0.0.1"} 3', output)
+        self.assertEqual(3, histogram.count("10.0.0.1"))
+
+    def test_labels_must_match(self):
+        counter = metrics.Counter("test_total", "Test.", ("switch",))
+        self.assertRaises(ValueError, counter.inc)
+
+
+class AfcRequestMetricsTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(AfcRequestMetricsTestCase, self).setUp()
+        self.afc = self.useFixture(afc_simulator.AfcSimulatorFixture(
+            device_ips=[SWITCH_IP])).simulator
+        self.client = afc_api.AfcRestClient()
+
+    def test_request_metrics_recorded(self):
+        labels = ("neutron_create_network", SWITCH_IP)
+        requests = metrics.AFC_REQUESTS.value(*(labels + (200,)))
+        observed = metrics.AFC_REQUEST_LATENCY.count(*labels)
+        # Body sizes are only counted when the metrics are exported
+        cfg.CONF.set_override("metrics_file", "/tmp/afc.prom",
+                              group="aster_afc")
+        self.client.send_config_to_afc({"switch_ip": SWITCH_IP,
+                                        "vni": 10008, "vlan_id": 105})
+        self.assertEqual(requests + 1,
+                         metrics.AFC_REQUESTS.value(*(labels + (200,))))
+        self.assertEqual(observed + 1,
+                         metrics.AFC_REQUEST_LATENCY.count(*labels))
+        self.assertEqual(0, metrics.AFC_IN_FLIGHT.value(*labels))
+        self.assertTrue(metrics.AFC_BYTES_SENT.value(*labels))
+
+    def test_failed_request_status_recorded(self):
+        self.afc.error_rate = 1.0
+        labels = ("list_devices", SWITCH_IP, 500)
+        failures = metrics.AFC_REQUESTS.value(*labels)
+        self.assertRaises(Exception, self.client.send_config_to_afc,
+                          {"switch_ip": SWITCH_IP})
+        self.assertEqual(failures + 1, metrics.AFC_REQUESTS.value(*labels))
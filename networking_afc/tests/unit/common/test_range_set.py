@@ -0,0 +1,42 @@
+from neutron.tests import base
+
+from networking_afc.common import range_set
+
+
+class RangeSetTestCase(base.BaseTestCase):
+
+    def test_membership(self):
+        ids = range_set.RangeSet([(100, 200), (5000, 5000)])
+        for id_ in (100, 150, 200, 5000):
+            self.assertIn(id_, ids)
+        for id_ in (0, 99, 201, 4999, 5001):
+            self.assertNotIn(id_, ids)
+        self.assertEqual(102, len(ids))
+
+    def test_overlapping_and_adjacent_ranges_are_merged(self):
+        ids = range_set.RangeSet([(10, 20), (1, 5), (15, 30), (6, 8)])
+        self.assertTrue(ids.overlapping)
+        self.assertEqual([(1, 8), (10, 30)], ids.ranges())
+        self.assertEqual(29, len(ids))
+        self.assertFalse(range_set.RangeSet([(1, 5), (6, 8)]).overlapping)
+
+    def test_iteration(self):
+        self.assertEqual([1, 2, 5],
+                         list(range_set.RangeSet([(5, 5), (1, 2)])))
+
+    def test_invalid_range(self):
+        self.assertRaises(ValueError, range_set.RangeSet, [(10, 5)])
+
+    def test_empty(self):
+        ids = range_set.RangeSet()
+        self.assertFalse(ids)
+        self.assertNotIn(1, ids)
+
+    def test_get_follows_ranges(self):
+        ranges = [(1, 5)]
+        ids = range_set.get(ranges)
+        self.assertIs(ids, range_set.get(ranges, ids))
+        ranges.append((10, 12))
+        updated = range_set.get(ranges, ids)
+        self.assertIsNot(ids, updated)
+        self.assertIn(11, updated)
@@ -0,0 +1,247 @@
+from hypothesis import given
+from hypothesis import strategies as st
+from neutron.tests import base
+
+from networking_afc.common import scheduler
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
+
+
+class FakeClock(object):
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+class TokenBucketTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(TokenBucketTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.bucket = scheduler.TokenBucket(2, 2, clock=self.clock)
+
+    def test_burst_then_refill(self):
+        for _ in range(2):
+            self.assertEqual(0, self.bucket.wait_time())
+            self.bucket.consume()
+        self.assertAlmostEqual(0.5, self.bucket.wait_time())
+        self.clock.now += 0.5
+        self.assertEqual(0, self.bucket.wait_time())
+
+    def test_refill_is_capped(self):
+        self.clock.now += 100
+        for _ in range(2):
+            self.bucket.consume()
+        self.assertTrue(self.bucket.wait_time() > 0)
+
+    def test_unlimited(self):
+        bucket = scheduler.TokenBucket(0, 1, clock=self.clock)
+        for _ in range(100):
+            bucket.consume()
+        self.assertEqual(0, bucket.wait_time())
+
+
+class AfcSchedulerTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(AfcSchedulerTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.scheduler = scheduler.AfcScheduler(
+            switch_rate=1, switch_burst=1, clock=self.clock)
+
+    def _op(self, switch_ip="10.0.0.1",
+            priority=scheduler.PRIORITY_CREATE, tenant_id="t1"):
+        op = scheduler.AfcOperation(switch_ip, priority, tenant_id)
+        self.scheduler._enqueue(op)
+        return op
+
+    def _drain(self, ops):
+        order = []
+        pending = list(ops)
+        while pending:
+            for op in pending:
+                if self.scheduler._try_dispatch(op, self.clock.now) is None:
+                    order.append(op)
+                    pending.remove(op)
+                    break
+            else:
+                self.clock.now += 1
+        return order
+
+    def test_unlimited_runs_immediately(self):
+        unlimited = scheduler.AfcScheduler()
+        self.assertEqual(3, unlimited.submit("10.0.0.1", lambda x: x + 1,
+                                             args=(2,)))
+
+    def test_deletes_before_creates(self):
+        create = self._op(priority=scheduler.PRIORITY_CREATE)
+        delete = self._op(priority=scheduler.PRIORITY_DELETE)
+        self.assertEqual([delete, create], self._drain([create, delete]))
+
+    def test_round_robin_across_tenants(self):
+        t1 = [self._op(tenant_id="t1") for _ in range(3)]
+        t2 = [self._op(tenant_id="t2") for _ in range(2)]
+        self.assertEqual([t1[0], t2[0], t1[1], t2[1], t1[2]],
+                         self._drain(t1 + t2))
+
+    def test_rate_limited_per_switch(self):
+        first = self._op()
+        second = self._op()
+        other_switch = self._op(switch_ip="10.0.0.2")
+        self.assertIsNone(self.scheduler._try_dispatch(first,
+                                                       self.clock.now))
+        self.assertEqual(1, self.scheduler._try_dispatch(second,
+                                                         self.clock.now))
+        self.assertIsNone(self.scheduler._try_dispatch(other_switch,
+                                                       self.clock.now))
+        self.clock.now += 1
+        self.assertIsNone(self.scheduler._try_dispatch(second,
+                                                       self.clock.now))
+        self.assertEqual(0, self.scheduler.pending())
+
+    def test_submit_times_out(self):
+        limited = scheduler.AfcScheduler(global_rate=0.001, global_burst=1,
+                                         max_wait=0.01)
+        limited.submit("10.0.0.1", lambda: None)
+        self.assertRaises(ex.AfcRequestQueueTimeout,
+                          limited.submit, "10.0.0.1", lambda: None)
+        self.assertEqual(0, limited.pending())
+
+
+KEYS = st.sampled_from(["net-a", "net-b"])
+# Resources configured on the switch before the operations
+STATES = st.dictionaries(KEYS, st.integers(0, 3))
+OPERATIONS = st.lists(st.tuples(KEYS,
+                                st.sampled_from([scheduler.OP_CREATE,
+                                                 scheduler.OP_UPDATE,
+                                                 scheduler.OP_DELETE]),
+                                st.integers(0, 3)),
+                      max_size=20)
+
+
+def _apply(state, ops):
+    # Resource state on the switch, creates and updates set the payload
+    state = dict(state)
+    for key, kind, payload in ops:
+        if kind == scheduler.OP_DELETE:
+            state.pop(key, None)
+        else:
+            state[key] = payload
+    return state
+
+
+class CompactionTestCase(base.BaseTestCase):
+
+    def test_delete_supersedes_create(self):
+        # The create may have updated a resource configured before
+        self.assertEqual(scheduler.COMPACT_REPLACE,
+                         scheduler.compact(scheduler.OP_CREATE,
+                                           scheduler.OP_DELETE))
+
+    def test_create_after_delete_then_delete_cancels(self):
+        self.assertEqual(scheduler.COMPACT_CANCEL,
+                         scheduler.compact(scheduler.OP_CREATE,
+                                           scheduler.OP_DELETE,
+                                           scheduler.OP_DELETE))
+
+    def test_updates_collapse(self):
+        self.assertEqual(scheduler.COMPACT_REPLACE,
+                         scheduler.compact(scheduler.OP_UPDATE,
+                                           scheduler.OP_UPDATE))
+
+    def test_pending_delete_is_kept(self):
+        for kind in (scheduler.OP_CREATE, scheduler.OP_UPDATE,
+                     scheduler.OP_DELETE):
+            self.assertEqual(scheduler.COMPACT_KEEP,
+                             scheduler.compact(scheduler.OP_DELETE, kind))
+
+    @given(STATES, OPERATIONS)
+    def test_final_state_is_preserved(self, state, ops):
+        self.assertEqual(_apply(state, ops),
+                         _apply(state, scheduler.compact_sequence(ops)))
+
+    def test_resent_create_then_delete_is_not_cancelled(self):
+        ops = [("net-a", scheduler.OP_CREATE, 1),
+               ("net-a", scheduler.OP_DELETE, 2)]
+        self.assertEqual([ops[1]], scheduler.compact_sequence(ops))
+
+    @given(OPERATIONS)
+    def test_survivors_keep_their_order(self, ops):
+        survivors = iter(range(len(ops)))
+        for op in scheduler.compact_sequence(ops):
+            self.assertIn(op, (ops[index] for index in survivors))
+
+    @given(OPERATIONS)
+    def test_deletes_only_cancel_with_creates(self, ops):
+        compacted = scheduler.compact_sequence(ops)
+
+        def dropped(kind):
+            return (sum(1 for op in ops if op[1] == kind) -
+                    sum(1 for op in compacted if op[1] == kind))
+
+        self.assertLessEqual(dropped(scheduler.OP_DELETE),
+                             dropped(scheduler.OP_CREATE))
+
+    def test_delete_supersedes_create_after_update(self):
+        ops = [("net-a", scheduler.OP_UPDATE, 0),
+               ("net-a", scheduler.OP_CREATE, 1),
+               ("net-a", scheduler.OP_DELETE, 2)]
+        self.assertEqual([ops[0], ops[2]],
+                         scheduler.compact_sequence(ops))
+
+
+class SchedulerCompactionTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(SchedulerCompactionTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.scheduler = scheduler.AfcScheduler(
+            switch_rate=1, switch_burst=1, clock=self.clock)
+
+    def _admit(self, kind, key=("network", "10.0.0.1", 10008, 105)):
+        op = scheduler.AfcOperation("10.0.0.1", scheduler.PRIORITY_CREATE,
+                                    "t1", key=key, kind=kind)
+        with self.scheduler._cond:
+            return op, self.scheduler._admit(op)
+
+    def test_delete_replaces_create(self):
+        create, _admitted = self._admit(scheduler.OP_CREATE)
+        delete, admitted = self._admit(scheduler.OP_DELETE)
+        self.assertTrue(admitted)
+        self.assertTrue(create.cancelled)
+        self.assertFalse(delete.cancelled)
+        self.assertEqual(1, self.scheduler.pending())
+
+    def test_create_after_delete_then_delete_cancel_out(self):
+        delete, _admitted = self._admit(scheduler.OP_DELETE)
+        create, _admitted = self._admit(scheduler.OP_CREATE)
+        _delete, admitted = self._admit(scheduler.OP_DELETE)
+        self.assertFalse(admitted)
+        self.assertTrue(create.cancelled)
+        self.assertFalse(delete.cancelled)
+        self.assertEqual(1, self.scheduler.pending())
+
+    def test_updates_collapse_into_last(self):
+        first, _admitted = self._admit(scheduler.OP_UPDATE)
+        last, admitted = self._admit(scheduler.OP_UPDATE)
+        self.assertTrue(admitted)
+        self.assertTrue(first.cancelled)
+        self.assertFalse(last.cancelled)
+        self.assertEqual(1, self.scheduler.pending())
+
+    def test_other_resources_are_not_compacted(self):
+        self._admit(scheduler.OP_CREATE)
+        _delete, admitted = self._admit(
+            scheduler.OP_DELETE, key=("network", "10.0.0.1", 10009, 106))
+        self.assertTrue(admitted)
+        self.assertEqual(2, self.scheduler.pending())
+
+    def test_dispatched_operation_is_not_compacted(self):
+        create, _admitted = self._admit(scheduler.OP_CREATE)
+        self.assertIsNone(self.scheduler._try_dispatch(create,
+                                                       self.clock.now))
+        _delete, admitted = self._admit(scheduler.OP_DELETE)
+        self.assertTrue(admitted)
+        self.assertFalse(create.cancelled)
@@ -0,0 +1,226 @@
+import mock
+
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import registry
+from neutron_lib.callbacks import resources
+from neutron.db import models_v2
+from neutron.db.models import segment as segment_models
+from neutron.plugins.ml2 import models as ml2_models
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as db_api
+from oslo_config import cfg
+
+from networking_afc.common import utils
+from networking_afc.db import replica
+from networking_afc.db.models import aster_models_v2
+
+
+class AllocationLookupTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(AllocationLookupTestCase, self).setUp()
+        session = db_api.get_writer_session()
+        with session.begin():
+            for l3_vni, router_id in ((5000, "r1"), (5001, "r2"),
+                                      (5002, "")):
+                session.add(aster_models_v2.AsterL3VNIAllocation(
+                    l3_vni=l3_vni, router_id=router_id))
+            for switch_ip, vlan_id, router_id in (
+                    ("10.0.0.1", 30, "r1"), ("10.0.0.2", 31, "r1"),
+                    ("10.0.0.1", 32, "r2"), ("10.0.0.1", 33, "")):
+                session.add(aster_models_v2.AsterLeafVlanAllocation(
+                    switch_ip=switch_ip, vlan_id=vlan_id,
+                    router_id=router_id))
+        self.query = mock.patch.object(
+            utils, "_query_by_router_ids",
+            side_effect=utils._query_by_router_ids).start()
+
+    def test_l3_vnis_by_router_ids(self):
+        self.assertEqual({"r1": 5000, "r2": 5001},
+                         utils.get_l3_vnis_by_router_ids(["r1", "r2", "r3"]))
+        self.assertEqual(1, self.query.call_count)
+
+    def test_free_rows_are_not_returned(self):
+        self.assertEqual({}, utils.get_l3_vnis_by_router_ids(["", None]))
+        self.assertEqual(-1, utils.get_l3_vni_by_route_id(""))
+        self.assertFalse(self.query.called)
+
+    def test_vlan_ids_by_router_ids(self):
+        self.assertEqual(
+            {"r1": {"10.0.0.1": 30, "10.0.0.2": 31}, "r2": {"10.0.0.1": 32}},
+            utils.get_vlan_ids_by_router_ids(["r1", "r2"]))
+        self.assertEqual(31, utils.get_vlan_id_by_route_id(
+            switch_ip="10.0.0.2", router_id="r1"))
+        self.assertEqual(-1, utils.get_vlan_id_by_route_id(
+            switch_ip="10.0.0.2", router_id="r2"))
+
+    def test_chunked_in_queries(self):
+        with mock.patch.object(utils, "_IN_CHUNK_SIZE", 1):
+            self.assertEqual({"r1": 5000, "r2": 5001},
+                             utils.get_l3_vnis_by_router_ids(["r1", "r2"]))
+
+    def test_memo_queries_each_router_once(self):
+        with utils.AllocationMemo():
+            utils.get_l3_vnis_by_router_ids(["r1", "r3"])
+            self.assertEqual(5000, utils.get_l3_vni_by_route_id("r1"))
+            self.assertEqual(-1, utils.get_l3_vni_by_route_id("r3"))
+            self.assertEqual({"r1": 5000, "r2": 5001},
+                             utils.get_l3_vnis_by_router_ids(["r1", "r2"]))
+        self.assertEqual(2, self.query.call_count)
+        self.assertEqual(["r2"], self.query.call_args[0][0])
+
+    def test_memo_is_invalidated(self):
+        with utils.AllocationMemo():
+            utils.get_l3_vni_by_route_id("r1")
+            utils.invalidate_allocation_memo()
+            utils.get_l3_vni_by_route_id("r1")
+        self.assertEqual(2, self.query.call_count)
+
+    def test_memo_ends_with_outermost_context(self):
+        with utils.AllocationMemo():
+            with utils.AllocationMemo():
+                utils.get_l3_vni_by_route_id("r1")
+            utils.get_l3_vni_by_route_id("r1")
+        utils.get_l3_vni_by_route_id("r1")
+        self.assertEqual(2, self.query.call_count)
+
+
+class SubnetDetailCacheTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(SubnetDetailCacheTestCase, self).setUp()
+        mock.patch.object(utils, "_subnet_cache", None).start()
+        self.session = db_api.get_writer_session()
+        with self.session.begin():
+            self.session.add(models_v2.Network(id="net1", name="net1"))
+            self.session.add(models_v2.Network(id="net2", name="net2"))
+            self.session.add(models_v2.Subnet(
+                id="sub1", network_id="net1", ip_version=4,
+                cidr="10.0.0.0/24", gateway_ip="10.0.0.1"))
+        self.query = mock.patch.object(
+            utils, "_query_subnet_detail",
+            side_effect=utils._query_subnet_detail).start()
+
+    def test_detail_is_cached(self):
+        expected = {"subnet_id": "sub1", "gip": "10.0.0.1",
+                    "cidr": "10.0.0.0/24", "ip_version": 4,
+                    "gw_and_mask": "10.0.0.1/24"}
+        detail = utils.get_subnet_detail_by_network_id("net1")
+        self.assertEqual(expected, detail)
+        detail["gip"] = "changed"
+        self.assertEqual(expected,
+                         utils.get_subnet_detail_by_network_id("net1"))
+        self.assertEqual(1, self.query.call_count)
+
+    def test_replica_not_read(self):
+        cfg.CONF.set_override("replica_reads", True, group="aster_db")
+        cfg.CONF.set_override("replica_max_lag", 0, group="aster_db")
+        # No write of this thread to read after
+        mock.patch.object(replica, "_local", replica.threading.local()
+                          ).start()
+        sessionmaker = mock.patch.object(
+            replica, "_sessionmaker", wraps=replica._sessionmaker).start()
+        # The subnet decides the gateway configured on the switches
+        self.assertEqual(
+            "10.0.0.1/24",
+            utils.get_subnet_detail_by_network_id("net1")["gw_and_mask"])
+        self.assertFalse(sessionmaker.called)
+        utils.get_read_session()
+        sessionmaker.assert_called_once_with(use_slave=True)
+
+    def test_missing_subnet_is_not_cached(self):
+        self.assertIsNone(utils.get_subnet_detail_by_network_id("net2"))
+        # Created by another worker, no event is received here
+        with self.session.begin():
+            self.session.add(models_v2.Subnet(
+                id="sub2", network_id="net2", ip_version=4,
+                cidr="10.0.1.0/24", gateway_ip="10.0.1.1"))
+        self.assertEqual(
+            "10.0.1.1/24",
+            utils.get_subnet_detail_by_network_id("net2")["gw_and_mask"])
+
+    def test_subnet_events_invalidate(self):
+        utils.subscribe_subnet_cache_invalidation()
+        self.assertIsNone(utils.get_subnet_detail_by_network_id("net2"))
+        with self.session.begin():
+            self.session.add(models_v2.Subnet(
+                id="sub2", network_id="net2", ip_version=4,
+                cidr="10.0.1.0/24", gateway_ip="10.0.1.1"))
+        registry.notify(resources.SUBNET, events.AFTER_CREATE, self,
+                        subnet={"id": "sub2", "network_id": "net2"})
+        self.assertEqual(
+            "10.0.1.1/24",
+            utils.get_subnet_detail_by_network_id("net2")["gw_and_mask"])
+        self.assertEqual(2, self.query.call_count)
+
+    def test_event_without_network_clears_cache(self):
+        utils.get_subnet_detail_by_network_id("net1")
+        utils._invalidate_subnet_cache_on_event(
+            resources.SUBNET, events.AFTER_DELETE, self)
+        utils.get_subnet_detail_by_network_id("net1")
+        self.assertEqual(2, self.query.call_count)
+
+
+class PortsBySubnetTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(PortsBySubnetTestCase, self).setUp()
+        session = db_api.get_writer_session()
+        with session.begin():
+            session.add(models_v2.Network(id="net1", name="net1"))
+            session.add(models_v2.Subnet(
+                id="sub1", network_id="net1", ip_version=4,
+                cidr="10.0.0.0/24", gateway_ip="10.0.0.1"))
+            for segment_id, network_type, segmentation_id in (
+                    ("seg_vxlan", "aster_vxlan", 10000),
+                    ("seg_vlan", "vlan", 100)):
+                session.add(segment_models.NetworkSegment(
+                    id=segment_id, network_id="net1",
+                    network_type=network_type, physical_network="physnet1",
+                    segmentation_id=segmentation_id))
+            # Not all the foreign keys have a relationship to order the
+            # inserts by
+            session.flush()
+            for index, (port_id, host, owner) in enumerate((
+                    ("p1", "host1", "compute:nova"),
+                    ("p2", "host2", "compute:nova"),
+                    ("p3", "host1", "network:dhcp"),
+                    ("p4", "host1", "compute:nova"))):
+                session.add(models_v2.Port(
+                    id=port_id, network_id="net1",
+                    mac_address="fa:16:3e:00:00:%02x" % index,
+                    admin_state_up=True, status="ACTIVE", device_id="",
+                    device_owner=owner))
+                session.add(models_v2.IPAllocation(
+                    port_id=port_id, subnet_id="sub1", network_id="net1",
+                    ip_address="10.0.0.%d" % (index + 10)))
+                session.add(ml2_models.PortBinding(
+                    port_id=port_id, host=host, vif_type="ovs",
+                    status="ACTIVE"))
+            session.flush()
+            # p1 is bound through both segments, p4 is not bound
+            for port_id, host, level, segment_id in (
+                    ("p1", "host1", 1, "seg_vlan"),
+                    ("p1", "host1", 0, "seg_vxlan"),
+                    ("p2", "host2", 0, "seg_vxlan"),
+                    ("p3", "host1", 0, "seg_vxlan")):
+                session.add(ml2_models.PortBindingLevel(
+                    port_id=port_id, host=host, level=level,
+                    driver="aster", segment_id=segment_id))
+
+    def test_bottom_segment_and_no_dhcp(self):
+        ports = utils.get_ports_by_subnet(subnet_id="sub1")
+        self.assertEqual(
+            [("p1", "host1", "compute:nova", "vlan", 100, "physnet1"),
+             ("p2", "host2", "compute:nova", "aster_vxlan", 10000,
+              "physnet1"),
+             ("p4", "host1", "compute:nova", None, None, None)],
+            [tuple(port) for port in ports])
+
+    def test_filter_by_hosts(self):
+        ports = utils.get_ports_by_subnet(subnet_id="sub1",
+                                          host_ids={"host2": []}.keys())
+        self.assertEqual(["p2"], [port.id for port in ports])
+        self.assertEqual(
+            [], utils.get_ports_by_subnet(subnet_id="sub2",
+                                          host_ids=["host1"]))
@@ -0,0 +1,236 @@
+import mock
+from neutron.tests import base
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+
+from networking_afc.db import allocator
+from networking_afc.db.models import aster_models_v2
+
+
+class FreeIdSetTestCase(base.BaseTestCase):
+
+    def test_from_sorted_ids_coalesces_runs(self):
+        free_ids = allocator.FreeIdSet.from_sorted_ids([1, 2, 3, 7, 9, 10])
+        self.assertEqual([(1, 3), (7, 7), (9, 10)], free_ids.intervals())
+        self.assertEqual(6, len(free_ids))
+
+    def test_adjacent_intervals_are_joined(self):
+        free_ids = allocator.FreeIdSet([(1, 2), (3, 5), (7, 8)])
+        self.assertEqual([(1, 5), (7, 8)], free_ids.intervals())
+        self.assertEqual(7, len(free_ids))
+
+    def test_unsorted_intervals_are_rejected(self):
+        self.assertRaises(ValueError, allocator.FreeIdSet,
+                          [(5, 8), (1, 2)])
+        self.assertRaises(ValueError, allocator.FreeIdSet,
+                          [(1, 5), (5, 8)])
+
+    def test_pop_lowest(self):
+        free_ids = allocator.FreeIdSet([(1, 2), (5, 5), (8, 9)])
+        self.assertEqual([1, 2, 5, 8, 9],
+                         [free_ids.pop_lowest() for _ in range(5)])
+        self.assertIsNone(free_ids.pop_lowest())
+        self.assertFalse(free_ids)
+        self.assertEqual([], free_ids.intervals())
+
+    def test_add_joins_neighbours(self):
+        free_ids = allocator.FreeIdSet([(1, 2), (4, 5)])
+        free_ids.add(3)
+        self.assertEqual([(1, 5)], free_ids.intervals())
+        free_ids.add(7)
+        free_ids.add(0)
+        free_ids.add(6)
+        self.assertEqual([(0, 7)], free_ids.intervals())
+        free_ids.add(4)
+        self.assertEqual(8, len(free_ids))
+
+    def test_add_after_pop_lowest(self):
+        free_ids = allocator.FreeIdSet([(1, 1), (3, 3), (5, 5)])
+        free_ids.pop_lowest()
+        free_ids.pop_lowest()
+        free_ids.add(1)
+        self.assertEqual([(1, 1), (5, 5)], free_ids.intervals())
+        self.assertEqual(1, free_ids.pop_lowest())
+
+    def test_discard_splits_interval(self):
+        free_ids = allocator.FreeIdSet([(1, 5)])
+        self.assertTrue(free_ids.discard(3))
+        self.assertFalse(free_ids.discard(3))
+        self.assertEqual([(1, 2), (4, 5)], free_ids.intervals())
+        free_ids.discard(1)
+        free_ids.discard(5)
+        self.assertEqual([(2, 2), (4, 4)], free_ids.intervals())
+        self.assertNotIn(3, free_ids)
+        self.assertIn(4, free_ids)
+        self.assertEqual([2, 4], list(free_ids))
+
+
+class FakePool(object):
+
+    def __init__(self, free_ids, taken=()):
+        self.free_ids = set(free_ids)
+        self.taken = set(taken)
+        self.loads = 0
+
+    def load(self, session):
+        self.loads += 1
+        return allocator.FreeIdSet.from_sorted_ids(
+            sorted(self.free_ids - self.taken))
+
+    def claim(self, session, id_, owner):
+        if id_ in self.taken or id_ not in self.free_ids:
+            return False
+        self.taken.add(id_)
+        return True
+
+    def claim_many(self, session, ids, owner):
+        return [id_ for id_ in ids if self.claim(session, id_, owner)]
+
+
+class PoolAllocatorTestCase(base.BaseTestCase):
+
+    def _allocator(self, fake):
+        return allocator.PoolAllocator("fake", fake.load, fake.claim)
+
+    def test_allocates_lowest_free_id(self):
+        fake = FakePool(range(10, 15))
+        pool = self._allocator(fake)
+        self.assertEqual([10, 11, 12],
+                         [pool.allocate(None) for _ in range(3)])
+        self.assertEqual(1, fake.loads)
+
+    def test_released_id_is_reused(self):
+        fake = FakePool(range(10, 15))
+        pool = self._allocator(fake)
+        pool.allocate(None)
+        pool.allocate(None)
+        fake.taken.discard(10)
+        pool.release(10)
+        self.assertEqual(10, pool.allocate(None))
+
+    def test_id_taken_elsewhere_is_skipped(self):
+        fake = FakePool(range(10, 15))
+        pool = self._allocator(fake)
+        pool.allocate(None)
+        fake.taken.update([11, 12])
+        self.assertEqual(13, pool.allocate(None))
+        self.assertEqual(1, fake.loads)
+
+    def test_reload_after_max_misses(self):
+        fake = FakePool(range(100))
+        pool = self._allocator(fake)
+        pool.allocate(None)
+        fake.taken.update(range(1, 50))
+        self.assertEqual(50, pool.allocate(None))
+        self.assertEqual(2, fake.loads)
+
+    def test_reload_when_empty(self):
+        fake = FakePool([1, 2])
+        pool = self._allocator(fake)
+        pool.allocate(None)
+        pool.allocate(None)
+        # Released by another worker
+        fake.taken.discard(1)
+        self.assertEqual(1, pool.allocate(None))
+        self.assertIsNone(pool.allocate(None))
+        self.assertEqual(3, fake.loads)
+
+    def test_failed_claim_returns_id(self):
+        fake = FakePool([1, 2])
+        pool = self._allocator(fake)
+
+        def claim(session, id_, owner):
+            raise RuntimeError()
+
+        pool._claim = claim
+        self.assertRaises(RuntimeError, pool.allocate, None)
+        pool._claim = fake.claim
+        self.assertEqual(1, pool.allocate(None))
+
+    def test_allocate_many(self):
+        fake = FakePool(range(10, 15))
+        pool = allocator.PoolAllocator("fake", fake.load, fake.claim,
+                                       fake.claim_many)
+        pool.allocate(None)
+        fake.taken.update([11, 12])
+        self.assertEqual([13, 14], pool.allocate_many(None, 3))
+        self.assertEqual(2, fake.loads)
+        self.assertEqual([], pool.allocate_many(None, 3))
+
+    def test_allocate_many_without_claim_many(self):
+        fake = FakePool(range(10, 15))
+        pool = self._allocator(fake)
+        self.assertEqual([10, 11, 12], pool.allocate_many(None, 3))
+        self.assertEqual([13, 14], pool.allocate_many(None, 3))
+
+    def test_failed_claim_many_returns_ids(self):
+        fake = FakePool([1, 2])
+        pool = allocator.PoolAllocator("fake", fake.load, fake.claim,
+                                       mock.Mock(side_effect=RuntimeError()))
+        self.assertRaises(RuntimeError, pool.allocate_many, None, 2)
+        pool._claim_many = fake.claim_many
+        self.assertEqual([1, 2], pool.allocate_many(None, 2))
+
+    def test_invalidate(self):
+        fake = FakePool([1, 2])
+        pool = self._allocator(fake)
+        pool.allocate(None)
+        pool.invalidate()
+        pool.release(1)
+        self.assertEqual(2, pool.allocate(None))
+        self.assertEqual(2, fake.loads)
+
+
+class RouterPoolTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(RouterPoolTestCase, self).setUp()
+        self.model = aster_models_v2.AsterLeafVlanAllocation
+        self.session = lib_db_api.get_writer_session()
+        with self.session.begin(subtransactions=True):
+            for switch_ip in ("10.0.0.1", "10.0.0.2"):
+                for vlan_id in (100, 101, 102):
+                    self.session.add(self.model(
+                        switch_ip=switch_ip, vlan_id=vlan_id,
+                        router_id="router-a" if vlan_id == 100 else ""))
+        self.pool = allocator.router_pool("border_vlan:10.0.0.1", self.model,
+                                          self.model.vlan_id,
+                                          switch_ip="10.0.0.1")
+
+    def _owner(self, switch_ip, vlan_id):
+        return self.session.query(self.model.router_id).filter_by(
+            switch_ip=switch_ip, vlan_id=vlan_id).scalar()
+
+    def test_allocate_claims_free_row_of_switch(self):
+        self.assertEqual(101, self.pool.allocate(self.session, "router-b"))
+        self.assertEqual("router-b", self._owner("10.0.0.1", 101))
+        self.assertEqual("", self._owner("10.0.0.2", 101))
+
+    def test_allocate_skips_row_taken_elsewhere(self):
+        self.pool.reload(self.session)
+        self.session.query(self.model).filter_by(
+            switch_ip="10.0.0.1", vlan_id=101).update(
+                {"router_id": "router-c"})
+        self.assertEqual(102, self.pool.allocate(self.session, "router-b"))
+        self.assertIsNone(self.pool.allocate(self.session, "router-d"))
+
+    def test_allocate_many_claims_free_rows_of_switch(self):
+        self.assertEqual([101, 102],
+                         self.pool.allocate_many(self.session, 3, "router-b"))
+        self.assertEqual("router-b", self._owner("10.0.0.1", 102))
+        self.assertEqual("", self._owner("10.0.0.2", 102))
+
+    def test_load_free_intervals(self):
+        with self.session.begin(subtransactions=True):
+            for vlan_id in (103, 104, 105, 106):
+                self.session.add(self.model(
+                    switch_ip="10.0.0.1", vlan_id=vlan_id,
+                    router_id="router-a" if vlan_id == 103 else ""))
+        # Grouped by the database, and from the IDs without window
+        # functions
+        for window_functions in (True, False):
+            with mock.patch.object(allocator, "_has_window_functions",
+                                   return_value=window_functions):
+                self.pool.reload(self.session)
+            self.assertEqual([(101, 102), (104, 106)],
+                             self.pool._free_ids.intervals())
@@ -0,0 +1,113 @@
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as db_api
+from oslo_db import exception as db_exc
+from sqlalchemy.dialects import sqlite
+
+from networking_afc.db.models import aster_models_v2
+
+
+def _query_plan(session, query):
+    statement = query.statement.compile(
+        dialect=sqlite.dialect(), compile_kwargs={"literal_binds": True})
+    rows = session.execute("EXPLAIN QUERY PLAN %s" % statement)
+    return " ".join(str(row[-1]) for row in rows)
+
+
+class AsterPortBindingIndexTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(AsterPortBindingIndexTestCase, self).setUp()
+        self.session = db_api.get_writer_session()
+
+    def _add_binding(self, switch_ip, subnet_id, router_id=""):
+        with self.session.begin():
+            self.session.add(aster_models_v2.AsterPortBinding(
+                switch_ip=switch_ip, vlan_id=100, l2_vni=10000,
+                subnet_id=subnet_id, router_id=router_id))
+
+    def _assert_uses_index(self, query, index_name):
+        self.assertIn(index_name, _query_plan(self.session, query))
+
+    def _assert_uses_unique_index(self, query):
+        # SQLite backs unique constraints with an automatic index which
+        # does not carry the constraint name
+        plan = _query_plan(self.session, query)
+        self.assertIn("USING INDEX sqlite_autoindex_aster_ml2_port_bindings",
+                      plan)
+        self.assertIn("switch_ip=? AND subnet_id=?", plan)
+
+    def _bindings(self):
+        return self.session.query(aster_models_v2.AsterPortBinding)
+
+    def test_switch_and_subnet_lookup_uses_unique_index(self):
+        self._assert_uses_unique_index(
+            self._bindings().filter_by(switch_ip="10.0.0.1",
+                                       subnet_id="subnet-1"))
+        self._assert_uses_unique_index(
+            self._bindings().filter_by(switch_ip="10.0.0.1",
+                                       is_config_l2=False,
+                                       subnet_id="subnet-1"))
+
+    def test_switch_and_router_lookup_uses_index(self):
+        self._assert_uses_index(
+            self._bindings().filter_by(switch_ip="10.0.0.1",
+                                       router_id="router-1"),
+            "ix_aster_ml2_port_bindings_switch_ip_router_id")
+
+    def test_switches_of_subnet_uses_index(self):
+        model = aster_models_v2.AsterPortBinding
+        self._assert_uses_index(
+            self.session.query(model.switch_ip, model.vlan_id).filter_by(
+                subnet_id="subnet-1"),
+            "ix_aster_ml2_port_bindings_subnet_id_switch_ip")
+
+    def test_hash_matches_eq(self):
+        binding = aster_models_v2.AsterPortBinding(
+            switch_ip="10.0.0.1", vlan_id=100, l2_vni=10000,
+            subnet_id="subnet-1")
+        same = aster_models_v2.AsterPortBinding(
+            switch_ip="10.0.0.1", vlan_id=100, l2_vni=10000,
+            subnet_id="subnet-2")
+        self.assertEqual(binding, same)
+        self.assertEqual(hash(binding), hash(same))
+
+    def test_switch_and_subnet_are_unique(self):
+        self._add_binding("10.0.0.1", "subnet-1")
+        self._add_binding("10.0.0.2", "subnet-1")
+        self.assertRaises(db_exc.DBDuplicateEntry,
+                          self._add_binding, "10.0.0.1", "subnet-1")
+
+
+class AllocationIndexTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(AllocationIndexTestCase, self).setUp()
+        self.session = db_api.get_reader_session()
+
+    def _assert_index_seek(self, query, index_name):
+        plan = _query_plan(self.session, query)
+        self.assertIn("SEARCH", plan)
+        self.assertIn(index_name, plan)
+
+    def test_vni_of_router_uses_index(self):
+        for model, index_name in (
+                (aster_models_v2.AsterL3VNIAllocation,
+                 "ix_ml2_aster_l3_vni_allocations_router_id"),
+                (aster_models_v2.AsterL2VNIAllocation,
+                 "ix_ml2_leaf_l2_vni_allocations_router_id")):
+            self._assert_index_seek(
+                self.session.query(model).filter_by(router_id="router-1"),
+                index_name)
+
+    def test_free_vni_lookup_uses_index(self):
+        model = aster_models_v2.AsterL3VNIAllocation
+        self._assert_index_seek(
+            self.session.query(model).filter_by(router_id="").
+            order_by(model.l3_vni).limit(1),
+            "ix_ml2_aster_l3_vni_allocations_")
+
+    def test_vlan_of_router_uses_index(self):
+        self._assert_index_seek(
+            self.session.query(aster_models_v2.AsterLeafVlanAllocation).
+            filter_by(switch_ip="10.0.0.1", router_id="router-1"),
+            "ix_ml2_leaf_vlan_allocations_switch_ip_router_id")
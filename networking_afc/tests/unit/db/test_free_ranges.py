@@ -0,0 +1,142 @@
+from neutron.tests import base
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+import sqlalchemy as sa
+
+from networking_afc.db import free_ranges
+from networking_afc.db.models import aster_models_v2
+
+
+class FreeIntervalsTestCase(base.BaseTestCase):
+
+    def test_allocated_ids_split_ranges(self):
+        self.assertEqual([(2, 4), (6, 9), (20, 30)],
+                         free_ranges.free_intervals(
+                             [(1, 10), (20, 30)], [10, 1, 5, 15]))
+
+    def test_overlapping_ranges_are_merged(self):
+        self.assertEqual([(1, 7), (9, 12)],
+                         free_ranges.free_intervals(
+                             [(5, 12), (1, 6)], [8]))
+
+    def test_fully_allocated(self):
+        self.assertEqual([], free_ranges.free_intervals([(1, 2)], [1, 2]))
+
+
+class FreeRangesTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(FreeRangesTestCase, self).setUp()
+        cfg.CONF.set_override("vni_pool_storage", free_ranges.RANGES,
+                              group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "vni_pool_storage",
+                        group="aster_db")
+        self.model = aster_models_v2.AsterL3VNIAllocation
+        self.session = lib_db_api.get_writer_session()
+
+    def _add_rows(self, rows):
+        with self.session.begin(subtransactions=True):
+            self.session.execute(self.model.__table__.insert(), [
+                {'l3_vni': l3_vni, 'router_id': router_id}
+                for l3_vni, router_id in rows])
+
+    def _sync(self, id_ranges, batch_size=free_ranges.BATCH_SIZE):
+        free_ranges.sync_pool(free_ranges.POOL_L3_VNI, self.model.l3_vni,
+                              self.model.router_id == "", id_ranges,
+                              batch_size=batch_size)
+
+    def _intervals(self):
+        return free_ranges.load_intervals(self.session,
+                                          free_ranges.POOL_L3_VNI)
+
+    def _rows(self):
+        return sorted(
+            self.session.query(self.model.l3_vni, self.model.router_id))
+
+    def test_sync_converts_rows(self):
+        self._add_rows([(vni, "router-a" if vni == 103 else "")
+                        for vni in range(100, 110)])
+        self._sync([(100, 109)], batch_size=3)
+        self.assertEqual([(100, 102), (104, 109)], self._intervals())
+        self.assertEqual([(103, "router-a")], self._rows())
+
+    def test_sync_locks_intervals_first(self):
+        self._sync([(100, 109)])
+        statements = []
+        engine = self.session.get_bind()
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sa.event.listen(engine, "before_cursor_execute", record)
+        self.addCleanup(sa.event.remove, engine, "before_cursor_execute",
+                        record)
+        self._sync([(100, 109)])
+        selects = [statement for statement in statements
+                   if statement.startswith("SELECT ")
+                   and statement != "SELECT 1"]
+        # Claims lock the intervals before inserting allocated rows
+        self.assertIn("FROM ml2_aster_free_ranges", selects[0])
+        self.assertIn("FROM ml2_aster_l3_vni_allocations", selects[1])
+
+    def test_take_and_add_free_id(self):
+        self._sync([(100, 109)])
+        with self.session.begin():
+            self.assertTrue(free_ranges.take_free_id(
+                self.session, free_ranges.POOL_L3_VNI, 104))
+            self.assertFalse(free_ranges.take_free_id(
+                self.session, free_ranges.POOL_L3_VNI, 104))
+            free_ranges.take_free_id(self.session,
+                                     free_ranges.POOL_L3_VNI, 100)
+        self.assertEqual([(101, 103), (105, 109)], self._intervals())
+        with self.session.begin():
+            free_ranges.add_free_id(self.session,
+                                    free_ranges.POOL_L3_VNI, 104)
+            free_ranges.add_free_id(self.session,
+                                    free_ranges.POOL_L3_VNI, 100)
+            free_ranges.add_free_id(self.session,
+                                    free_ranges.POOL_L3_VNI, 107)
+        self.assertEqual([(100, 109)], self._intervals())
+
+    def test_router_pool_inserts_allocated_rows(self):
+        self._add_rows([(100, "router-a")])
+        self._sync([(100, 102)])
+        pool = free_ranges.router_pool(free_ranges.POOL_L3_VNI, self.model,
+                                       self.model.l3_vni)
+        with self.session.begin():
+            self.assertEqual(101, pool.allocate(self.session, "router-b"))
+            self.assertEqual(102, pool.allocate(self.session, "router-c"))
+            self.assertIsNone(pool.allocate(self.session, "router-d"))
+        self.assertEqual([(100, "router-a"), (101, "router-b"),
+                          (102, "router-c")], self._rows())
+        self.assertEqual([], self._intervals())
+
+    def test_claim_left_over_free_row(self):
+        self._sync([(100, 101)])
+        self._add_rows([(100, "")])
+        with self.session.begin():
+            self.assertTrue(free_ranges.claim_free_id(
+                self.session, free_ranges.POOL_L3_VNI, self.model.l3_vni,
+                100, {'router_id': "router-a"}))
+        self.assertEqual([(100, "router-a")], self._rows())
+
+    def test_claim_and_add_free_ids(self):
+        self._add_rows([(103, "router-a")])
+        self._sync([(100, 109)])
+        with self.session.begin():
+            self.assertEqual([101, 102, 104, 105], free_ranges.claim_free_ids(
+                self.session, free_ranges.POOL_L3_VNI, self.model.l3_vni,
+                [101, 102, 103, 104, 105], {'router_id': "router-b"}))
+        self.assertEqual([(100, 100), (106, 109)], self._intervals())
+        self.assertEqual(5, len(self._rows()))
+        with self.session.begin():
+            free_ranges.add_free_ids(self.session, free_ranges.POOL_L3_VNI,
+                                     [105, 101, 102, 106])
+        self.assertEqual([(100, 102), (105, 109)], self._intervals())
+
+    def test_rows_mode_clears_pool(self):
+        self._sync([(100, 101)])
+        with self.session.begin():
+            free_ranges.clear_pool(self.session, free_ranges.POOL_L3_VNI)
+        self.assertEqual([], self._intervals())
@@ -0,0 +1,72 @@
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as db_api
+from oslo_config import cfg
+
+from networking_afc.db import host_mappings
+from networking_afc.db.models import aster_models_v2
+
+
+SWITCH_INFOS = {
+    "10.0.0.1": {"physnet": "physnet1",
+                 "host_ports_mapping": {"host1": ["X1", "X2"],
+                                        "host2": ["X3"]}},
+    "10.0.0.2": {"physnet": "physnet2",
+                 "host_ports_mapping": {"host1": ["X4"]}},
+}
+
+
+class HostMappingsTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(HostMappingsTestCase, self).setUp()
+        self.session = db_api.get_writer_session()
+        host_mappings.replace_host_mappings(
+            host_mappings.mappings_from_switch_infos(SWITCH_INFOS))
+
+    def _rows(self):
+        model = aster_models_v2.AsterCxHostMapping
+        with self.session.begin():
+            return sorted(self.session.query(
+                model.switch_ip, model.host_id, model.switch_interfaces,
+                model.physical_network))
+
+    def test_host_connections(self):
+        self.assertEqual(
+            [("10.0.0.1", {"physnet": "physnet1",
+                           "host_ports_mapping": {"host1": ["X1", "X2"],
+                                                  "host2": ["X3"]}}),
+             ("10.0.0.2", {"physnet": "physnet2",
+                           "host_ports_mapping": {"host1": ["X4"]}})],
+            host_mappings.get_host_connections("host1"))
+        self.assertEqual(
+            ["10.0.0.1"],
+            [ip for ip, _ in host_mappings.get_host_connections("host2")])
+        self.assertEqual([], host_mappings.get_host_connections("host3"))
+
+    def test_replace_switches(self):
+        counts = host_mappings.replace_host_mappings(
+            {("10.0.0.1", "host1"): ("X1", "physnet1"),
+             ("10.0.0.1", "host3"): ("X5", "physnet1")},
+            switch_ips=["10.0.0.1"])
+        self.assertEqual((1, 1, 1), counts)
+        self.assertEqual(
+            [("10.0.0.1", "host1", "X1", "physnet1"),
+             ("10.0.0.1", "host3", "X5", "physnet1"),
+             ("10.0.0.2", "host1", "X4", "physnet2")],
+            self._rows())
+
+    def test_sync_from_config(self):
+        cfg.CONF.set_override("cx_switches",
+                              {"10.0.0.3": {"physnet": "physnet3",
+                                            "host_ports_mapping": {
+                                                "host1": ["X9"]}}},
+                              group="ml2_aster")
+        host_mappings.sync_from_config()
+        self.assertEqual([("10.0.0.3", "host1", "X9", "physnet3")],
+                         self._rows())
+
+    def test_sync_disabled(self):
+        cfg.CONF.set_override("sync_host_mappings", False, group="aster_db")
+        cfg.CONF.set_override("cx_switches", {}, group="ml2_aster")
+        host_mappings.sync_from_config()
+        self.assertEqual(3, len(self._rows()))
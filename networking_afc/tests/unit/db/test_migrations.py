@@ -0,0 +1,49 @@
+import importlib
+
+from alembic import migration
+from alembic import operations
+import six
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from sqlalchemy import schema
+
+from neutron.tests import base
+
+from networking_afc.db.models import aster_models_v2
+
+
+VERSIONS = 'networking_afc.db.migration.alembic_migrations.versions.pike.'
+ROUTER_ID_INDEXES = importlib.import_module(
+    VERSIONS + 'expand.9e4b1c7a2d6f_add_allocation_router_id_indexes')
+
+FREE_INDEXES = {
+    'ix_ml2_aster_l3_vni_allocations_free':
+        aster_models_v2.AsterL3VNIAllocation,
+    'ix_ml2_leaf_l2_vni_allocations_free':
+        aster_models_v2.AsterL2VNIAllocation,
+}
+
+
+class AllocationIndexesTestCase(base.BaseTestCase):
+
+    def _upgrade_sql(self, dialect_name):
+        output = six.StringIO()
+        context = migration.MigrationContext.configure(
+            dialect_name=dialect_name,
+            opts={'as_sql': True, 'output_buffer': output})
+        with operations.Operations.context(context):
+            ROUTER_ID_INDEXES.upgrade()
+        return output.getvalue()
+
+    def _model_sql(self, dialect, name):
+        index = next(index for index in
+                     FREE_INDEXES[name].__table__.indexes
+                     if index.name == name)
+        return str(schema.CreateIndex(index).compile(dialect=dialect))
+
+    def test_free_indexes_match_models(self):
+        for dialect_name, dialect in (('mysql', mysql.dialect()),
+                                      ('postgresql', postgresql.dialect())):
+            upgrade_sql = self._upgrade_sql(dialect_name)
+            for name in FREE_INDEXES:
+                self.assertIn(self._model_sql(dialect, name), upgrade_sql)
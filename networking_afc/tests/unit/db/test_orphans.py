@@ -0,0 +1,122 @@
+import mock
+from neutron.db.models import l3 as l3_models
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+
+from networking_afc.common import metrics
+from networking_afc.common import range_set
+from networking_afc.db import free_ranges
+from networking_afc.db import orphans
+from networking_afc.db import pool_stats
+from networking_afc.db import prefetch
+from networking_afc.db.models import aster_models_v2
+
+
+class OrphansTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(OrphansTestCase, self).setUp()
+        self.model = aster_models_v2.AsterL3VNIAllocation
+        self.session = lib_db_api.get_writer_session()
+        with self.session.begin():
+            self.session.add(l3_models.Router(
+                id="router-a", name="a", project_id="project",
+                status="ACTIVE", admin_state_up=True))
+            self.session.execute(self.model.__table__.insert(), [
+                {'l3_vni': 100, 'router_id': "router-a"},
+                {'l3_vni': 101, 'router_id': "deleted-1"},
+                {'l3_vni': 102, 'router_id': ""},
+                {'l3_vni': 103, 'router_id': prefetch.lease_marker("x")},
+                {'l3_vni': 104, 'router_id': "deleted-2"},
+                {'l3_vni': 200, 'router_id': "deleted-3"}])
+            pool_stats.recount(self.session, "l3_vni", [(100, 104)],
+                               [100, 101, 103, 104, 200])
+        self.id_set = range_set.RangeSet([(100, 104)])
+
+    def _rows(self):
+        return dict(self.session.query(self.model.l3_vni,
+                                       self.model.router_id))
+
+    def test_find_orphans(self):
+        self.assertEqual(
+            [(101, "deleted-1"), (104, "deleted-2"), (200, "deleted-3")],
+            orphans.find_orphans(self.session, self.model,
+                                 self.model.l3_vni))
+        self.assertEqual(
+            [(104, "deleted-2")],
+            orphans.find_orphans(self.session, self.model,
+                                 self.model.l3_vni, after=101, limit=1))
+
+    def test_sweep_in_chunks(self):
+        reclaimed = metrics.ORPHANS_RECLAIMED.value("l3_vni",
+                                                    orphans.REMOVED)
+        released, removed = orphans.sweep(
+            "l3_vni", self.model, self.model.l3_vni, self.id_set,
+            batch_size=1)
+        self.assertEqual(([101, 104], [200]), (released, removed))
+        self.assertEqual({100: "router-a", 101: "", 102: "",
+                          103: prefetch.lease_marker("x"), 104: ""},
+                         self._rows())
+        stats = pool_stats.get_stats(self.session, pool="l3_vni")[0]
+        self.assertEqual(2, stats['allocated'])
+        self.assertEqual(0, stats['outside_allocated'])
+        self.assertEqual(
+            reclaimed + 1,
+            metrics.ORPHANS_RECLAIMED.value("l3_vni", orphans.REMOVED))
+
+    def test_reallocated_row_is_left_alone(self):
+        found = orphans.find_orphans(self.session, self.model,
+                                     self.model.l3_vni)
+        with self.session.begin():
+            self.session.query(self.model).filter_by(l3_vni=101).update(
+                {'router_id': "router-a"})
+        with mock.patch.object(orphans, "find_orphans",
+                               side_effect=[found, []]):
+            released, removed = orphans.sweep(
+                "l3_vni", self.model, self.model.l3_vni, self.id_set)
+        self.assertEqual(([104], [200]), (released, removed))
+        self.assertEqual("router-a", self._rows()[101])
+
+    def test_ranges_mode(self):
+        cfg.CONF.set_override("vni_pool_storage", free_ranges.RANGES,
+                              group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "vni_pool_storage",
+                        group="aster_db")
+        orphans.sweep("l3_vni", self.model, self.model.l3_vni, self.id_set,
+                      free_pool=free_ranges.POOL_L3_VNI)
+        self.assertEqual({100: "router-a", 102: "",
+                          103: prefetch.lease_marker("x")}, self._rows())
+        self.assertEqual(
+            [(101, 101), (104, 104)],
+            free_ranges.load_intervals(self.session,
+                                       free_ranges.POOL_L3_VNI))
+
+    def test_filters(self):
+        model = aster_models_v2.AsterLeafVlanAllocation
+        with self.session.begin():
+            self.session.execute(model.__table__.insert(), [
+                {'switch_ip': "10.0.0.1", 'vlan_id': 10,
+                 'router_id': "deleted-1"},
+                {'switch_ip': "10.0.0.2", 'vlan_id': 10,
+                 'router_id': "deleted-1"}])
+        released, _ = orphans.sweep(
+            "border_vlan:10.0.0.1", model, model.vlan_id,
+            range_set.RangeSet([(2, 4094)]), switch_ip="10.0.0.1")
+        self.assertEqual([10], released)
+        self.assertEqual(
+            [("10.0.0.1", ""), ("10.0.0.2", "deleted-1")],
+            sorted(self.session.query(model.switch_ip, model.router_id)))
+
+    def test_sweeper_goes_on_after_a_failure(self):
+        failing = mock.Mock(side_effect=RuntimeError())
+        sweeper = orphans.OrphanSweeper(
+            [failing, mock.Mock(return_value=2)])
+        self.assertEqual(2, sweeper.sweep())
+        self.assertTrue(failing.called)
+
+    def test_disabled(self):
+        cfg.CONF.set_override("orphan_sweep_interval", 0, group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "orphan_sweep_interval",
+                        group="aster_db")
+        self.assertIsNone(orphans.start([mock.Mock()]))
@@ -0,0 +1,76 @@
+import six
+
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+
+from networking_afc.cmd import pool_stats as pool_stats_cmd
+from networking_afc.db import allocator
+from networking_afc.db import pool_stats
+from networking_afc.db.models import aster_models_v2
+
+
+class PoolStatsTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(PoolStatsTestCase, self).setUp()
+        self.session = lib_db_api.get_writer_session()
+
+    def _stats(self, pool="l3_vni"):
+        stats = pool_stats.get_stats(self.session, pool=pool)
+        return stats[0] if stats else None
+
+    def test_recount(self):
+        with self.session.begin():
+            pool_stats.recount(self.session, "l3_vni", [(100, 109)],
+                               [100, 101, 5000])
+        self.assertEqual({'pool': "l3_vni", 'total': 10, 'allocated': 2,
+                          'free': 8, 'outside_allocated': 1},
+                         self._stats())
+        self.assertEqual(pool_stats.SHARDS, self.session.query(
+            aster_models_v2.AsterPoolCounter).count())
+
+    def test_adjust_sums_shards(self):
+        with self.session.begin():
+            pool_stats.recount(self.session, "l3_vni", [(100, 109)], [])
+        for _ in range(20):
+            with self.session.begin():
+                pool_stats.adjust(self.session, "l3_vni", allocated=1)
+        with self.session.begin():
+            pool_stats.adjust(self.session, "l3_vni", allocated=-3,
+                              outside=2)
+        stats = self._stats()
+        self.assertEqual(17, stats['allocated'])
+        self.assertEqual(0, stats['free'])
+        self.assertEqual(2, stats['outside_allocated'])
+
+    def test_adjust_before_recount(self):
+        with self.session.begin():
+            pool_stats.adjust(self.session, "l3_vni", allocated=1)
+        self.assertIsNone(self._stats())
+
+    def test_rolled_back_allocation_is_not_counted(self):
+        model = aster_models_v2.AsterL3VNIAllocation
+        with self.session.begin():
+            self.session.execute(model.__table__.insert(), [
+                {'l3_vni': 100, 'router_id': ""}])
+            pool_stats.recount(self.session, "l3_vni", [(100, 100)], [])
+        pool = allocator.router_pool("l3_vni", model, model.l3_vni)
+        try:
+            with self.session.begin():
+                self.assertEqual(100, pool.allocate(self.session,
+                                                    "router-a"))
+                self.assertEqual(1, self._stats()['allocated'])
+                raise RuntimeError()
+        except RuntimeError:
+            pass
+        self.assertEqual(0, self._stats()['allocated'])
+
+    def test_print_stats(self):
+        out = six.StringIO()
+        low = pool_stats_cmd.print_stats(
+            [{'pool': "l2_vni", 'total': 100, 'allocated': 50, 'free': 50,
+              'outside_allocated': 0},
+             {'pool': "l3_vni", 'total': 100, 'allocated': 95, 'free': 5,
+              'outside_allocated': 1}], min_free_percent=10, out=out)
+        self.assertEqual(["l3_vni"], low)
+        self.assertIn("l3_vni\t100\t95\t5\t1\n", out.getvalue())
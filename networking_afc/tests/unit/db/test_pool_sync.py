@@ -0,0 +1,103 @@
+import datetime
+
+import mock
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+from oslo_utils import timeutils
+
+from networking_afc.db import pool_stats
+from networking_afc.db import pool_sync
+from networking_afc.db.models import aster_models_v2
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions as ex
+
+
+class PoolSyncTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(PoolSyncTestCase, self).setUp()
+        self.digest = pool_sync.config_digest(([(100, 200)], "rows"))
+        self.sync_func = mock.Mock()
+
+    def _row(self):
+        session = lib_db_api.get_reader_session()
+        return session.query(aster_models_v2.AsterPoolSync).filter_by(
+            pool="l3_vni").one()
+
+    def test_config_digest(self):
+        self.assertEqual(self.digest,
+                         pool_sync.config_digest([[[100, 200]], "rows"]))
+        self.assertNotEqual(self.digest,
+                            pool_sync.config_digest(([(100, 200)], "ranges")))
+
+    def test_synchronize_once_per_config(self):
+        sync = pool_sync.PoolSync("l3_vni", self.digest, self.sync_func)
+        sync.synchronize()
+        self.assertEqual(self.digest, self._row().config_digest)
+        self.assertIsNone(self._row().owner)
+
+        # Another worker started with the same configuration
+        pool_sync.PoolSync("l3_vni", self.digest,
+                           self.sync_func).synchronize()
+        self.assertEqual(1, self.sync_func.call_count)
+
+        changed = pool_sync.config_digest(([(100, 300)], "rows"))
+        pool_sync.PoolSync("l3_vni", changed, self.sync_func).synchronize()
+        self.assertEqual(2, self.sync_func.call_count)
+
+    def test_missing_counters_are_recounted(self):
+        session = lib_db_api.get_writer_session()
+
+        def recount():
+            with session.begin():
+                pool_stats.recount(session, "l3_vni", [(100, 200)], [])
+
+        self.sync_func.side_effect = recount
+        for _ in range(2):
+            pool_sync.PoolSync("l3_vni", self.digest, self.sync_func,
+                               ["l3_vni"]).synchronize()
+        self.assertEqual(1, self.sync_func.call_count)
+        # Lost, or synchronized before the counters existed
+        with session.begin():
+            session.query(aster_models_v2.AsterPoolCounter).delete()
+        pool_sync.PoolSync("l3_vni", self.digest, self.sync_func,
+                           ["l3_vni"]).synchronize()
+        self.assertEqual(2, self.sync_func.call_count)
+        self.assertEqual([], pool_stats.missing_pools(session, ["l3_vni"]))
+
+    def test_lease_is_exclusive(self):
+        self.assertEqual(pool_sync.ACQUIRED, pool_sync.try_acquire(
+            "l3_vni", self.digest, "worker-1", 60))
+        self.assertEqual(pool_sync.BUSY, pool_sync.try_acquire(
+            "l3_vni", self.digest, "worker-2", 60))
+        pool_sync.release("l3_vni", "worker-1", self.digest)
+        self.assertEqual(pool_sync.SYNCED, pool_sync.try_acquire(
+            "l3_vni", self.digest, "worker-2", 60))
+
+    def test_expired_lease_is_taken_over(self):
+        pool_sync.try_acquire("l3_vni", self.digest, "worker-1", 60)
+        later = timeutils.utcnow() + datetime.timedelta(seconds=61)
+        with mock.patch.object(timeutils, "utcnow", return_value=later):
+            self.assertEqual(pool_sync.ACQUIRED, pool_sync.try_acquire(
+                "l3_vni", self.digest, "worker-2", 60))
+        self.assertEqual("worker-2", self._row().owner)
+
+    def test_failed_sync_releases_lease(self):
+        self.sync_func.side_effect = RuntimeError()
+        sync = pool_sync.PoolSync("l3_vni", self.digest, self.sync_func)
+        self.assertRaises(RuntimeError, sync.synchronize)
+        self.assertIsNone(self._row().owner)
+        self.assertIsNone(self._row().config_digest)
+
+    def test_start_sets_ready(self):
+        sync = pool_sync.start("l3_vni", ([(100, 200)], "rows"),
+                               self.sync_func)
+        sync.wait()
+        self.assertTrue(sync.ready)
+        self.sync_func.assert_called_once_with()
+
+    def test_wait_timeout(self):
+        sync = pool_sync.PoolSync("l3_vni", self.digest, self.sync_func)
+        with mock.patch.object(sync._ready, "wait",
+                               return_value=False) as wait:
+            self.assertRaises(ex.PoolSyncTimeout, sync.wait)
+        wait.assert_called_once_with(60)
@@ -0,0 +1,208 @@
+import importlib
+
+from alembic import migration
+from alembic import operations
+import six
+import sqlalchemy as sa
+from sqlalchemy import exc as sa_exc
+
+from neutron.tests import base
+from oslo_config import cfg
+
+from networking_afc.cmd import migrate_port_bindings
+from networking_afc.db.migration import port_binding_data
+
+
+VERSIONS = 'networking_afc.db.migration.alembic_migrations.versions.pike.'
+EXPAND = importlib.import_module(
+    VERSIONS + 'expand.5c2f7d9e1a3b_add_port_binding_indexes')
+CONTRACT = importlib.import_module(
+    VERSIONS + 'contract.7f3a9c1d2e85_normalize_port_bindings')
+
+
+def _legacy_metadata():
+    # The tables as they are before the contract migration
+    metadata = sa.MetaData()
+    sa.Table('aster_ml2_port_bindings', metadata,
+             sa.Column('binding_id', sa.Integer, primary_key=True),
+             sa.Column('switch_ip', sa.String(36), nullable=False,
+                       server_default=''),
+             sa.Column('vlan_id', sa.String(36), nullable=False,
+                       server_default=''),
+             sa.Column('l2_vni', sa.Integer, nullable=False),
+             sa.Column('is_config_l2', sa.Boolean, nullable=False,
+                       server_default=sa.sql.false()),
+             sa.Column('subnet_id', sa.String(36), nullable=False),
+             sa.Column('router_id', sa.String(36), nullable=False,
+                       server_default=''),
+             sa.Column('l3_vni', sa.Integer, nullable=False,
+                       server_default='0'))
+    sa.Table('aster_ml2_cx_host_interface_mappings', metadata,
+             sa.Column('id', sa.Integer, primary_key=True),
+             sa.Column('switch_ip', sa.String(255)),
+             sa.Column('physical_network', sa.String(255)))
+    sa.Table('networksegments', metadata,
+             sa.Column('id', sa.Integer, primary_key=True),
+             sa.Column('network_id', sa.String(36)),
+             sa.Column('network_type', sa.String(32)),
+             sa.Column('physical_network', sa.String(64)),
+             sa.Column('segmentation_id', sa.Integer))
+    sa.Table('subnets', metadata,
+             sa.Column('id', sa.String(36), primary_key=True),
+             sa.Column('network_id', sa.String(36)))
+    return metadata
+
+
+class LegacyBindingsTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(LegacyBindingsTestCase, self).setUp()
+        self.engine = sa.create_engine('sqlite://')
+        metadata = _legacy_metadata()
+        metadata.create_all(self.engine)
+        tables = metadata.tables
+        with self.engine.begin() as connection:
+            connection.execute(
+                tables['aster_ml2_cx_host_interface_mappings'].insert(),
+                [{'switch_ip': '10.0.0.1', 'physical_network': 'physnet1'}])
+            connection.execute(tables['networksegments'].insert(), [
+                {'network_id': 'net1', 'network_type': 'vlan',
+                 'physical_network': 'physnet1', 'segmentation_id': 105},
+                {'network_id': 'net1', 'network_type': 'aster_vxlan',
+                 'physical_network': None, 'segmentation_id': 10008},
+                {'network_id': 'net2', 'network_type': 'vlan',
+                 'physical_network': 'physnet1', 'segmentation_id': 106},
+                {'network_id': 'net2', 'network_type': 'aster_vxlan',
+                 'physical_network': None, 'segmentation_id': 10009}])
+            connection.execute(tables['subnets'].insert(), [
+                {'id': 'sub1', 'network_id': 'net1'},
+                {'id': 'sub2', 'network_id': 'net2'}])
+            connection.execute(
+                tables['aster_ml2_port_bindings'].insert(), [
+                    # Legacy, resolved through net1
+                    {'binding_id': 1, 'switch_ip': '10.0.0.1',
+                     'vlan_id': ' 105', 'l2_vni': 0, 'subnet_id': ''},
+                    # Legacy, sub2 is bound again by row 5
+                    {'binding_id': 2, 'switch_ip': '10.0.0.1',
+                     'vlan_id': '106', 'l2_vni': 0, 'subnet_id': ''},
+                    # Legacy on an unknown switch
+                    {'binding_id': 3, 'switch_ip': '10.0.0.9',
+                     'vlan_id': '107', 'l2_vni': 0, 'subnet_id': ''},
+                    {'binding_id': 4, 'switch_ip': '10.0.0.1',
+                     'vlan_id': 'x', 'l2_vni': 0, 'subnet_id': ''},
+                    {'binding_id': 5, 'switch_ip': '10.0.0.1',
+                     'vlan_id': '106', 'l2_vni': 10009,
+                     'subnet_id': 'sub2'}])
+
+    def _bindings(self):
+        table = port_binding_data.bindings
+        with self.engine.connect() as connection:
+            return [tuple(row) for row in connection.execute(
+                sa.select([table.c.binding_id, table.c.vlan_id,
+                           table.c.l2_vni, table.c.subnet_id]).
+                order_by(table.c.binding_id))]
+
+
+class PortBindingDataTestCase(LegacyBindingsTestCase):
+
+    def test_migrate_batches(self):
+        with self.engine.begin() as connection:
+            result = port_binding_data.migrate_batch(connection,
+                                                     batch_size=3)
+            self.assertEqual((3, 3, 1, 1, 1, []), result)
+            result = port_binding_data.migrate_batch(connection, 3)
+            self.assertEqual((5, 2, 0, 0, 0, [4]), result)
+            self.assertIsNone(port_binding_data.migrate_batch(connection,
+                                                              5))
+        self.assertEqual([(1, '105', 10008, 'sub1'),
+                          (3, '107', 0, ''),
+                          (4, 'x', 0, ''),
+                          (5, '106', 10009, 'sub2')],
+                         self._bindings())
+
+    def test_migrate_is_resumable(self):
+        out = six.StringIO()
+        invalid = migrate_port_bindings.migrate(self.engine, 2, 0,
+                                                after_id=2, out=out)
+        self.assertEqual([4], invalid)
+        self.assertIn("3/3 rows scanned", out.getvalue())
+        self.assertIn("--start-after 5", out.getvalue())
+        # Rows up to the start are left for another run
+        self.assertEqual((2, '106', 0, ''), self._bindings()[1])
+        migrate_port_bindings.migrate(self.engine, 2, 0, out=out)
+        self.assertEqual([1, 3, 4, 5],
+                         [row[0] for row in self._bindings()])
+
+
+class PortBindingMigrationTestCase(LegacyBindingsTestCase):
+
+    def setUp(self):
+        super(PortBindingMigrationTestCase, self).setUp()
+        table = port_binding_data.bindings
+        with self.engine.begin() as connection:
+            # Fixed by the operator, see test_invalid_vlan_id
+            connection.execute(table.delete().where(
+                table.c.binding_id == 4))
+            connection.execute(table.insert(), [
+                # Legacy, not resolved on the same switch as row 3
+                {'binding_id': 6, 'switch_ip': '10.0.0.9',
+                 'vlan_id': '108', 'l2_vni': 0, 'subnet_id': ''},
+                # Bound concurrently with row 5
+                {'binding_id': 7, 'switch_ip': '10.0.0.1',
+                 'vlan_id': '106', 'l2_vni': 10009, 'subnet_id': 'sub2'}])
+
+    def _upgrade(self):
+        with self.engine.begin() as connection:
+            context = migration.MigrationContext.configure(connection)
+            with operations.Operations.context(context):
+                EXPAND.upgrade()
+                CONTRACT.upgrade()
+
+    def test_expand_and_contract(self):
+        self._upgrade()
+        self.assertEqual([(1, 105, 10008, 'sub1'),
+                          (3, 107, 0, None),
+                          (5, 106, 10009, 'sub2'),
+                          (6, 108, 0, None)],
+                         self._bindings())
+        with self.engine.begin() as connection:
+            self.assertRaises(
+                sa_exc.IntegrityError, connection.execute,
+                port_binding_data.bindings.insert(),
+                {'switch_ip': '10.0.0.1', 'vlan_id': 110, 'l2_vni': 10008,
+                 'subnet_id': 'sub1'})
+
+    def test_invalid_vlan_id(self):
+        table = port_binding_data.bindings
+        with self.engine.begin() as connection:
+            connection.execute(table.insert(), [
+                {'binding_id': 8, 'switch_ip': '10.0.0.1', 'vlan_id': 'x',
+                 'l2_vni': 10008, 'subnet_id': 'sub1'}])
+        ex = self.assertRaises(port_binding_data.InvalidVlanIds,
+                               self._upgrade)
+        self.assertEqual([8], ex.binding_ids)
+        # The binding is kept and the schema left unchanged
+        self.assertEqual((8, 'x', 10008, 'sub1'), self._bindings()[-1])
+
+    def _clear_host_mappings(self):
+        with self.engine.begin() as connection:
+            connection.execute(port_binding_data.host_mappings.delete())
+
+    def test_switches_from_config(self):
+        # neutron-server did not store the host mappings yet
+        self._clear_host_mappings()
+        cfg.CONF.set_override("cx_switches",
+                              {"10.0.0.1": {"physnet": "physnet1"}},
+                              group="ml2_aster")
+        self._upgrade()
+        self.assertEqual((1, 105, 10008, 'sub1'), self._bindings()[0])
+
+    def test_missing_switch_physnets(self):
+        self._clear_host_mappings()
+        self.assertRaises(port_binding_data.MissingSwitchPhysnets,
+                          self._upgrade)
+        self.assertRaises(port_binding_data.MissingSwitchPhysnets,
+                          migrate_port_bindings.migrate, self.engine, 2, 0,
+                          out=six.StringIO())
+        # Nothing was changed
+        self.assertEqual(' 105', self._bindings()[0][1])
@@ -0,0 +1,138 @@
+import datetime
+
+import mock
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+from oslo_utils import timeutils
+
+from networking_afc.db import allocator
+from networking_afc.db import free_ranges
+from networking_afc.db import prefetch
+from networking_afc.db.models import aster_models_v2
+
+
+class PrefetchTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(PrefetchTestCase, self).setUp()
+        cfg.CONF.set_override("prefetch_size", 3, group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "prefetch_size",
+                        group="aster_db")
+        self.model = aster_models_v2.AsterL3VNIAllocation
+        self.session = lib_db_api.get_writer_session()
+        with self.session.begin():
+            self.session.execute(self.model.__table__.insert(), [
+                {'l3_vni': l3_vni, 'router_id': ""}
+                for l3_vni in range(100, 105)])
+        self.pool = self._pool()
+
+    def _pool(self):
+        pool = prefetch.router_pool(
+            allocator.router_pool("l3_vni", self.model, self.model.l3_vni),
+            self.model, self.model.l3_vni)
+        self.addCleanup(pool.return_lease)
+        return pool
+
+    def _allocate(self, pool, router_id):
+        with self.session.begin():
+            return pool.allocate(self.session, router_id)
+
+    def _rows(self):
+        return dict(self.session.query(self.model.l3_vni,
+                                       self.model.router_id))
+
+    def _leases(self):
+        return self.session.query(
+            aster_models_v2.AsterAllocationLease).count()
+
+    def test_disabled_by_default(self):
+        cfg.CONF.clear_override("prefetch_size", group="aster_db")
+        pool = allocator.router_pool("l3_vni", self.model,
+                                     self.model.l3_vni)
+        self.assertIs(pool, prefetch.router_pool(pool, self.model,
+                                                 self.model.l3_vni))
+
+    def test_allocate_from_block(self):
+        self.assertEqual(100, self._allocate(self.pool, "router-a"))
+        rows = self._rows()
+        self.assertEqual("router-a", rows[100])
+        self.assertTrue(prefetch.is_lease_marker(rows[101]))
+        self.assertTrue(prefetch.is_lease_marker(rows[102]))
+        self.assertEqual("", rows[103])
+        self.assertEqual(1, self._leases())
+
+        self.assertEqual(101, self._allocate(self.pool, "router-b"))
+        self.assertEqual(102, self._allocate(self.pool, "router-c"))
+        # The block is used up
+        self.assertEqual(0, self._leases())
+        self.assertEqual(103, self._allocate(self.pool, "router-d"))
+
+    def test_blocks_of_workers_do_not_overlap(self):
+        other = self._pool()
+        self.assertEqual(100, self._allocate(self.pool, "router-a"))
+        self.assertEqual(103, self._allocate(other, "router-b"))
+        self.assertEqual(101, self._allocate(self.pool, "router-c"))
+        self.assertEqual(104, self._allocate(other, "router-d"))
+
+    def test_exhausted_pool_falls_back(self):
+        other = self._pool()
+        self._allocate(self.pool, "router-a")
+        self._allocate(other, "router-b")
+        self._allocate(self.pool, "router-c")
+        self._allocate(self.pool, "router-d")
+        # The free ID left is in the block of the other worker
+        self.assertIsNone(self._allocate(self.pool, "router-e"))
+        self.assertEqual(104, self._allocate(other, "router-e"))
+
+    def test_return_lease(self):
+        self._allocate(self.pool, "router-a")
+        self.pool.return_lease()
+        rows = self._rows()
+        self.assertEqual("", rows[101])
+        self.assertEqual("", rows[102])
+        self.assertEqual(0, self._leases())
+        self.assertEqual(101, self._allocate(self.pool, "router-b"))
+
+    def test_expired_lease_is_recovered(self):
+        self._allocate(self.pool, "router-a")
+        other = self._pool()
+        later = timeutils.utcnow() + datetime.timedelta(
+            seconds=cfg.CONF.aster_db.prefetch_lease + 1)
+        with mock.patch.object(timeutils, "utcnow", return_value=later):
+            with self.session.begin():
+                self.assertEqual(2, other.recover_expired(self.session))
+            self.assertEqual(0, self._leases())
+            self.assertEqual("", self._rows()[101])
+            # The worker of the expired lease reserves a new block
+            self.assertEqual(103, self._allocate(self.pool, "router-b"))
+        # The new block took 103, 104 and the recovered 101
+        self.assertTrue(prefetch.is_lease_marker(self._rows()[101]))
+        self.assertEqual(102, self._allocate(other, "router-c"))
+
+    def test_recovered_id_is_skipped(self):
+        self._allocate(self.pool, "router-a")
+        with self.session.begin():
+            self.session.query(self.model).filter_by(l3_vni=101).update(
+                {"router_id": "router-x"})
+        self.assertEqual(102, self._allocate(self.pool, "router-b"))
+
+    def test_ranges_mode(self):
+        cfg.CONF.set_override("vni_pool_storage", free_ranges.RANGES,
+                              group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "vni_pool_storage",
+                        group="aster_db")
+        free_ranges.sync_pool(free_ranges.POOL_L3_VNI, self.model.l3_vni,
+                              self.model.router_id == "", [(100, 104)])
+        pool = prefetch.router_pool(
+            free_ranges.router_pool(free_ranges.POOL_L3_VNI, self.model,
+                                    self.model.l3_vni),
+            self.model, self.model.l3_vni,
+            free_pool=free_ranges.POOL_L3_VNI)
+        self.assertEqual(100, self._allocate(pool, "router-a"))
+        self.assertEqual([(103, 104)], free_ranges.load_intervals(
+            self.session, free_ranges.POOL_L3_VNI))
+        pool.return_lease()
+        self.assertEqual([(101, 104)], free_ranges.load_intervals(
+            self.session, free_ranges.POOL_L3_VNI))
+        self.assertEqual({100: "router-a"}, self._rows())
@@ -0,0 +1,152 @@
+import datetime
+
+import mock
+
+from neutron.tests.unit import testlib_api
+from neutron_lib.db import api as lib_db_api
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+import sqlalchemy as sa
+
+from networking_afc.db import replica
+from networking_afc.db.models import aster_models_v2
+
+
+class ReplicaTestCase(testlib_api.SqlTestCase):
+
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp()
+        cfg.CONF.set_override("replica_reads", True, group="aster_db")
+        self.now = 1000.0
+        mock.patch.object(replica, "_clock", lambda: self.now).start()
+        mock.patch.object(replica, "_local", replica.threading.local()
+                          ).start()
+        mock.patch.object(replica, "_replica_down_until", [0]).start()
+        mock.patch.object(replica, "_lag_check",
+                          {"checked_at": None, "lag_ok": None}).start()
+        self.sessionmaker = mock.patch.object(
+            replica, "_sessionmaker", wraps=replica._sessionmaker).start()
+
+    def _reads_replica(self):
+        # Whether the last session returned was bound to the replica
+        return self.sessionmaker.call_args == mock.call(use_slave=True)
+
+
+class ReplicaRoutingTestCase(ReplicaTestCase):
+
+    def setUp(self):
+        super(ReplicaRoutingTestCase, self).setUp()
+        cfg.CONF.set_override("replica_max_lag", 0, group="aster_db")
+
+    def test_replica_session(self):
+        session = replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+        facade = lib_db_api.get_context_manager().get_legacy_facade()
+        self.assertIs(facade.get_engine(use_slave=True), session.bind)
+        with session.begin():
+            self.assertEqual(0, session.query(
+                aster_models_v2.AsterCxHostMapping).count())
+
+    def test_disabled(self):
+        cfg.CONF.set_override("replica_reads", False, group="aster_db")
+        replica.get_reader_session()
+        self.assertFalse(self.sessionmaker.called)
+
+    def test_reads_after_write_use_primary(self):
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+        replica.record_write()
+        self.now += 4.9
+        replica.get_reader_session()
+        self.assertFalse(self._reads_replica())
+        self.now += 0.1
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+
+    def test_fallback_to_primary(self):
+        used_replica = []
+
+        @replica.replica_fallback
+        def lookup():
+            replica.get_reader_session()
+            used_replica.append(self._reads_replica())
+            if used_replica[-1]:
+                raise db_exc.DBConnectionError()
+            return "result"
+
+        self.assertEqual("result", lookup())
+        self.assertEqual([True, False], used_replica)
+        # The replica is skipped until the retry interval passed
+        replica.get_reader_session()
+        self.assertFalse(self._reads_replica())
+        self.now += 30
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+
+    def test_primary_errors_are_raised(self):
+        cfg.CONF.set_override("replica_reads", False, group="aster_db")
+        lookup = mock.Mock(side_effect=db_exc.DBConnectionError())
+        self.assertRaises(db_exc.DBConnectionError,
+                          replica.replica_fallback(lookup))
+        self.assertEqual(1, lookup.call_count)
+
+
+class ReplicaLagTestCase(ReplicaTestCase):
+
+    def setUp(self):
+        super(ReplicaLagTestCase, self).setUp()
+        self.measure = mock.patch.object(
+            replica, "_measure_lag", wraps=replica._measure_lag).start()
+
+    def _beat_at(self):
+        session = lib_db_api.get_reader_session()
+        return session.query(aster_models_v2.AsterReplicaHeartbeat).one(
+            ).beat_at
+
+    def test_primary_until_heartbeat_replicated(self):
+        replica.get_reader_session()
+        self.assertFalse(self._reads_replica())
+        self.assertIsNotNone(self._beat_at())
+        # The verdict is kept until the next check
+        replica.get_reader_session()
+        self.assertFalse(self._reads_replica())
+        self.assertEqual(1, self.measure.call_count)
+        self.now += 2
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+        self.assertEqual(2, self.measure.call_count)
+
+    def test_lagging_replica(self):
+        replica.get_reader_session()
+        self.now += 2
+        # The replica still misses the heartbeat written 10 seconds ago
+        real_read = replica._read_heartbeat
+
+        def read_heartbeat(session, *columns):
+            now = real_read(session, sa.func.now())[1]
+            if not columns:
+                return (now - datetime.timedelta(seconds=20),)
+            return (now - datetime.timedelta(seconds=10), now)
+
+        with mock.patch.object(replica, "_read_heartbeat",
+                               side_effect=read_heartbeat):
+            replica.get_reader_session()
+            self.assertFalse(self._reads_replica())
+            self.assertGreaterEqual(replica._measure_lag(), 10)
+        self.now += 2
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+
+    def test_unreachable_replica(self):
+        replica.get_reader_session()
+        self.now += 2
+        with mock.patch.object(replica, "_read_heartbeat",
+                               side_effect=db_exc.DBConnectionError()):
+            replica.get_reader_session()
+        self.assertFalse(self._reads_replica())
+
+    def test_check_disabled(self):
+        cfg.CONF.set_override("replica_max_lag", 0, group="aster_db")
+        replica.get_reader_session()
+        self.assertTrue(self._reads_replica())
+        self.assertFalse(self.measure.called)
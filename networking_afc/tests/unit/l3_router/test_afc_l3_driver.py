@@ -4,6 +4,7 @@ from oslo_config import cfg
 from neutron._i18n import _
 from neutron.tests.unit import testlib_api
 from neutron_lib.db import api as db_api
+from networking_afc.common import api as afc_api
 from networking_afc.db.models import aster_models_v2
 from networking_afc.l3_router import afc_l3_driver
 
@@ -13,6 +14,10 @@ class AfcL3DriverTestCase(testlib_api.SqlTestCase):
     def setUp(self):
         super(AfcL3DriverTestCase, self).setUp()
         self.driver = afc_l3_driver.AFCL3Driver()
+        for manager in (self.driver.l3_vni_manager,
+                        self.driver.l2_vni_manager,
+                        self.driver.border_vlan_manager):
+            manager.pool_sync.wait()
         if not cfg.CONF.ml2_aster:
             ml2_aster_test_opts = [
                 cfg.StrOpt('border_switches',
@@ -104,3 +109,22 @@ class AfcL3DriverTestCase(testlib_api.SqlTestCase):
         self.assertTrue(mock_sub_3.called)
         self.assertTrue(mock_api.called)
         self.assertTrue(mock_alloc_seg.called)
+
+    def test_add_interface_to_router_queued_by_project(self):
+        params = {
+            "id": "fake_id",
+            "project_id": "fake_project",
+            "switch_ip": "10.0.0.1",
+            "l3_vni": 10000,
+            "seg_id": 888,
+            "vlan_id": 105,
+            "gip": "10.10.10.1",
+            "cidr": "10.10.10.0/24"
+        }
+        cfg.CONF.set_override("is_send_afc", True, group="aster_authtoken")
+        scheduler = mock.Mock()
+        with mock.patch.object(afc_api.scheduler, "get_scheduler",
+                               return_value=scheduler):
+            afc_l3_driver.add_interface_to_router(add_vrf_params=params)
+        self.assertEqual("fake_project",
+                         scheduler.submit.call_args[1]["tenant_id"])
@@ -29,4 +29,5 @@ class AfcBorderVlanManagerTestCase(testlib_api.SqlTestCase):
                               {"fake_switch_1": {
                                   "vlan_ranges": ['2000:2002']}},
                               group="ml2_aster")
-        border_vlan_manager.BorderVlanManager()
+        manager = border_vlan_manager.BorderVlanManager()
+        manager.pool_sync.wait()
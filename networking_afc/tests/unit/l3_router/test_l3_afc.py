@@ -1,6 +1,11 @@
-
+import mock
 from neutron.tests import base
+from neutron_lib import exceptions as n_exc
+
+from networking_afc.db import pool_stats
 from networking_afc.l3_router import l3_afc
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 
 
 class TestAFCL3TestCase(base.BaseTestCase):
@@ -8,3 +13,36 @@ class TestAFCL3TestCase(base.BaseTestCase):
     def setUp(self):
         super(TestAFCL3TestCase, self).setUp()
         self.l3_plugin = l3_afc.AsterL3ServicePlugin()
+
+
+class TestAsterPoolsTestCase(base.BaseTestCase):
+
+    def setUp(self):
+        super(TestAsterPoolsTestCase, self).setUp()
+        with mock.patch.object(l3_afc.afc_l3_driver, "AFCL3Driver"):
+            self.l3_plugin = l3_afc.AsterL3ServicePlugin()
+        self.context = mock.Mock(is_admin=True)
+        get_stats = mock.patch.object(pool_stats, "get_stats").start()
+        get_stats.side_effect = lambda session, pool=None: [
+            {'pool': name, 'total': 10, 'allocated': 4, 'free': 6,
+             'outside_allocated': 0}
+            for name in ("l2_vni", "l3_vni") if pool in (None, name)]
+        self.addCleanup(mock.patch.stopall)
+
+    def test_get_aster_pools(self):
+        pools = self.l3_plugin.get_aster_pools(
+            self.context, filters={'id': ["l3_vni"]}, fields=['id', 'free'])
+        self.assertEqual([{'id': "l3_vni", 'free': 6}], pools)
+
+    def test_get_aster_pool(self):
+        pool = self.l3_plugin.get_aster_pool(self.context, "l2_vni")
+        self.assertEqual("l2_vni", pool['id'])
+        self.assertEqual(4, pool['allocated'])
+        self.assertRaises(ex.AllocationPoolNotFound,
+                          self.l3_plugin.get_aster_pool, self.context,
+                          "aster_vxlan")
+
+    def test_admin_only(self):
+        self.context.is_admin = False
+        self.assertRaises(n_exc.AdminRequired,
+                          self.l3_plugin.get_aster_pools, self.context)
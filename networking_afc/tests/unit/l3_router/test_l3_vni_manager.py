@@ -4,6 +4,8 @@ from neutron.tests.unit import testlib_api
 from neutron_lib.db import api as db_api
 from networking_afc.l3_router import l3_vni_manager
 from networking_afc.db.models import aster_models_v2
+from networking_afc.ml2_drivers.mech_aster.mech_driver import exceptions \
+    as ex
 
 
 class AfcL2VniManagerTestCase(testlib_api.SqlTestCase):
@@ -11,6 +13,7 @@ class AfcL2VniManagerTestCase(testlib_api.SqlTestCase):
     def setUp(self):
         super(AfcL2VniManagerTestCase, self).setUp()
         self.manager = l3_vni_manager.L3VniManager()
+        self.manager.pool_sync.wait()
 
     def _create_record(self, l3_vni):
         session = db_api.get_writer_session()
@@ -31,7 +34,8 @@ class AfcL2VniManagerTestCase(testlib_api.SqlTestCase):
         return result
 
     def test_allocation_l3_vni_with_no_db(self):
-        self.assertRaises(Exception, self.manager.allocation_l3_vni, "test_id")
+        self.assertRaises(ex.AllocationPoolExhausted,
+                          self.manager.allocation_l3_vni, "test_id")
         # db_record = self._get_record(router_id="")
 
     def test_allocation_l3_vni_with_normal_db(self):
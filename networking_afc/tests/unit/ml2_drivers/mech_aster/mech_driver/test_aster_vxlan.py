@@ -14,13 +14,20 @@
 #    under the License.
 
 import mock
+import sqlalchemy as sa
 
 from oslo_config import cfg
+from neutron_lib.api.definitions import provider_net as pnet
+from neutron_lib.callbacks import events
+from neutron_lib.callbacks import resources
 from neutron_lib import context
 from neutron_lib.plugins.ml2 import api
 from neutron.tests.unit import testlib_api
 from neutron_lib import exceptions as exc
 from neutron_lib.db import api as lib_db_api
+from networking_afc.db import free_ranges
+from networking_afc.db import pool_stats
+from networking_afc.db.models import aster_models_v2
 from networking_afc.ml2_drivers.mech_aster.mech_driver import type_aster_vxlan
 
 
@@ -175,3 +182,141 @@ class AsterVxlanTypeDBTest(AsterVxlanBaseTest):
 
     def test_sync_allocations_and_allocated_in_final_range(self):
         self._test_sync_allocations_and_allocated(TUN_MAX + 2)
+
+
+class AsterVxlanBulkTest(AsterVxlanBaseTest):
+    STORAGE = free_ranges.ROWS
+
+    def setUp(self):
+        super(AsterVxlanBulkTest, self).setUp()
+        cfg.CONF.set_override("vni_pool_storage", self.STORAGE,
+                              group="aster_db")
+        self.addCleanup(cfg.CONF.clear_override, "vni_pool_storage",
+                        group="aster_db")
+        self.driver._pool = free_ranges.flag_pool(
+            free_ranges.POOL_VXLAN, aster_models_v2.AsterVxlanAllocation,
+            aster_models_v2.AsterVxlanAllocation.vxlan_vni)
+        self.driver.tunnel_ranges = [(TUN_MIN, TUN_MAX)]
+        self.driver.sync_allocations()
+
+    def _allocated(self):
+        model = aster_models_v2.AsterVxlanAllocation
+        return sorted(vni for vni, in self.context.session.query(
+            model.vxlan_vni).filter_by(allocated=True))
+
+    def _stats(self):
+        return pool_stats.get_stats(self.context.session,
+                                    pool=free_ranges.POOL_VXLAN)[0]
+
+    def _announce(self, network):
+        self.driver._count_tenant_network(
+            resources.NETWORK, events.BEFORE_CREATE, None,
+            context=self.context, network=network)
+
+    def test_allocate_and_release_segments(self):
+        segments = self.driver.allocate_tenant_segments(self.context, 3)
+        self.assertEqual([TUN_MIN, TUN_MIN + 1, TUN_MIN + 2],
+                         [s[api.SEGMENTATION_ID] for s in segments])
+        self.assertEqual(3, self._stats()['allocated'])
+        self.driver.release_segments(self.context, segments[:2])
+        self.assertEqual([TUN_MIN + 2], self._allocated())
+        self.assertEqual(1, self._stats()['allocated'])
+        self.assertEqual(
+            TUN_MIN,
+            self.driver.allocate_tenant_segment(
+                self.context)[api.SEGMENTATION_ID])
+
+    def test_allocate_segments_exhausted(self):
+        segments = self.driver.allocate_tenant_segments(self.context, 12)
+        self.assertEqual(TUN_MAX - TUN_MIN + 1, len(segments))
+
+    def test_release_segments_outside_pool(self):
+        outside = {api.NETWORK_TYPE: self.TYPE,
+                   api.PHYSICAL_NETWORK: None,
+                   api.SEGMENTATION_ID: TUN_MAX + 100}
+        self.driver.reserve_provider_segment(self.context, outside)
+        self.assertEqual(1, self._stats()['outside_allocated'])
+        self.driver.release_segments(
+            self.context, [outside, self.driver._segment(TUN_MIN)])
+        self.assertEqual([], self._allocated())
+        self.assertEqual(0, self._stats()['outside_allocated'])
+
+    def test_bulk_request(self):
+        for _ in range(3):
+            self._announce({'name': "net"})
+        self._announce({pnet.NETWORK_TYPE: self.TYPE})
+        with self.context.session.begin():
+            segments = [self.driver.allocate_tenant_segment(self.context)
+                        for _ in range(2)]
+        self.assertEqual([TUN_MIN, TUN_MIN + 1],
+                         [s[api.SEGMENTATION_ID] for s in segments])
+        # The vni of the third network was released at commit
+        self.assertEqual([TUN_MIN, TUN_MIN + 1], self._allocated())
+        self.assertEqual(2, self._stats()['allocated'])
+        self.assertEqual(
+            TUN_MIN + 2,
+            self.driver.allocate_tenant_segment(
+                self.context)[api.SEGMENTATION_ID])
+
+    def test_bulk_request_rolled_back(self):
+        for _ in range(2):
+            self._announce({'name': "net"})
+
+        def create_networks():
+            with self.context.session.begin():
+                self.driver.allocate_tenant_segment(self.context)
+                raise RuntimeError()
+
+        self.assertRaises(RuntimeError, create_networks)
+        self.assertEqual([], self._allocated())
+        self.assertEqual(
+            TUN_MIN,
+            self.driver.allocate_tenant_segment(
+                self.context)[api.SEGMENTATION_ID])
+
+    def test_bulk_request_commit_fails(self):
+        for _ in range(3):
+            self._announce({'name': "net"})
+        session = self.context.session
+
+        def fail(session):
+            raise RuntimeError()
+
+        def create_networks():
+            with session.begin():
+                self.driver.allocate_tenant_segment(self.context)
+                sa.event.listen(session, "before_commit", fail)
+
+        self.assertRaises(RuntimeError, create_networks)
+        sa.event.remove(session, "before_commit", fail)
+        self.assertEqual([], self._allocated())
+        self.assertEqual(
+            [TUN_MIN, TUN_MIN + 1, TUN_MIN + 2],
+            [s[api.SEGMENTATION_ID] for s in
+             self.driver.allocate_tenant_segments(self.context, 3)])
+
+    def test_bulk_request_listeners_removed(self):
+        session = self.context.session
+
+        def listeners():
+            return [len(getattr(session.dispatch, name)) for name in (
+                "before_commit", "after_commit", "after_transaction_end")]
+
+        def create_networks():
+            for _ in range(2):
+                self._announce({'name': "net"})
+            with session.begin():
+                self.driver.allocate_tenant_segment(self.context)
+                self.driver.allocate_tenant_segment(self.context)
+
+        before = listeners()
+        create_networks()
+        after = listeners()
+        self.assertEqual(before[:2], after[:2])
+        create_networks()
+        self.assertEqual(after, listeners())
+        self.assertNotIn(type_aster_vxlan.BULK_ALLOCATIONS, session.info)
+
+
+class AsterVxlanBulkRangesTest(AsterVxlanBulkTest):
+    STORAGE = free_ranges.RANGES
@@ -15,11 +15,15 @@
 import copy
 import mock
 
+import sqlalchemy as sa
+from sqlalchemy import orm
 from oslo_config import cfg
+from oslo_db import exception as db_exc
 from neutron_lib.plugins.ml2 import api
 from neutron_lib.db import api as db_api
 from neutron.tests.unit import testlib_api
 from neutron_lib.api.definitions import portbindings
+from networking_afc.db import host_mappings
 from networking_afc.db.models import aster_models_v2
 
 from networking_afc.ml2_drivers.mech_aster.mech_driver import mech_aster
@@ -130,6 +134,7 @@ class AsterCXSwitchBaseTestCase(AsterCXSwitchMechanismBaseTestCase):
             "cx_switches",
             fake_switch_info,
             group="ml2_aster")
+        host_mappings.sync_from_config()
 
 
 class AsterCXSwitchDbTestCase(AsterCXSwitchBaseTestCase):
@@ -536,3 +541,171 @@ class AsterCXSwitchCommitAPITestCase(AsterCXSwitchMechanismBaseTestCase):
 
     def setUp(self):
         super(AsterCXSwitchCommitAPITestCase, self).setUp()
+
+
+class AsterCXSwitchPortEventTestCase(AsterCXSwitchDbTestCase):
+
+    vlan_seg = {
+        api.SEGMENTATION_ID: 105,
+        api.NETWORK_TYPE: 'vlan',
+        api.PHYSICAL_NETWORK: 'fake_phy_net_1',
+        api.NETWORK_ID: 'fake_network_id'}
+    vxlan_seg = {
+        api.SEGMENTATION_ID: 10008,
+        api.NETWORK_TYPE: 'aster_vxlan',
+        api.PHYSICAL_NETWORK: None,
+        api.NETWORK_ID: 'fake_network_id'}
+    router_interface_path = ("networking_afc.common.utils."
+                             "get_router_interface_by_subnet_id")
+    get_ports_path = ("networking_afc.common.utils."
+                      "get_ports_by_subnet")
+
+    def setUp(self):
+        super(AsterCXSwitchPortEventTestCase, self).setUp()
+        self._set_up_fixture()
+        mock.patch(self.mock_sub_path,
+                   return_value={"subnet_id": "test_id",
+                                 "gw_and_mask": "10.0.0.1/24"}).start()
+        mock.patch(self.router_interface_path, return_value=None).start()
+        self.send_config = mock.Mock()
+        self.delete_config = mock.Mock()
+        self.driver.afc_api.send_config_to_afc = self.send_config
+        self.driver.afc_api.delete_config_from_afc = self.delete_config
+        self.port = self.context.current
+
+    def _bind(self, switch_ip, is_config_l2=False):
+        session = db_api.get_writer_session()
+        with session.begin():
+            session.add(aster_models_v2.AsterPortBinding(
+                switch_ip=switch_ip, vlan_id=105, l2_vni=10008,
+                subnet_id="test_id", is_config_l2=is_config_l2))
+
+    def _bindings(self):
+        return dict((binding.switch_ip, binding.is_config_l2)
+                    for binding in self._get_record(subnet_id="test_id"))
+
+    def _track(self, session):
+        # Statements sent to the database and sessions opening a
+        # transaction while the driver handles a port event
+        statements = []
+        sessions = set()
+
+        def count_statement(conn, cursor, statement, *args):
+            # Leave out the pings and transaction control of the connection
+            if statement != "SELECT 1" and statement.split()[0] in (
+                    "SELECT", "INSERT", "UPDATE", "DELETE"):
+                statements.append(statement)
+
+        def count_session(begun_session, transaction, connection):
+            sessions.add(begun_session)
+
+        engine = session.get_bind()
+        sa.event.listen(engine, "before_cursor_execute", count_statement)
+        sa.event.listen(orm.Session, "after_begin", count_session)
+        self.addCleanup(sa.event.remove, engine, "before_cursor_execute",
+                        count_statement)
+        self.addCleanup(sa.event.remove, orm.Session, "after_begin",
+                        count_session)
+        return statements, sessions
+
+    def test_port_event_statements(self):
+        session = db_api.get_writer_session()
+        statements, sessions = self._track(session)
+        with session.begin():
+            self.driver._configure_physical_switch_db(
+                self.port, vxlan_segment=self.vxlan_seg,
+                vlan_segment=self.vlan_seg, session=session)
+        # Host connections, bound switches and one insert per switch
+        self.assertEqual(4, len(statements))
+        self.assertEqual({session}, sessions)
+
+        del statements[:]
+        self.driver._configure_physical_switch(
+            self.port, vxlan_segment=self.vxlan_seg,
+            vlan_segment=self.vlan_seg, session=session)
+        # Host connections, unconfigured switches and one update
+        self.assertEqual(3, len(statements))
+        self.assertEqual(2, self.send_config.call_count)
+        self.assertEqual({session}, sessions)
+
+        del statements[:]
+        self.driver._delete_physical_switch_config(
+            self.port, vxlan_segment=self.vxlan_seg,
+            vlan_segment=self.vlan_seg, session=session)
+        # Host connections, bound switches, the ports of the subnet on
+        # the hosts of each switch and one delete
+        self.assertEqual(5, len(statements))
+        self.assertEqual(2, self.delete_config.call_count)
+        self.assertEqual({session}, sessions)
+        self.assertEqual({}, self._bindings())
+
+    def test_configure_fails_partway(self):
+        self._bind("fake_switch_1")
+        self._bind("fake_switch_4")
+        self.send_config.side_effect = [None, RuntimeError()]
+        self.assertRaises(RuntimeError,
+                          self.driver._configure_physical_switch,
+                          self.port, vxlan_segment=self.vxlan_seg,
+                          vlan_segment=self.vlan_seg)
+        # The switch configured before the failure is recorded, the other
+        # one is configured again on the next port event
+        self.assertEqual({"fake_switch_1": True, "fake_switch_4": False},
+                         self._bindings())
+        self.send_config.side_effect = None
+        self.send_config.reset_mock()
+        self.driver._configure_physical_switch(
+            self.port, vxlan_segment=self.vxlan_seg,
+            vlan_segment=self.vlan_seg)
+        self.assertEqual(
+            ["fake_switch_4"],
+            [call[0][0]["switch_ip"]
+             for call in self.send_config.call_args_list])
+        self.assertEqual({"fake_switch_1": True, "fake_switch_4": True},
+                         self._bindings())
+
+    def test_configure_db_duplicate_binding(self):
+        session = db_api.get_writer_session()
+        add = session.add
+
+        def add_concurrently(binding):
+            # Another port of the subnet binds the switch once the bound
+            # switches are read
+            if binding.switch_ip == "fake_switch_1":
+                self._bind("fake_switch_1")
+            add(binding)
+
+        with mock.patch.object(session, "add", side_effect=add_concurrently):
+            self.assertRaises(db_exc.DBDuplicateEntry,
+                              self.driver._configure_physical_switch_db,
+                              self.port, vxlan_segment=self.vxlan_seg,
+                              vlan_segment=self.vlan_seg, session=session)
+        session.rollback()
+        self.assertEqual({"fake_switch_1": False}, self._bindings())
+
+    def test_delete_keeps_shared_vlan(self):
+        # fake_switch_1 is also connected to fake_host_2, which still has
+        # a port of the subnet
+        cfg.CONF.set_override("cx_switches", {
+            "fake_switch_1": {
+                "host_ports_mapping": {"fake_host_1": ["Y25"],
+                                       "fake_host_2": ["Y26"]},
+                "physnet": "fake_phy_net_1"},
+            "fake_switch_4": {
+                "host_ports_mapping": {"fake_host_1": ["Y35"]},
+                "physnet": "fake_phy_net_1"}}, group="ml2_aster")
+        host_mappings.sync_from_config()
+        self._bind("fake_switch_1", is_config_l2=True)
+        self._bind("fake_switch_4", is_config_l2=True)
+
+        def get_ports(subnet_id=None, host_ids=None, session=None):
+            return ["port_on_host_2"] if "fake_host_2" in host_ids else []
+
+        with mock.patch(self.get_ports_path, side_effect=get_ports):
+            self.driver._delete_physical_switch_config(
+                self.port, vxlan_segment=self.vxlan_seg,
+                vlan_segment=self.vlan_seg)
+        self.assertEqual(
+            ["fake_switch_4"],
+            [call[0][0]["switch_ip"]
+             for call in self.delete_config.call_args_list])
+        self.assertEqual({"fake_switch_1": True}, self._bindings())
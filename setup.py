@@ -1,6 +1,12 @@
 from setuptools import setup, find_packages
 
 _entry_points = {
+    'console_scripts': [
+        'neutron-afc-host-mappings = networking_afc.cmd.host_mappings:main',
+        'neutron-afc-migrate-port-bindings = '
+        'networking_afc.cmd.migrate_port_bindings:main',
+        'neutron-afc-pool-stats = networking_afc.cmd.pool_stats:main'
+    ],
     'neutron.db.alembic_migrations': [
         'networking_afc = networking_afc.db.migration:alembic_migrations'
     ],